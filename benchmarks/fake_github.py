@@ -0,0 +1,167 @@
+"""
+Local stand-in for the parts of the GitHub API the review engine calls:
+installation tokens, the PR snapshot GraphQL query, PR files, commits,
+compare, review comments and reviews.
+
+PRs are registered by the load generator before their webhook is sent, and
+every comment-bearing POST is timestamped so the harness can tell when a
+PR's review landed.
+"""
+import hashlib, time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+FILES_PER_PAGE = 100
+LINES_PER_HUNK = 12
+
+
+@dataclass
+class FakePR:
+    repo: str
+    number: int
+    files: int
+    hunks_per_file: int
+    head_sha: str = ""
+    base_sha: str = ""
+    posted_at: list = field(default_factory=list)
+    comments: int = 0
+
+    def __post_init__(self):
+        digest = hashlib.sha1(f"{self.repo}#{self.number}".encode()).hexdigest()
+        self.head_sha = self.head_sha or digest
+        self.base_sha = self.base_sha or digest[::-1]
+
+    def path(self, i: int) -> str:
+        return f"src/module_{i}.py"
+
+    def patch(self, i: int) -> str:
+        """A unique patch per PR and file, so the engine's hunk cache never hits."""
+        hunks = []
+        for h in range(self.hunks_per_file):
+            start = 1 + h * (LINES_PER_HUNK + 20)
+            lines = [f"+value_{self.head_sha[:8]}_{i}_{h}_{n} = compute({n})" for n in range(LINES_PER_HUNK)]
+            hunks.append(f"@@ -{start},0 +{start},{LINES_PER_HUNK} @@\n" + "\n".join(lines))
+        return "\n".join(hunks)
+
+    def file_entry(self, i: int) -> dict:
+        return {
+            "filename": self.path(i),
+            "status": "modified",
+            "additions": LINES_PER_HUNK * self.hunks_per_file,
+            "deletions": 0,
+            "patch": self.patch(i),
+        }
+
+
+class FakeGitHub:
+    """In-memory state shared by the fake API and the harness."""
+
+    def __init__(self):
+        self.prs: dict[tuple[str, int], FakePR] = {}
+        self.requests: dict[str, int] = {}
+
+    def add_pr(self, pr: FakePR):
+        self.prs[(pr.repo, pr.number)] = pr
+
+    def get_pr(self, owner: str, name: str, number) -> FakePR | None:
+        return self.prs.get((f"{owner}/{name}", int(number)))
+
+    def count(self, route: str):
+        self.requests[route] = self.requests.get(route, 0) + 1
+
+    def record_post(self, pr: FakePR, comments: int):
+        pr.posted_at.append(time.time())
+        pr.comments += comments
+
+
+def create_app(state: FakeGitHub) -> FastAPI:
+    app = FastAPI()
+
+    def not_found():
+        return JSONResponse(status_code=404, content={"message": "Not Found"})
+
+    @app.post("/app/installations/{installation_id}/access_tokens")
+    async def access_token(installation_id: int):
+        state.count("access_tokens")
+        expires = datetime.now(timezone.utc) + timedelta(hours=1)
+        return JSONResponse(
+            status_code=201,
+            content={"token": f"fake-token-{installation_id}", "expires_at": expires.strftime("%Y-%m-%dT%H:%M:%SZ")},
+        )
+
+    @app.post("/graphql")
+    async def graphql(request: Request):
+        state.count("graphql")
+        variables = (await request.json()).get("variables") or {}
+        pr = state.get_pr(variables.get("owner"), variables.get("name"), variables.get("number", 0))
+        if pr is None:
+            return {"data": {"repository": {"pullRequest": None}}}
+
+        offset = int(variables.get("cursor") or 0)
+        end = min(offset + FILES_PER_PAGE, pr.files)
+        nodes = [
+            {"path": pr.path(i), "additions": LINES_PER_HUNK * pr.hunks_per_file, "deletions": 0, "changeType": "MODIFIED"}
+            for i in range(offset, end)
+        ]
+        return {"data": {"repository": {"pullRequest": {
+            "id": f"PR_{pr.number}",
+            "title": f"Benchmark PR {pr.number}",
+            "url": f"https://github.test/{pr.repo}/pull/{pr.number}",
+            "headRefOid": pr.head_sha,
+            "baseRefOid": pr.base_sha,
+            "changedFiles": pr.files,
+            "files": {"pageInfo": {"hasNextPage": end < pr.files, "endCursor": str(end)}, "nodes": nodes},
+        }}}}
+
+    @app.get("/repos/{owner}/{name}/pulls/{number}/files")
+    async def pr_files(owner: str, name: str, number: int, request: Request, page: int = 1, per_page: int = 30):
+        state.count("files")
+        pr = state.get_pr(owner, name, number)
+        if pr is None:
+            return not_found()
+        last = max((pr.files + per_page - 1) // per_page, 1)
+        start = (page - 1) * per_page
+        files = [pr.file_entry(i) for i in range(start, min(start + per_page, pr.files))]
+        headers = {}
+        if last > 1:
+            base = str(request.url).split("?")[0]
+            headers["Link"] = f'<{base}?per_page={per_page}&page={last}>; rel="last"'
+        return JSONResponse(content=files, headers=headers)
+
+    @app.get("/repos/{owner}/{name}/pulls/{number}/commits")
+    async def pr_commits(owner: str, name: str, number: int):
+        state.count("commits")
+        pr = state.get_pr(owner, name, number)
+        if pr is None:
+            return not_found()
+        return [{"sha": pr.base_sha}, {"sha": pr.head_sha}]
+
+    @app.get("/repos/{owner}/{name}/compare/{spec}")
+    async def compare(owner: str, name: str, spec: str):
+        # Benchmark PRs are only ever opened, so there is nothing to compare
+        state.count("compare")
+        return not_found()
+
+    @app.post("/repos/{owner}/{name}/pulls/{number}/reviews")
+    async def create_review(owner: str, name: str, number: int, request: Request):
+        state.count("reviews")
+        pr = state.get_pr(owner, name, number)
+        if pr is None:
+            return not_found()
+        review = await request.json()
+        state.record_post(pr, len(review.get("comments") or []))
+        return {"id": len(pr.posted_at), "state": "COMMENTED"}
+
+    @app.post("/repos/{owner}/{name}/pulls/{number}/comments")
+    async def create_comment(owner: str, name: str, number: int):
+        state.count("comments")
+        pr = state.get_pr(owner, name, number)
+        if pr is None:
+            return not_found()
+        state.record_post(pr, 1)
+        return JSONResponse(status_code=201, content={"id": pr.comments})
+
+    return app
@@ -0,0 +1,100 @@
+"""
+Local stand-in for the chat-completions endpoint, with configurable latency
+and response size. Comments point at real files and lines from the prompt so
+they survive the engine's parsing and posting like model output would.
+"""
+import asyncio, json, random, re
+from dataclasses import dataclass
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+FILE_LINE = re.compile(r"^File: (.+)$", re.MULTILINE)
+HUNK_START = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)", re.MULTILINE)
+
+
+@dataclass
+class ModelProfile:
+    latency: float = 2.0          # seconds per completion
+    jitter: float = 0.5           # +/- uniform jitter, seconds
+    comments_per_file: int = 1
+    comment_chars: int = 200
+    first_token: float = 0.1      # fraction of latency before a stream starts
+    chunk_chars: int = 64         # content per streamed event
+
+
+def fake_review(prompt: str, profile: ModelProfile) -> str:
+    """Build a JSON array of comments for the files named in a review prompt."""
+    comments = []
+    sections = FILE_LINE.split(prompt)
+    # split() alternates: preamble, path, body, path, body, ...
+    for path, body in zip(sections[1::2], sections[2::2]):
+        start = HUNK_START.search(body)
+        line = int(start.group(1)) if start else 1
+        for n in range(profile.comments_per_file):
+            text = f"Consider naming and error handling here ({n}). "
+            comments.append({
+                "file": path.strip(),
+                "comment": (text * (profile.comment_chars // len(text) + 1))[: profile.comment_chars],
+                "line_number": line + n,
+            })
+    return json.dumps(comments)
+
+
+async def stream_events(state, request_id: str, content: str, delay: float):
+    """Server-sent events spreading the content over the completion time."""
+    profile = state.profile
+    pieces = [content[i:i + profile.chunk_chars] for i in range(0, len(content), profile.chunk_chars)] or [""]
+    state.in_flight += 1
+    state.peak_in_flight = max(state.peak_in_flight, state.in_flight)
+    try:
+        await asyncio.sleep(delay * profile.first_token)
+        gap = delay * (1 - profile.first_token) / len(pieces)
+        for piece in pieces:
+            event = {"id": request_id, "choices": [{"index": 0, "delta": {"content": piece}}]}
+            yield f"data: {json.dumps(event)}\n\n"
+            await asyncio.sleep(gap)
+        yield "data: [DONE]\n\n"
+    finally:
+        state.in_flight -= 1
+
+
+class FakeModels:
+    def __init__(self, profile: ModelProfile):
+        self.profile = profile
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+
+def create_app(state: FakeModels) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/{path:path}")
+    async def chat_completions(path: str, request: Request):
+        body = await request.json()
+        prompt = body["messages"][-1]["content"]
+        profile = state.profile
+
+        state.requests += 1
+        request_id = f"bench-{state.requests}"
+        content = fake_review(prompt, profile)
+        delay = max(profile.latency + random.uniform(-profile.jitter, profile.jitter), 0)
+
+        if body.get("stream"):
+            return StreamingResponse(stream_events(state, request_id, content, delay), media_type="text/event-stream")
+
+        state.in_flight += 1
+        state.peak_in_flight = max(state.peak_in_flight, state.in_flight)
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            state.in_flight -= 1
+
+        return {
+            "id": request_id,
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}}],
+        }
+
+    return app
@@ -0,0 +1,105 @@
+"""
+Open-loop load generator: registers PRs with the fake GitHub API and sends
+signed `pull_request` webhooks to the listener at a fixed rate, drawing PR
+sizes from a weighted mix.
+"""
+import asyncio, hashlib, hmac, json, random, time, uuid
+
+import httpx
+
+from benchmarks.fake_github import FakeGitHub, FakePR
+
+# name -> (changed files, hunks per file)
+PR_SIZES = {
+    "small": (2, 1),
+    "medium": (10, 3),
+    "large": (60, 4),
+    "huge": (250, 2),
+}
+
+
+def parse_mix(spec: str) -> list[tuple[str, float]]:
+    """Parse "small=0.6,medium=0.3,large=0.1" into (size, weight) pairs."""
+    mix = []
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in PR_SIZES:
+            raise ValueError(f"Unknown PR size {name!r}, expected one of {', '.join(PR_SIZES)}")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+def sign(secret: str, body: bytes) -> str:
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def webhook_body(pr: FakePR, installation_id: int) -> bytes:
+    return json.dumps({
+        "action": "opened",
+        "number": pr.number,
+        "pull_request": {"number": pr.number, "head": {"sha": pr.head_sha}},
+        "repository": {"full_name": pr.repo},
+        "installation": {"id": installation_id},
+    }).encode()
+
+
+async def generate_load(
+    listener_url: str,
+    secret: str,
+    github: FakeGitHub,
+    rate: float,
+    count: int,
+    mix: list[tuple[str, float]],
+    installations: int = 1,
+    run_id: str | None = None,
+    seed: int | None = None,
+) -> dict:
+    """
+    Send `count` webhooks at `rate` per second. Returns when every request has
+    been answered, with the send time and listener response per PR.
+    """
+    rng = random.Random(seed)
+    run_id = run_id or uuid.uuid4().hex[:8]
+    names, weights = zip(*mix)
+    sent: dict[tuple[str, int], dict] = {}
+
+    async with httpx.AsyncClient(timeout=30) as client:
+
+        async def send(pr: FakePR, installation_id: int):
+            body = webhook_body(pr, installation_id)
+            record = sent[(pr.repo, pr.number)] = {
+                "sent_at": time.time(), "size": pr.files, "installation_id": installation_id,
+            }
+            try:
+                resp = await client.post(
+                    f"{listener_url}/webhook",
+                    content=body,
+                    headers={
+                        "Content-Type": "application/json",
+                        "X-GitHub-Event": "pull_request",
+                        "X-GitHub-Delivery": str(uuid.uuid4()),
+                        "X-Hub-Signature-256": sign(secret, body),
+                    },
+                )
+                record["status"] = resp.status_code
+            except httpx.HTTPError as e:
+                record["status"] = f"error: {e}"
+            record["acked_at"] = time.time()
+
+        tasks = []
+        started = time.monotonic()
+        for i in range(count):
+            # Open loop: keep the schedule even if the listener slows down
+            delay = started + i / rate - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            files, hunks = PR_SIZES[rng.choices(names, weights)[0]]
+            installation_id = 1 + i % installations
+            pr = FakePR(repo=f"bench-{run_id}-{installation_id}/repo", number=i + 1, files=files, hunks_per_file=hunks)
+            github.add_pr(pr)
+            tasks.append(asyncio.create_task(send(pr, installation_id)))
+
+        await asyncio.gather(*tasks)
+    return sent
@@ -0,0 +1,279 @@
+"""
+End-to-end load benchmark for the webhook listener and review engine.
+
+Starts the fake GitHub API and fake model server in this process, runs the
+real listener and engine as subprocesses pointed at them, drives signed
+webhooks through the listener and reports sustained throughput, webhook to
+last comment latency, and the engine's peak memory.
+
+Needs a Redis server; use a database nothing else writes to:
+
+    python -m benchmarks.run --redis-url redis://localhost:6379/15 --rate 2 --count 100
+"""
+import argparse, asyncio, json, os, subprocess, sys, tempfile, time, uuid
+from pathlib import Path
+
+import httpx
+import uvicorn
+from redis.asyncio import from_url
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from benchmarks import fake_github, fake_models
+from benchmarks.load import generate_load, parse_mix
+from services.review_engine.history import reviews_key, review_field
+
+ROOT = Path(__file__).resolve().parent.parent
+BENCH_SECRET = "benchmark-secret"
+
+
+def percentile(values: list[float], pct: float) -> float | None:
+    """Nearest-rank percentile."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def _private_key_pem() -> str:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+
+
+def _rss_kb(pid: int, field: str = "VmRSS") -> int | None:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+async def _sample_memory(pid: int, peak: dict, interval: float = 0.2):
+    while True:
+        rss = _rss_kb(pid)
+        if rss:
+            peak["rss_kb"] = max(peak.get("rss_kb", 0), rss)
+        await asyncio.sleep(interval)
+
+
+async def _serve(app, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    return server
+
+
+def _spawn(args: list[str], cwd: Path, env: dict, log_path: Path) -> subprocess.Popen:
+    log = open(log_path, "w")
+    return subprocess.Popen(args, cwd=cwd, env={**os.environ, **env}, stdout=log, stderr=subprocess.STDOUT)
+
+
+async def _wait_healthy(url: str, proc: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=2) as client:
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError(f"{url} exited with code {proc.returncode}")
+            try:
+                if (await client.get(f"{url}/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not become healthy within {timeout}s")
+
+
+async def _wait_reviewed(redis_url: str, expected: list, sent: dict, timeout: float) -> int:
+    """Poll the engine's review history until every expected PR is recorded."""
+    redis = from_url(redis_url, decode_responses=True)
+    pending = set(expected)
+    deadline = time.monotonic() + timeout
+    try:
+        while pending and time.monotonic() < deadline:
+            keys = sorted(pending)
+            pipe = redis.pipeline(transaction=False)
+            for repo, number in keys:
+                pipe.hexists(reviews_key(sent[(repo, number)]["installation_id"]), review_field(repo, number))
+            for key, recorded in zip(keys, await pipe.execute()):
+                if recorded:
+                    pending.discard(key)
+            await asyncio.sleep(0.5)
+    finally:
+        await redis.aclose()
+    return len(expected) - len(pending)
+
+
+def _stop(proc: subprocess.Popen):
+    if proc.poll() is None:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def summarize(sent: dict, github: fake_github.FakeGitHub, models: fake_models.FakeModels, peak: dict) -> dict:
+    latencies, first_comment, finished = [], [], []
+    for key, record in sent.items():
+        pr = github.prs.get(key)
+        if pr and pr.posted_at:
+            last = max(pr.posted_at)
+            latencies.append(last - record["sent_at"])
+            first_comment.append(min(pr.posted_at) - record["sent_at"])
+            finished.append(last)
+
+    first_sent = min((r["sent_at"] for r in sent.values()), default=None)
+    span = (max(finished) - first_sent) if finished else None
+    rejected = sum(1 for r in sent.values() if r.get("status") != 200)
+    return {
+        "sent": len(sent),
+        "rejected_webhooks": rejected,
+        "completed": len(latencies),
+        "prs_per_minute": round(len(finished) / span * 60, 2) if span else None,
+        "latency_p50_s": percentile(latencies, 50),
+        "latency_p95_s": percentile(latencies, 95),
+        "latency_p99_s": percentile(latencies, 99),
+        "first_comment_p50_s": percentile(first_comment, 50),
+        "first_comment_p95_s": percentile(first_comment, 95),
+        "comments_posted": sum(pr.comments for pr in github.prs.values()),
+        "model_requests": models.requests,
+        "model_peak_concurrency": models.peak_in_flight,
+        "github_requests": dict(github.requests),
+        "engine_peak_rss_mb": round(peak["rss_kb"] / 1024, 1) if peak.get("rss_kb") else None,
+    }
+
+
+def print_report(report: dict):
+    def fmt(value, unit=""):
+        return "n/a" if value is None else (f"{value:.2f}{unit}" if isinstance(value, float) else f"{value}{unit}")
+
+    print("\n📊 Benchmark results")
+    print(f"   PRs sent / completed:   {report['sent']} / {report['completed']} ({report['rejected_webhooks']} webhooks rejected)")
+    print(f"   Sustained throughput:   {fmt(report['prs_per_minute'])} PRs/min")
+    print(
+        f"   Webhook → last comment: p50 {fmt(report['latency_p50_s'], 's')}, "
+        f"p95 {fmt(report['latency_p95_s'], 's')}, p99 {fmt(report['latency_p99_s'], 's')}"
+    )
+    print(
+        f"   Webhook → 1st comment:  p50 {fmt(report['first_comment_p50_s'], 's')}, "
+        f"p95 {fmt(report['first_comment_p95_s'], 's')}"
+    )
+    print(f"   Comments posted:        {report['comments_posted']}")
+    print(f"   Model requests:         {report['model_requests']} (peak {report['model_peak_concurrency']} concurrent)")
+    print(f"   GitHub requests:        {report['github_requests']}")
+    print(f"   Engine peak RSS:        {fmt(report['engine_peak_rss_mb'], ' MB')}")
+
+
+async def run(args) -> dict:
+    log_dir = Path(args.log_dir or tempfile.mkdtemp(prefix="pr-review-bench-"))
+    log_dir.mkdir(parents=True, exist_ok=True)
+    github_url, models_url = f"http://127.0.0.1:{args.github_port}", f"http://127.0.0.1:{args.models_port}"
+    listener_url, engine_url = f"http://127.0.0.1:{args.listener_port}", f"http://127.0.0.1:{args.engine_port}"
+
+    github = fake_github.FakeGitHub()
+    models = fake_models.FakeModels(fake_models.ModelProfile(
+        latency=args.model_latency,
+        jitter=args.model_jitter,
+        comments_per_file=args.comments_per_file,
+        comment_chars=args.comment_chars,
+    ))
+    servers = [
+        await _serve(fake_github.create_app(github), args.github_port),
+        await _serve(fake_models.create_app(models), args.models_port),
+    ]
+
+    listener_env = {"REDIS_URL_DOCKER": args.redis_url, "GITHUB_SECRET": BENCH_SECRET, "API_URL": ""}
+    engine_env = {
+        "REDIS_URL_DOCKER": args.redis_url,
+        "GITHUB_API_URL": github_url,
+        "GITHUB_MODELS_URL": f"{models_url}/inference/chat/completions",
+        "GITHUB_APP_ID": "1",
+        "GITHUB_APP_PRIVATE_KEY": _private_key_pem(),
+        "OPENAI_API_KEY": "benchmark",
+        "HTTP2_ENABLED": "false",
+        "PYTHONPATH": str(ROOT),
+    }
+    for item in args.engine_env or []:
+        key, _, value = item.partition("=")
+        engine_env[key] = value
+
+    uvicorn_cmd = [sys.executable, "-m", "uvicorn", "--host", "127.0.0.1", "--log-level", "warning"]
+    listener = _spawn(
+        uvicorn_cmd + ["--port", str(args.listener_port), "main:app"],
+        ROOT / "services" / "webhook_listener", listener_env, log_dir / "webhook_listener.log",
+    )
+    engine = _spawn(
+        uvicorn_cmd + ["--port", str(args.engine_port), "services.review_engine.engine:app"],
+        ROOT, engine_env, log_dir / "review_engine.log",
+    )
+    peak: dict = {}
+    sampler = None
+    try:
+        await _wait_healthy(listener_url, listener)
+        await _wait_healthy(engine_url, engine)
+        sampler = asyncio.create_task(_sample_memory(engine.pid, peak))
+        print(f"🚀 Sending {args.count} webhooks at {args.rate}/s (logs in {log_dir})")
+
+        sent = await generate_load(
+            listener_url, BENCH_SECRET, github,
+            rate=args.rate, count=args.count, mix=parse_mix(args.mix),
+            installations=args.installations, run_id=uuid.uuid4().hex[:8], seed=args.seed,
+        )
+
+        # A PR is done once the engine has recorded it in the review history
+        expected = [key for key, r in sent.items() if r.get("status") == 200]
+        done = await _wait_reviewed(args.redis_url, expected, sent, args.timeout)
+        if done < len(expected):
+            print(f"⚠️ Timed out with {len(expected) - done} PR(s) still unreviewed")
+
+        hwm = _rss_kb(engine.pid, "VmHWM")
+        if hwm:
+            peak["rss_kb"] = max(peak.get("rss_kb", 0), hwm)
+        return summarize(sent, github, models, peak)
+    finally:
+        if sampler:
+            sampler.cancel()
+        _stop(engine)
+        _stop(listener)
+        for server in servers:
+            server.should_exit = True
+        await asyncio.sleep(0.2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load benchmark for the PR review pipeline")
+    parser.add_argument("--redis-url", default=os.getenv("BENCH_REDIS_URL", "redis://localhost:6379/15"))
+    parser.add_argument("--rate", type=float, default=1.0, help="Webhooks per second")
+    parser.add_argument("--count", type=int, default=50, help="Number of PRs to open")
+    parser.add_argument("--mix", default="small=0.6,medium=0.3,large=0.1", help="PR size distribution")
+    parser.add_argument("--installations", type=int, default=2)
+    parser.add_argument("--model-latency", type=float, default=2.0, help="Seconds per completion")
+    parser.add_argument("--model-jitter", type=float, default=0.5)
+    parser.add_argument("--comments-per-file", type=int, default=1)
+    parser.add_argument("--comment-chars", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds to wait for reviews after the last webhook")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--github-port", type=int, default=9101)
+    parser.add_argument("--models-port", type=int, default=9102)
+    parser.add_argument("--listener-port", type=int, default=9103)
+    parser.add_argument("--engine-port", type=int, default=9104)
+    parser.add_argument("--engine-env", action="append", metavar="KEY=VALUE", help="Extra engine setting, repeatable")
+    parser.add_argument("--log-dir", help="Where to write listener and engine logs")
+    parser.add_argument("--json", help="Also write the report to this file")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
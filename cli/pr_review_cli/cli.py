@@ -66,16 +66,24 @@ def ensure_installation_id(api_url, installation_id):
     return installation_id
 
 # --- CLI commands ---
-async def list_prs(limit: int):
+async def list_prs(limit: int, cursor=None):
     api_url, installation_id = load_config()
     installation_id = ensure_installation_id(api_url, installation_id)
 
+    params = {"installation_id": installation_id, "limit": limit, "fields": "pr_number,repo,status"}
+    if cursor:
+        params["cursor"] = cursor
+
     async with httpx.AsyncClient() as client:
-        resp = await client.get(f"{api_url}/api/prs", params={"installation_id": installation_id, "limit": limit})
-        prs = resp.json()
+        resp = await client.get(f"{api_url}/api/prs", params=params)
+        page = resp.json()
 
-        if isinstance(prs, str):
-            prs = json.loads(prs)
+        if isinstance(page, str):
+            page = json.loads(page)
+        # Older servers return a bare list
+        if isinstance(page, list):
+            page = {"items": page, "next_cursor": None}
+        prs = page.get("items", [])
 
         if not prs:
             print("⚠️ No PRs found in history.")
@@ -87,6 +95,9 @@ async def list_prs(limit: int):
                 pr = json.loads(pr)
             print(f"- #{pr['pr_number']} | {pr['repo']} | status={pr.get('status','done')}")
 
+        if page.get("next_cursor"):
+            print(f"\n👉 More PRs: pr-review list-prs --limit {limit} --cursor {page['next_cursor']}")
+
 async def show_pr(pr_number: int):
     api_url, installation_id = load_config()
     installation_id = ensure_installation_id(api_url, installation_id)
@@ -115,7 +126,40 @@ async def recheck_pr(pr_number: int):
             print(f"❌ Could not find repo for PR #{pr_number}")
             return
         data = resp.json()
-        print(f"♻️ Requeued PR #{pr_number} ({data['repo']}) for re-review.")
+        if data.get("status") == "already_queued":
+            print(f"⏳ PR #{pr_number} ({data['repo']}) is already queued for review.")
+        else:
+            print(f"♻️ Requeued PR #{pr_number} ({data['repo']}) for re-review.")
+
+async def list_dead_letters():
+    api_url, installation_id = load_config()
+    installation_id = ensure_installation_id(api_url, installation_id)
+
+    async with httpx.AsyncClient() as client:
+        resp = await client.get(f"{api_url}/api/dead-letters", params={"installation_id": installation_id})
+        entries = resp.json()
+        if not entries:
+            print("✅ No failed reviews.")
+            return
+        print(f"🪦 {len(entries)} review(s) failed for good:")
+        for entry in entries:
+            job = entry["job"]
+            print(f"- #{job['pr_number']} | {job['repo']} | {entry['error_type']} after {entry['attempts']} attempt(s): {entry['error'][:120]}")
+
+async def replay_pr(pr_number: int):
+    api_url, installation_id = load_config()
+    installation_id = ensure_installation_id(api_url, installation_id)
+
+    async with httpx.AsyncClient() as client:
+        resp = await client.post(f"{api_url}/api/dead-letters/{pr_number}/replay", params={"installation_id": installation_id})
+        if resp.status_code == 404:
+            print(f"❌ No failed review for PR #{pr_number}")
+            return
+        data = resp.json()
+        if data.get("status") == "already_queued":
+            print(f"⏳ PR #{pr_number} ({data['repo']}) is already queued; its dead letter was cleared.")
+        else:
+            print(f"♻️ Replaying PR #{pr_number} ({data['repo']}).")
 
 # --- Main CLI parser ---
 def main():
@@ -125,6 +169,7 @@ def main():
     # list-prs
     list_parser = subparsers.add_parser("list-prs")
     list_parser.add_argument("--limit", type=int, default=10)
+    list_parser.add_argument("--cursor", help="Resume from a previous listing's cursor")
 
     # show-pr
     show_parser = subparsers.add_parser("show-pr")
@@ -134,6 +179,11 @@ def main():
     recheck_parser = subparsers.add_parser("recheck-pr")
     recheck_parser.add_argument("pr_number", type=int)
 
+    # dead-letters / replay-pr
+    subparsers.add_parser("dead-letters", help="List reviews that failed after every retry")
+    replay_parser = subparsers.add_parser("replay-pr", help="Queue a failed review again")
+    replay_parser.add_argument("pr_number", type=int)
+
     # config command
     config_parser = subparsers.add_parser("config", help="View or update configuration")
     config_parser.add_argument("--set-installation-id", type=int, help="Set or update installation_id")
@@ -141,11 +191,15 @@ def main():
     args = parser.parse_args()
 
     if args.command == "list-prs":
-        asyncio.run(list_prs(args.limit))
+        asyncio.run(list_prs(args.limit, args.cursor))
     elif args.command == "show-pr":
         asyncio.run(show_pr(args.pr_number))
     elif args.command == "recheck-pr":
         asyncio.run(recheck_pr(args.pr_number))
+    elif args.command == "dead-letters":
+        asyncio.run(list_dead_letters())
+    elif args.command == "replay-pr":
+        asyncio.run(replay_pr(args.pr_number))
     elif args.command == "config":
         if args.set_installation_id:
             save_config(installation_id=args.set_installation_id)
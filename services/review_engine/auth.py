@@ -1,34 +1,60 @@
 import os
 import time
+import json
+import asyncio
+from datetime import datetime
 import jwt  # PyJWT
 import httpx
-import base64
+from cryptography.hazmat.primitives import serialization
+from services.review_engine.http_client import get_http_client, GITHUB_API_URL, HTTPStatusError
+from services.review_engine.rate_limit import rate_limiter
 
-def generate_jwt():
+# Re-sign the App JWT this many seconds before its 10 minute expiry
+APP_JWT_REFRESH_MARGIN = 60
+
+_private_key = None
+_private_key_source = None
+_app_jwt: tuple[str, float] | None = None
+_app_jwt_lock: asyncio.Lock | None = None
+
+
+def _load_private_key():
     """
-    Generate a JWT for GitHub App authentication
+    Parse GITHUB_APP_PRIVATE_KEY once into a cryptography key object
     """
-    app_id = os.getenv("GITHUB_APP_ID")
+    global _private_key, _private_key_source
     private_key_env = os.getenv("GITHUB_APP_PRIVATE_KEY")
-   
-    
-    if not app_id:
-        raise RuntimeError("Missing GITHUB_APP_ID")
-    
-    # Handle different key formats
-    private_key = None
 
-    
-    if private_key_env:
-        # Direct key with \n replacements
-        private_key = private_key_env.strip()
-    else:
+    if not private_key_env:
         raise RuntimeError("Missing GITHUB_APP_PRIVATE_KEY or GITHUB_APP_PRIVATE_KEY_B64")
-    
+
+    # Direct key with \n replacements
+    private_key = private_key_env.strip()
+    if _private_key is not None and private_key == _private_key_source:
+        return _private_key
+
     # Validate key format
     if not private_key.startswith('-----BEGIN') or not private_key.endswith('-----'):
         raise RuntimeError("Private key doesn't appear to be in PEM format")
-    
+
+    try:
+        _private_key = serialization.load_pem_private_key(private_key.encode(), password=None)
+    except Exception as e:
+        raise RuntimeError(f"Failed to load private key: {e}")
+    _private_key_source = private_key
+    return _private_key
+
+
+def _sign_app_jwt() -> tuple[str, float]:
+    """
+    Sign a new App JWT, returning it with its expiry (epoch seconds)
+    """
+    app_id = os.getenv("GITHUB_APP_ID")
+    if not app_id:
+        raise RuntimeError("Missing GITHUB_APP_ID")
+
+    private_key = _load_private_key()
+
     now = int(time.time())
     payload = {
         "iat": now - 60,          # issued at
@@ -37,30 +63,177 @@ def generate_jwt():
     }
     
     try:
-        return jwt.encode(payload, private_key, algorithm="RS256")
+        return jwt.encode(payload, private_key, algorithm="RS256"), payload["exp"]
     except Exception as e:
         raise RuntimeError(f"Failed to create JWT: {e}")
 
-async def get_installation_token(installation_id: int) -> str:
+
+def generate_jwt():
+    """
+    Generate a JWT for GitHub App authentication
+    """
+    return _sign_app_jwt()[0]
+
+
+async def get_app_jwt() -> str:
+    """
+    Return the cached App JWT, re-signing it in an executor shortly before it expires
+    """
+    global _app_jwt, _app_jwt_lock
+    if _app_jwt and _app_jwt[1] - time.time() > APP_JWT_REFRESH_MARGIN:
+        return _app_jwt[0]
+
+    if _app_jwt_lock is None:
+        _app_jwt_lock = asyncio.Lock()
+    async with _app_jwt_lock:
+        if _app_jwt and _app_jwt[1] - time.time() > APP_JWT_REFRESH_MARGIN:
+            return _app_jwt[0]
+        loop = asyncio.get_running_loop()
+        _app_jwt = await loop.run_in_executor(None, _sign_app_jwt)
+        return _app_jwt[0]
+
+async def _fetch_installation_token(installation_id, client: httpx.AsyncClient | None = None) -> tuple[str, float]:
     """
-    Exchange the App JWT for an installation token
+    Exchange the App JWT for an installation token and its expiry (epoch seconds)
     """
-    jwt_token = generate_jwt()
+    global _app_jwt
+    jwt_token = await get_app_jwt()
     
-    url = f"https://api.github.com/app/installations/{installation_id}/access_tokens"
+    url = f"{GITHUB_API_URL}/app/installations/{installation_id}/access_tokens"
     
-    async with httpx.AsyncClient() as client:
-        resp = await client.post(
-            url,
-            headers={
-                "Authorization": f"Bearer {jwt_token}",
-                "Accept": "application/vnd.github+json",
-                "X-GitHub-Api-Version": "2022-11-28"
-            }
-        )
-        
-        if resp.status_code != 201:
-            raise RuntimeError(f"Failed to get installation token: {resp.status_code} {resp.text}")
-        
-        data = resp.json()
-        return data["token"]
\ No newline at end of file
+    client = client or get_http_client()
+    resp = await client.post(
+        url,
+        headers={
+            "Authorization": f"Bearer {jwt_token}",
+            "Accept": "application/vnd.github+json",
+            "X-GitHub-Api-Version": "2022-11-28"
+        }
+    )
+
+    if resp.status_code == 401:
+        # Drop the cached App JWT so the next attempt signs a fresh one
+        _app_jwt = None
+
+    if resp.status_code != 201:
+        raise HTTPStatusError(f"Failed to get installation token: {resp.status_code} {resp.text}", resp.status_code)
+    
+    data = resp.json()
+    return data["token"], _parse_expires_at(data.get("expires_at"))
+
+
+def _parse_expires_at(value) -> float:
+    """
+    Parse GitHub's ISO 8601 `expires_at`; assume the documented 1h lifetime if absent
+    """
+    if not value:
+        return time.time() + 3600
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+class InstallationTokenCache:
+    """
+    Per-installation cache of GitHub installation tokens.
+
+    Tokens are served until `refresh_margin` seconds before they expire. Inside
+    the `refresh_ahead` window the cached token is still returned while a new one
+    is minted in the background. Concurrent misses for the same installation share
+    a single HTTP call, and when a Redis client is attached tokens are shared
+    across engine replicas.
+    """
+
+    def __init__(self, refresh_margin: int = 60, refresh_ahead: int = 300, redis=None):
+        self.refresh_margin = refresh_margin
+        self.refresh_ahead = max(refresh_ahead, refresh_margin)
+        self.redis = redis
+        self._tokens: dict[str, tuple[str, float]] = {}
+        self._inflight: dict[str, asyncio.Task] = {}
+
+    @staticmethod
+    def redis_key(installation_id) -> str:
+        return f"pr-review-token:{installation_id}"
+
+    def invalidate(self, installation_id):
+        self._tokens.pop(str(installation_id), None)
+
+    async def get(self, installation_id, force_refresh: bool = False) -> str:
+        key = str(installation_id)
+        if force_refresh:
+            self.invalidate(key)
+            if self.redis is not None:
+                await self.redis.delete(self.redis_key(key))
+        else:
+            cached = self._tokens.get(key) or await self._load_shared(key)
+            if cached:
+                token, expires_at = cached
+                remaining = expires_at - time.time()
+                if remaining > self.refresh_ahead:
+                    return token
+                if remaining > self.refresh_margin:
+                    # 🔄 Still valid: serve it and refresh ahead of expiry
+                    self._refresh(key)
+                    return token
+
+        return await asyncio.shield(self._refresh(key))
+
+    def _refresh(self, key: str) -> asyncio.Task:
+        """Start (or join) the single in-flight refresh for an installation."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._mint(key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._on_minted(key, t))
+        return task
+
+    def _on_minted(self, key: str, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if not task.cancelled() and task.exception():
+            print(f"⚠️ Token refresh failed for installation {key}: {task.exception()}")
+
+    async def _mint(self, key: str) -> str:
+        token, expires_at = await _fetch_installation_token(key)
+        self._tokens[key] = (token, expires_at)
+        await self._store_shared(key, token, expires_at)
+        return token
+
+    async def _load_shared(self, key: str):
+        if self.redis is None:
+            return None
+        try:
+            raw = await self.redis.get(self.redis_key(key))
+        except Exception as e:
+            print(f"⚠️ Could not read shared token cache: {e}")
+            return None
+        if not raw:
+            return None
+        data = json.loads(raw)
+        cached = (data["token"], float(data["expires_at"]))
+        self._tokens[key] = cached
+        return cached
+
+    async def _store_shared(self, key: str, token: str, expires_at: float):
+        if self.redis is None:
+            return
+        ttl = int(expires_at - time.time() - self.refresh_margin)
+        if ttl <= 0:
+            return
+        try:
+            await self.redis.set(
+                self.redis_key(key), json.dumps({"token": token, "expires_at": expires_at}), ex=ttl
+            )
+        except Exception as e:
+            print(f"⚠️ Could not write shared token cache: {e}")
+
+
+token_cache = InstallationTokenCache()
+
+
+async def get_installation_token(installation_id: int, force_refresh: bool = False) -> str:
+    """
+    Return a cached installation token, minting a new one when needed.
+    Pass force_refresh=True after GitHub rejected the current token with a 401.
+    """
+    token = await token_cache.get(installation_id, force_refresh=force_refresh)
+    # Lets the rate limiter charge requests to the installation's budget
+    rate_limiter.register_token(token, installation_id)
+    return token
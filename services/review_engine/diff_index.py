@@ -0,0 +1,161 @@
+import os, re
+from array import array
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+# How far (in lines) a comment may be moved to reach a line in the diff
+SNAP_DISTANCE = int(os.getenv("REVIEW_COMMENT_SNAP_DISTANCE", 3))
+
+
+class ParsedHunk:
+    """
+    One `@@` hunk, parsed once. `new_lines[i]` is the new-file line of the
+    i-th body line (0 for removed lines).
+    """
+
+    __slots__ = ("path", "header", "old_start", "new_start", "body", "new_lines")
+
+    def __init__(self, path: str, text: str):
+        self.path = path
+        header, _, body = text.partition("\n")
+        match = HUNK_HEADER.match(header)
+        if not match:
+            # Not a unified diff hunk (e.g. a bare patch): nothing is commentable
+            self.header, self.old_start, self.new_start = "", 0, 0
+            self.body = text.split("\n")
+            self.new_lines = array("I", [0] * len(self.body))
+            return
+
+        self.header = header
+        self.old_start, self.new_start = int(match.group(1)), int(match.group(3))
+        if body.endswith("\n"):
+            body = body[:-1]
+        self.body = body.split("\n") if body else []
+        self.new_lines = array("I")
+        line = self.new_start
+        for text_line in self.body:
+            marker = text_line[:1]
+            if marker == "@" and (nested := HUNK_HEADER.match(text_line)):
+                # A later hunk left in the same chunk
+                line = int(nested.group(3))
+                self.new_lines.append(0)
+            elif marker == "-" or marker == "\\":
+                self.new_lines.append(0)
+            else:
+                # Added or context line (an empty line is context with its space trimmed)
+                self.new_lines.append(line)
+                line += 1
+
+    def annotated(self) -> str:
+        """The hunk with each commentable line prefixed by its new-file line number."""
+        if not self.header:
+            return "\n".join(self.body)
+        width = len(str(max(self.new_lines, default=0)))
+        lines = [self.header]
+        for number, text_line in zip(self.new_lines, self.body):
+            prefix = str(number).rjust(width) if number else " " * width
+            lines.append(f"{prefix} {text_line}")
+        return "\n".join(lines)
+
+
+class FileDiff:
+    """Commentable new-file lines of one file, each mapped to its diff position."""
+
+    __slots__ = ("path", "positions", "first_line")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.positions: dict[int, int] = {}
+        self.first_line = None
+
+
+class DiffIndex:
+    """
+    Index of the hunks sent for review, answering in O(1) whether a comment
+    can be placed on a path and new-file line.
+
+    Diff positions count lines from the first hunk header of each file, the
+    way GitHub's legacy `position` does, assuming a file's hunks are added in
+    order.
+    """
+
+    __slots__ = ("files", "_by_name", "_next_position")
+
+    def __init__(self):
+        self.files: dict[str, FileDiff] = {}
+        self._by_name: dict[str, list[str]] = {}
+        self._next_position: dict[str, int] = {}
+
+    @classmethod
+    def from_chunks(cls, chunks) -> "DiffIndex":
+        index = cls()
+        for chunk in chunks:
+            index.add(ParsedHunk(chunk["path"], chunk["hunk"]))
+        return index
+
+    def add(self, hunk: ParsedHunk):
+        diff = self.files.get(hunk.path)
+        if diff is None:
+            diff = self.files[hunk.path] = FileDiff(hunk.path)
+            self._by_name.setdefault(hunk.path.rsplit("/", 1)[-1], []).append(hunk.path)
+            # The first hunk header is position 0; later headers take a position
+            position = 0
+        else:
+            position = self._next_position[hunk.path] + 1
+
+        for number in hunk.new_lines:
+            position += 1
+            if number:
+                diff.positions.setdefault(number, position)
+                if diff.first_line is None or number < diff.first_line:
+                    diff.first_line = number
+        self._next_position[hunk.path] = position
+
+    def position(self, path: str, line: int):
+        diff = self.files.get(path)
+        return diff.positions.get(line) if diff else None
+
+    def resolve_path(self, path):
+        """Match a model-cited path to a reviewed file, tolerating a missing directory prefix."""
+        if not path:
+            return None
+        if path in self.files:
+            return path
+        candidates = [p for p in self._by_name.get(path.rsplit("/", 1)[-1], ()) if p.endswith(path.lstrip("./"))]
+        return candidates[0] if len(candidates) == 1 else None
+
+    def snap(self, path: str, line, distance: int | None = None):
+        """Return the nearest commentable line within `distance`, or None."""
+        diff = self.files.get(path)
+        if diff is None or not isinstance(line, int):
+            return None
+        if line in diff.positions:
+            return line
+        distance = SNAP_DISTANCE if distance is None else distance
+        for offset in range(1, distance + 1):
+            for candidate in (line + offset, line - offset):
+                if candidate in diff.positions:
+                    return candidate
+        return None
+
+    def validate(self, comment: dict):
+        """
+        Return the comment pointed at a valid path and line (snapped if
+        needed), or None if it cannot be placed on the diff.
+        """
+        path = self.resolve_path(comment.get("path"))
+        if path is None:
+            return None
+        line = comment.get("line")
+        if isinstance(line, str) and line.strip().isdigit():
+            line = int(line)
+        snapped = self.snap(path, line)
+        if snapped is None:
+            return None
+        if path == comment.get("path") and snapped == comment.get("line"):
+            return comment
+        return {**comment, "path": path, "line": snapped}
+
+
+def annotate_hunk(path: str, hunk: str) -> str:
+    return ParsedHunk(path, hunk).annotated()
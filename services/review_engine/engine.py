@@ -1,18 +1,448 @@
-import json, re, os, traceback, difflib, signal, asyncio
+import json, os, time, traceback, asyncio, hashlib
 from redis.asyncio import from_url
-from gql import Client, gql
-from gql.transport.aiohttp import AIOHTTPTransport
 from fastapi import FastAPI
-import httpx
-
-from services.review_engine.functions.post_comments import post_pr_comments
-from services.review_engine.functions.generate_review import generate_review, parse_review_json
-from services.review_engine.auth import get_installation_token
+from fastapi.responses import Response
+
+from services.review_engine.functions.post_comments import post_pr_comments, CommentStreamPoster
+from services.review_engine.functions.generate_review import (
+    generate_review_comments, REVIEW_MODEL, PROMPT_VERSION, STREAMING,
+)
+from services.review_engine.functions.fetch_pr import fetch_pr_snapshot, iter_pr_hunk_pages, fetch_compare_hunks
+from services.review_engine.auth import get_installation_token, token_cache
+from services.review_engine.http_client import get_http_client, close_http_client, HTTPStatusError
+from services.review_engine.review_cache import ReviewCache
+from services.review_engine.history import record_review, import_legacy_history, last_reviewed_sha
+from services.review_engine.diff_index import DiffIndex, ParsedHunk
+from services.review_engine.review_config import load_review_config
+from services.review_engine.job_queue import JobQueue, StreamJob, installation_from_stream, WAKE_CHANNEL
+from services.review_engine.scheduler import FairScheduler
+from services.review_engine.retries import retry_or_dead_letter, clear_failures, retry_promoter
+from services.review_engine.metrics import (
+    observe_stage, observe_duration, observe_queue_wait, record_error, refresh_queue_depth, render_metrics,
+    JOBS_TOTAL, COMMENTS_TOTAL, JOBS_IN_FLIGHT,
+)
 
 app = FastAPI()
 _worker_task: asyncio.Task | None = None
+_wake_task: asyncio.Task | None = None
+_queue: JobQueue | None = None
+_pool: "JobPool | None" = None
+
+VALID_ACTIONS = ["opened", "synchronize", "reopened", "edited"]
+FILE_PAGE_CONCURRENCY = int(os.getenv("REVIEW_FILE_PAGE_CONCURRENCY", 8))
+INCREMENTAL_REVIEWS = os.getenv("REVIEW_INCREMENTAL", "true").lower() in ("1", "true", "yes")
+# Off when jobs are run by `python -m services.review_engine.worker` instead
+EMBEDDED_WORKER = os.getenv("REVIEW_EMBEDDED_WORKER", "true").lower() in ("1", "true", "yes")
+# How long a failed attempt's posted comments are remembered for its retries
+POSTED_COMMENTS_TTL = int(os.getenv("REVIEW_POSTED_COMMENTS_TTL", 7 * 24 * 3600))
+
+
+def posted_comments_key(installation_id, pr_field: str, head_sha: str) -> str:
+    """Fingerprints of the comments already posted on a PR at a head SHA."""
+    return f"pr-review-posted:{installation_id}:{pr_field}@{head_sha}"
 
-async def review_worker():
+
+def comment_fingerprint(comment: dict) -> str:
+    text = json.dumps([comment.get("path"), comment.get("line"), comment.get("body")])
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def _env_int(name: str, default: int) -> int:
+    """
+    Read a positive integer setting from the environment, falling back to default
+    """
+    try:
+        value = int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        print(f"⚠️ Invalid {name}, using {default}")
+        return default
+    return max(value, 1)
+
+
+def _review_cache(redis):
+    if os.getenv("REVIEW_CACHE_ENABLED", "true").lower() not in ("1", "true", "yes"):
+        return None
+    return ReviewCache(redis, REVIEW_MODEL, PROMPT_VERSION)
+
+
+async def process_job(redis, job: dict):
+    """
+    Run a single review job: fetch the PR, generate the review, post comments
+    and record the result in the installation's history.
+    """
+    action = job.get("action", "").lower().strip()
+    if action not in VALID_ACTIONS:
+        JOBS_TOTAL.labels("ignored").inc()
+        return
+
+    repo, pr_number = job["repo"], job["pr_number"]
+    owner, name = repo.split("/")
+
+    installation_id = job.get("installation_id")
+    if not installation_id:
+        print("❌ No installation_id in job payload")
+        return
+
+    # === fetch fresh GitHub installation token ===
+    with observe_stage("token"):
+        github_token = await get_installation_token(installation_id)
+
+    # === PR snapshot: metadata, head/base SHA and file list in one query ===
+    client = get_http_client()
+    try:
+        with observe_stage("snapshot"):
+            snapshot = await fetch_pr_snapshot(owner, name, pr_number, github_token, client=client)
+    except HTTPStatusError as e:
+        if e.status_code == 401:
+            print("⚠️ GitHub token expired, refreshing...")
+            with observe_stage("token"):
+                github_token = await get_installation_token(installation_id, force_refresh=True)
+            with observe_stage("snapshot"):
+                snapshot = await fetch_pr_snapshot(owner, name, pr_number, github_token, client=client)
+        else:
+            raise
+
+    pr_title = snapshot.title
+    pr_url = snapshot.url
+
+    # === review config: which files are worth sending to the model ===
+    with observe_stage("config"):
+        review_config = await load_review_config(owner, name, snapshot.head_sha, github_token, client=client)
+    # The snapshot holds the first page of files, judged in PR order; files
+    # on later pages are judged as their page arrives
+    selection = review_config.selection()
+    for f in snapshot.files:
+        selection.add(f["path"], f.get("additions"), f.get("deletions"))
+    skipped = selection.skipped
+
+    def accept(f):
+        name = f["filename"]
+        reason = selection.add(name, f.get("additions"), f.get("deletions")) or review_config.file_reason(f)
+        if reason:
+            skipped[name] = reason
+            return False
+        return True
+
+    # === incremental review: only what changed since the last reviewed head ===
+    pr_field = f"{repo}#{pr_number}"
+    chunks, incremental = None, False
+    if action == "synchronize" and INCREMENTAL_REVIEWS:
+        last_sha = await last_reviewed_sha(redis, installation_id, pr_field)
+        if last_sha == snapshot.head_sha:
+            print(f"⏭️ PR #{pr_number} already reviewed at {last_sha[:7]}, skipping")
+            JOBS_TOTAL.labels("skipped").inc()
+            return
+        if last_sha:
+            with observe_stage("files"):
+                chunks = await fetch_compare_hunks(
+                    owner, name, last_sha, snapshot.head_sha, github_token, client=client, accept=accept
+                )
+            if chunks is None:
+                print(f"⚠️ {last_sha[:7]} is not an ancestor of the new head, reviewing full PR")
+            else:
+                incremental = True
+                print(f"🔁 Incremental review of {len(chunks)} hunk(s) since {last_sha[:7]}")
+
+    # === patches via REST (GraphQL does not expose diff text) ===
+    # Comments citing a line outside the diff would be rejected with a 422:
+    # each page is indexed before it is reviewed, so its comments can be moved
+    # to the nearest line in the diff, or dropped.
+    diff = DiffIndex()
+
+    async def refresh_token():
+        nonlocal github_token
+        print("⚠️ REST token expired, refreshing...")
+        with observe_stage("token"):
+            github_token = await get_installation_token(installation_id, force_refresh=True)
+        return github_token
+
+    def indexed(page):
+        for chunk in page:
+            diff.add(ParsedHunk(chunk["path"], chunk["hunk"]))
+        return page
+
+    async def hunk_pages():
+        if chunks is not None:
+            yield indexed(chunks)
+            return
+        pages = iter_pr_hunk_pages(
+            owner, name, pr_number, github_token, client=client,
+            max_concurrency=FILE_PAGE_CONCURRENCY, accept=accept, refresh_token=refresh_token,
+        )
+        # "files" is the time spent waiting on pages, not the review running meanwhile
+        waited, started = 0.0, time.monotonic()
+        try:
+            async for page in pages:
+                waited += time.monotonic() - started
+                yield indexed(page)
+                started = time.monotonic()
+        finally:
+            observe_duration("files", waited)
+
+    # A retried job must not post again what an earlier attempt already posted
+    # (cached shards replay the same comments)
+    posted_key = posted_comments_key(installation_id, pr_field, snapshot.head_sha)
+    already_posted = await redis.smembers(posted_key)
+    duplicates = []
+
+    async def remember_posted(comment):
+        try:
+            pipe = redis.pipeline(transaction=False)
+            pipe.sadd(posted_key, comment_fingerprint(comment))
+            pipe.expire(posted_key, POSTED_COMMENTS_TTL)
+            await pipe.execute()
+        except Exception as e:
+            print(f"⚠️ Could not record posted comment: {e}")
+
+    def is_new(comment):
+        if comment_fingerprint(comment) in already_posted:
+            duplicates.append(comment)
+            return False
+        return True
+
+    placed, dropped = [], []
+
+    def place(comment):
+        fixed = diff.validate(comment)
+        if fixed is None:
+            dropped.append(comment)
+            return None
+        if fixed is not comment:
+            COMMENTS_TOTAL.labels("snapped").inc()
+        placed.append(fixed)
+        return fixed
+
+    if STREAMING:
+        # Comments are posted while the model is still writing the rest
+        poster = CommentStreamPoster(
+            owner, name, pr_number, github_token, installation_id,
+            client=client, commit_id=snapshot.head_sha, on_posted=remember_posted,
+        )
+
+        async def post_placed(comment):
+            fixed = place(comment)
+            if fixed is not None and is_new(fixed):
+                await poster.add(fixed)
+
+        model_started = time.monotonic()
+        try:
+            with observe_stage("model"):
+                await generate_review_comments(
+                    pr_title, hunk_pages(), client=client, cache=_review_cache(redis), on_comment=post_placed
+                )
+        except Exception:
+            await asyncio.gather(poster.close(), return_exceptions=True)
+            raise
+        with observe_stage("post"):
+            post_report = await poster.close()
+        if poster.first_posted_at is not None:
+            observe_duration("first_comment", poster.first_posted_at - model_started)
+    else:
+        with observe_stage("model"):
+            comments = await generate_review_comments(
+                pr_title, hunk_pages(), client=client, cache=_review_cache(redis)
+            )
+        for comment in comments:
+            place(comment)
+        with observe_stage("post"):
+            post_report = await post_pr_comments(
+                owner, name, pr_number, [c for c in placed if is_new(c)], github_token, installation_id,
+                client=client, commit_id=snapshot.head_sha, on_posted=remember_posted,
+            )
+    if skipped:
+        print(f"🙈 Skipped {len(skipped)} file(s) by review config")
+    if dropped:
+        print(f"⚠️ Dropped {len(dropped)} comment(s) on lines outside the diff")
+    if duplicates:
+        print(f"⏭️ Skipped {len(duplicates)} comment(s) already posted by an earlier attempt")
+    COMMENTS_TOTAL.labels("posted").inc(post_report["posted"])
+    COMMENTS_TOTAL.labels("rejected").inc(len(post_report["rejected"]))
+    COMMENTS_TOTAL.labels("dropped").inc(len(dropped))
+    COMMENTS_TOTAL.labels("duplicate").inc(len(duplicates))
+
+    # 🔑 Store into history namespace
+    history_entry = {
+        "repo": repo,
+        "pr_number": pr_number,
+        "title": pr_title,
+        "url": pr_url,
+        "status": "done",
+        "head_sha": snapshot.head_sha,
+        "incremental": incremental,
+        "comments": placed,
+        "rejected_comments": post_report["rejected"],
+        "dropped_comments": dropped,
+        "skipped_files": [{"path": path, "reason": reason} for path, reason in skipped.items()],
+        "installation_id": installation_id,
+    }
+    with observe_stage("history"):
+        pipe = redis.pipeline(transaction=True)
+        record_review(pipe, history_entry)
+        pipe.delete(posted_key)
+        await pipe.execute()
+
+    JOBS_TOTAL.labels("done").inc()
+    print(f"✅ Processed PR #{pr_number} for installation {installation_id}")
+
+
+class JobPool:
+    """
+    Bounded pool of in-flight review jobs.
+
+    At most `max_jobs` jobs run at once, and at most `max_per_installation`
+    of them may belong to the same installation.
+    """
+
+    def __init__(self, max_jobs: int, max_per_installation: int):
+        self.max_jobs = max_jobs
+        self.max_per_installation = max_per_installation
+        self._slots = asyncio.Semaphore(max_jobs)
+        self._tasks: set[asyncio.Task] = set()
+        self._per_installation: dict[str, int] = {}
+
+    def __len__(self):
+        return len(self._tasks)
+
+    async def acquire(self):
+        """Wait until a global slot is free."""
+        await self._slots.acquire()
+
+    def release(self):
+        """Give back a slot that was acquired but not used for a job."""
+        self._slots.release()
+
+    def is_saturated(self, installation_id) -> bool:
+        return self._per_installation.get(str(installation_id), 0) >= self.max_per_installation
+
+    def spawn(self, installation_id, coro) -> asyncio.Task:
+        """Run coro as an independent task holding an already-acquired slot."""
+        key = str(installation_id)
+        self._per_installation[key] = self._per_installation.get(key, 0) + 1
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+
+        def _done(t: asyncio.Task):
+            self._tasks.discard(t)
+            remaining = self._per_installation.get(key, 1) - 1
+            if remaining > 0:
+                self._per_installation[key] = remaining
+            else:
+                self._per_installation.pop(key, None)
+            self._slots.release()
+
+        task.add_done_callback(_done)
+        return task
+
+    async def drain(self, timeout: float) -> int:
+        """Let in-flight jobs finish for up to `timeout` seconds, then cancel the rest; returns how many were cancelled."""
+        tasks = list(self._tasks)
+        if not tasks:
+            return 0
+        _, unfinished = await asyncio.wait(tasks, timeout=timeout)
+        if unfinished:
+            await self.cancel_all()
+        return len(unfinished)
+
+    async def cancel_all(self):
+        """Cancel every in-flight job and wait for them to unwind."""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _run_job(queue: JobQueue, entry: StreamJob, active: dict):
+    JOBS_IN_FLIGHT.inc()
+    job = None
+    try:
+        # Claim the PR's latest coalesced payload (after any debounce window)
+        job = await queue.take(entry)
+        if job is None:
+            print(f"⏭️ No pending job left for {entry.label}, skipping")
+            JOBS_TOTAL.labels("superseded").inc()
+        else:
+            # Time from the webhook's enqueue to the job starting, debounce included
+            observe_queue_wait(entry.entry_id, entry.installation_id)
+            with observe_stage("total"):
+                await process_job(queue.redis, job)
+            if job.get("installation_id"):
+                await clear_failures(queue.redis, job)
+    except asyncio.CancelledError:
+        # Leave the entry pending so another consumer can reclaim it
+        print(f"🔹 Job for {entry.label} cancelled")
+        JOBS_TOTAL.labels("cancelled").inc()
+        raise
+    except Exception as e:
+        print(f"💥 Error processing {entry.label}: {e}")
+        traceback.print_exc()
+        record_error(e)
+        if job and job.get("installation_id"):
+            try:
+                outcome = await retry_or_dead_letter(queue.redis, job, e)
+            except Exception as retry_error:
+                # Leave the entry pending: it is reclaimed and run again later
+                print(f"❌ Could not schedule a retry for {entry.label}: {retry_error}")
+                record_error(retry_error)
+                JOBS_TOTAL.labels("failed").inc()
+                return
+            JOBS_TOTAL.labels(outcome).inc()
+        else:
+            JOBS_TOTAL.labels("failed").inc()
+        await queue.ack(entry)
+    else:
+        await queue.ack(entry)
+    finally:
+        JOBS_IN_FLIGHT.dec()
+        active.pop(entry.entry_id, None)
+
+
+async def _acquire_unless_stopped(pool: JobPool, stop: asyncio.Event | None) -> bool:
+    """Wait for a free slot, or for `stop` (a full pool must not hold up draining); True once a slot is held."""
+    if stop is None:
+        await pool.acquire()
+        return True
+    acquire = asyncio.create_task(pool.acquire())
+    stopped = asyncio.create_task(stop.wait())
+    try:
+        await asyncio.wait({acquire, stopped}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        stopped.cancel()
+        if not acquire.done():
+            acquire.cancel()
+        await asyncio.gather(acquire, stopped, return_exceptions=True)
+    if acquire.cancelled():
+        return False
+    if stop.is_set():
+        pool.release()
+        return False
+    return True
+
+
+async def _keep_claimed(queue: JobQueue, held, interval: float):
+    """Touch the entries this consumer holds every `interval` seconds, so none looks abandoned."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await queue.touch(held())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️ Could not refresh claimed jobs: {e}")
+
+
+def _has_room(pool: JobPool):
+    return lambda installation_id: not pool.is_saturated(installation_id)
+
+
+async def review_worker(stop: asyncio.Event | None = None, consumer: str | None = None, drain_timeout: float | None = None):
+    """
+    Pull jobs from the installation streams and run them in a JobPool until
+    cancelled, or until `stop` is set, in which case in-flight jobs get up to
+    `drain_timeout` seconds (derived from REVIEW_STOP_GRACE_PERIOD) to finish.
+    """
+    global _queue, _pool
+    pool = promoter = keeper = None
     try:
         print("🚀 Starting review worker...")
         redis_url = os.getenv("REDIS_URL_DOCKER")
@@ -47,167 +477,182 @@ async def review_worker():
                     traceback.print_exc()
                     return
 
-        print("👂 Listening for jobs...")
+        # Share installation tokens with other engine replicas
+        if os.getenv("REVIEW_SHARE_TOKENS", "").lower() in ("1", "true", "yes"):
+            token_cache.redis = redis
+            print("🔑 Sharing installation tokens through Redis")
 
-        while True:
+        # Reviews recorded before the history hashes would otherwise be invisible
+        try:
+            await import_legacy_history(redis)
+        except Exception as e:
+            print(f"⚠️ Could not import legacy review history: {e}")
+
+        pool = _pool = JobPool(
+            max_jobs=_env_int("REVIEW_MAX_CONCURRENT_JOBS", 4),
+            max_per_installation=_env_int("REVIEW_MAX_JOBS_PER_INSTALLATION", 2),
+        )
+        queue = _queue = JobQueue(redis, consumer)
+        promoter = asyncio.create_task(retry_promoter(redis))
+        claim_idle_ms = _env_int("REVIEW_CLAIM_IDLE_MS", 10 * 60 * 1000)
+        reclaim_interval = _env_int("REVIEW_RECLAIM_INTERVAL", 30)
+        loop = asyncio.get_running_loop()
+        last_reclaim = 0.0
+
+        # Entries delivered to this consumer but not started yet, and entries running
+        scheduler = FairScheduler()
+        active: dict[str, StreamJob] = {}
+        has_room = _has_room(pool)
+        # Reviews can outlast claim_idle_ms (rate limit waits, debounce): keep
+        # every held entry fresh so other consumers only reclaim dead ones
+        keeper = asyncio.create_task(_keep_claimed(
+            queue, lambda: [*active.values(), *scheduler.entries()], max(claim_idle_ms / 3000, 1)
+        ))
+
+        # A restarted worker with a stable consumer name resumes what its predecessor was handed
+        await queue.refresh_streams()
+        for entry in await queue.read(queue.streams, count=1000, own_pending=True):
+            print(f"♻️ Resuming job {entry.entry_id} from {entry.stream}")
+            scheduler.push(entry)
+
+        print(
+            f"👂 Listening for jobs as {queue.consumer} (max {pool.max_jobs} in flight, "
+            f"{pool.max_per_installation} per installation)..."
+        )
+
+        while not (stop and stop.is_set()):
+            # Only take a job once there is a free slot to run it in
+            if not await _acquire_unless_stopped(pool, stop):
+                break
             try:
-
-                # 🔑 Instead of hardcoding, block on ANY pr-review-queue
-                # Use pattern with BRPOP for all installations
-                keys = [key async for key in redis.scan_iter("pr-review-queue:*")]
-                if not keys:
-                    await asyncio.sleep(1)
-                    continue
-
-                response = await redis.brpop(*keys)
-
-                if not response or len(response) != 2:
-                    print(f"⚠️ Invalid response from queue: {response}")
-                    continue
-
-                queue_name, payload = response
-                try:
-                    job = json.loads(payload)
-                except Exception:
-                    print("❌ Failed to parse job JSON")
-                    traceback.print_exc()
-                    continue
-
-                action = job.get("action", "").lower().strip()
-                valid_actions = ["opened", "synchronize", "reopened", "edited"]
-                if action not in valid_actions:
-                    continue
-
-                repo, pr_number = job["repo"], job["pr_number"]
-                owner, name = repo.split("/")
-                
-                installation_id = job.get("installation_id")
-                if not installation_id:
-                    print("❌ No installation_id in job payload")
-                    continue
-
-
-                # === fetch fresh GitHub installation token ===
-                github_token = await get_installation_token(installation_id)
-
-                async def run_github_query():
-                    graphql_transport = AIOHTTPTransport(
-                        url="https://api.github.com/graphql",
-                        headers={"Authorization": f"Bearer {github_token}"}
-                    )
-                    graphql_client = Client(
-                        transport=graphql_transport,
-                        fetch_schema_from_transport=True,
-                    )
-                    query = gql(
-                        """
-                        query($owner: String!, $name: String!, $number: Int!) {
-                          repository(owner: $owner, name: $name) {
-                            pullRequest(number: $number) {
-                              id
-                              title
-                              url
-                            }
-                          }
-                        }
-                        """
-                    )
-                    return await graphql_client.execute_async(
-                        query, variable_values={"owner": owner, "name": name, "number": pr_number}
-                    )
-
-                # === retry once on 401 ===
-                try:
-                    result = await run_github_query()
-                except Exception as e:
-                    if "401" in str(e):
-                        print("⚠️ GitHub token expired, refreshing...")
-                        github_token = await get_installation_token(installation_id)
-                        result = await run_github_query()
-                    else:
-                        raise
-
-                pr_title = result["repository"]["pullRequest"]["title"]
-                pr_url = result["repository"]["pullRequest"]["url"]
-
-                # === changed files via REST ===
-                rest_headers = {
-                    "Authorization": f"Bearer {github_token}",
-                    "Accept": "application/vnd.github.v3+json",
-                }
-                async with httpx.AsyncClient() as client:
-                    resp = await client.get(
-                        f"https://api.github.com/repos/{owner}/{name}/pulls/{pr_number}/files",
-                        headers=rest_headers,
-                    )
-                    if resp.status_code == 401:
-                        print("⚠️ REST token expired, refreshing...")
-                        github_token = await get_installation_token(installation_id)
-                        rest_headers["Authorization"] = f"Bearer {github_token}"
-                        resp = await client.get(
-                            f"https://api.github.com/repos/{owner}/{name}/pulls/{pr_number}/files",
-                            headers=rest_headers,
-                        )
-                    files = resp.json()
-
-                # === parse patches ===
-                chunks = []
-                for f in files:
-                    patch = f.get("patch")
-                    if not patch:
-                        continue
-                    parts = re.split(r"(^@@.*@@\n)", patch, flags=re.MULTILINE)
-                    if len(parts) <= 1:
-                        chunks.append({"path": f["filename"], "hunk": patch})
-                    else:
-                        for i in range(1, len(parts), 2):
-                            chunks.append({"path": f["filename"], "hunk": parts[i] + parts[i + 1]})
-
-                # === generate & post review ===
-                review_output = await generate_review(pr_title, chunks)
-                comments = parse_review_json(review_output)
-                await post_pr_comments(owner, name, pr_number, comments, github_token, installation_id)
-
-                 # 🔑 Store into history namespace
-                history_key = f"pr-review-history:{installation_id}"
-                history_entry = {
-                    "repo": repo,
-                    "pr_number": pr_number,
-                    "title": pr_title,
-                    "url": pr_url,
-                    "status": "done",
-                    "comments": comments,
-                    "installation_id": installation_id,
+                await queue.refresh_streams()
+
+                # ♻️ Take over jobs left pending by crashed consumers
+                if loop.time() - last_reclaim >= reclaim_interval:
+                    last_reclaim = loop.time()
+                    known = active.keys() | scheduler.entry_ids()
+                    for entry in await queue.reclaim(claim_idle_ms):
+                        if entry.entry_id not in known:
+                            print(f"♻️ Reclaimed job {entry.entry_id} from {entry.stream}")
+                            scheduler.push(entry)
+
+                # Top up every installation with room, so all tenants with work
+                # compete for the slot. Only block when nothing can run meanwhile.
+                wanted = {
+                    s: scheduler.wanted(installation_from_stream(s))
+                    for s in queue.streams if has_room(installation_from_stream(s))
                 }
-                await redis.rpush(history_key, json.dumps(history_entry))
-                await redis.ltrim(history_key, -100, -1)
+                streams = [s for s, n in wanted.items() if n]
+                if streams:
+                    block_ms = None if scheduler.has_ready(has_room) else 1000
+                    count = max(wanted[s] for s in streams)
+                    for delivered in await queue.read(streams, count=count, block_ms=block_ms):
+                        scheduler.push(delivered)
+
+                entry = scheduler.pop(has_room)
+                if entry is None:
+                    pool.release()
+                    if not streams:
+                        await asyncio.sleep(1)
+                    continue
 
-                print(f"✅ Processed PR #{pr_number} for installation {installation_id}")
-                     
+                active[entry.entry_id] = entry
+                pool.spawn(entry.installation_id, _run_job(queue, entry, active))
 
             except Exception as e:
+                pool.release()
                 print(f"💥 Error in job loop: {e}")
+                record_error(e)
                 traceback.print_exc()
+                await asyncio.sleep(1)
+
+        # 🔹 Stop requested: finish what is running, leave the rest pending for other consumers
+        promoter.cancel()
+        if len(pool):
+            if drain_timeout is None:
+                from services.review_engine.worker import drain_deadlines, STOP_GRACE_PERIOD
+
+                drain_timeout = drain_deadlines(STOP_GRACE_PERIOD)[0]
+            timeout = drain_timeout
+            print(f"🔹 Draining {len(pool)} in-flight job(s) (up to {timeout}s)...")
+            cancelled = await pool.drain(timeout)
+            if cancelled:
+                print(f"⚠️ Cancelled {cancelled} job(s) still running after {timeout}s")
+        keeper.cancel()
+        print("🔹 Review worker drained and stopped.")
     except asyncio.CancelledError:
+        if promoter:
+            promoter.cancel()
+        if keeper:
+            keeper.cancel()
+        if pool and len(pool):
+            print(f"🔹 Cancelling {len(pool)} in-flight job(s)...")
+            await pool.cancel_all()
         print("🔹 Review worker stopped gracefully.")
 
+def _ensure_worker(reason: str) -> bool:
+    """Start the worker task if it is not running; returns True if it was restarted."""
+    global _worker_task
+    if not EMBEDDED_WORKER or (_worker_task and not _worker_task.done()):
+        return False
+    loop = asyncio.get_event_loop()
+    _worker_task = loop.create_task(review_worker())
+    print(f"♻️ Worker re-started via {reason}")
+    return True
+
+
+async def wake_listener():
+    """
+    Restart the worker when the webhook listener publishes new work, so waking
+    the engine does not need an HTTP call on the webhook's response path.
+    """
+    redis_url = os.getenv("REDIS_URL_DOCKER")
+    if not redis_url:
+        return
+    while True:
+        redis = pubsub = None
+        try:
+            redis = await from_url(redis_url.strip(), decode_responses=True)
+            pubsub = redis.pubsub()
+            await pubsub.subscribe(WAKE_CHANNEL)
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    _ensure_worker(WAKE_CHANNEL)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️ Wake listener error: {e}, resubscribing in 5s...")
+            await asyncio.sleep(5)
+        finally:
+            if pubsub:
+                await pubsub.aclose()
+            if redis:
+                await redis.aclose()
+
+
 @app.on_event("startup")
 async def startup_event():
-    global _worker_task
+    global _worker_task, _wake_task
+    get_http_client()
+    if not EMBEDDED_WORKER:
+        print("ℹ️ Embedded worker disabled, serving health and metrics only")
+        return
     loop = asyncio.get_event_loop()
     _worker_task = loop.create_task(review_worker())
+    _wake_task = loop.create_task(wake_listener())
     print("✅ Worker task started")
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    global _worker_task
-    if _worker_task:
-        _worker_task.cancel()
-        try:
-            await _worker_task
-        except asyncio.CancelledError:
-            print("Worker cancelled on shutdown")
+    for task in (_wake_task, _worker_task):
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                print("Worker cancelled on shutdown")
+    await close_http_client()
 
 
 @app.get("/health")
@@ -215,14 +660,24 @@ async def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint."""
+    if _queue is not None:
+        try:
+            await refresh_queue_depth(_queue.redis, _queue.streams)
+        except Exception as e:
+            print(f"⚠️ Could not refresh queue depth: {e}")
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
 @app.get("/wake")
 async def wake():
     """Ping endpoint to restart the worker loop if needed."""
-    global _worker_task
-    if not _worker_task or _worker_task.done():
-        loop = asyncio.get_event_loop()
-        _worker_task = loop.create_task(review_worker())
-        print("♻️ Worker re-started via /wake")
+    if not EMBEDDED_WORKER:
+        return {"status": "disabled"}
+    if _ensure_worker("/wake"):
         return {"status": "restarted"}
     return {"status": "already_running"}
 
@@ -235,4 +690,4 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=int(os.getenv("PORT", 8000)),
         workers=1,
-    )
\ No newline at end of file
+    )
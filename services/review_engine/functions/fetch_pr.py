@@ -0,0 +1,232 @@
+import asyncio, re
+from dataclasses import dataclass, field
+from urllib.parse import parse_qs, urlparse
+
+from services.review_engine.http_client import get_http_client, GITHUB_API_URL, HTTPStatusError
+
+GITHUB_GRAPHQL_URL = f"{GITHUB_API_URL}/graphql"
+
+# GitHub caps the PR files listing at 3000 files
+FILES_PER_PAGE = 100
+MAX_FILE_PAGES = 30
+# Headers may carry trailing context, e.g. "@@ -10,3 +10,4 @@ def f():"
+HUNK_HEADER = re.compile(r"(^@@ -\d+(?:,\d+)? \+\d+(?:,\d+)? @@.*\n)", flags=re.MULTILINE)
+
+# Plain POST with a fixed query: no schema introspection round trip per job
+PR_SNAPSHOT_QUERY = """
+query($owner: String!, $name: String!, $number: Int!) {
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {
+      id
+      title
+      url
+      headRefOid
+      baseRefOid
+      changedFiles
+      files(first: 100) {
+        nodes { path additions deletions changeType }
+      }
+    }
+  }
+}
+"""
+
+
+# GraphQL error types that mean the same as an HTTP status, for retry classification
+GRAPHQL_ERROR_STATUS = {"NOT_FOUND": 404, "FORBIDDEN": 403, "RATE_LIMITED": 429}
+
+
+@dataclass
+class PRSnapshot:
+    """
+    What a job needs to know about a PR, fetched once up front. `files` is
+    only the first page of changed files; the REST listing supplies the rest.
+    """
+
+    owner: str
+    name: str
+    number: int
+    id: str
+    title: str
+    url: str
+    head_sha: str
+    base_sha: str
+    changed_files: int = 0
+    files: list = field(default_factory=list)
+
+    @property
+    def repo(self) -> str:
+        return f"{self.owner}/{self.name}"
+
+
+async def _graphql(client, token, variables):
+    resp = await client.post(
+        GITHUB_GRAPHQL_URL,
+        headers={"Authorization": f"Bearer {token}"},
+        json={"query": PR_SNAPSHOT_QUERY, "variables": variables},
+    )
+    if resp.status_code != 200:
+        raise HTTPStatusError(f"GitHub GraphQL error {resp.status_code}: {resp.text}", resp.status_code)
+    data = resp.json()
+    errors = data.get("errors")
+    if errors:
+        # GraphQL answers 200 with typed errors; map them to the REST status
+        types = {e.get("type") for e in errors}
+        status = next((GRAPHQL_ERROR_STATUS[t] for t in GRAPHQL_ERROR_STATUS if t in types), None)
+        if status:
+            raise HTTPStatusError(f"GitHub GraphQL error {status}: {errors}", status)
+        raise RuntimeError(f"GitHub GraphQL errors: {errors}")
+    repository = (data.get("data") or {}).get("repository")
+    pr = repository.get("pullRequest") if repository else None
+    if pr is None:
+        raise HTTPStatusError(f"Pull request #{variables['number']} not found", 404)
+    return pr
+
+
+async def fetch_pr_snapshot(owner, name, pr_number, github_token, client=None) -> PRSnapshot:
+    """
+    Fetch PR metadata, head/base SHAs and the first 100 changed files in one
+    GraphQL query. Larger PRs are not paged here: iter_pr_files fetches every
+    page concurrently while the review runs.
+    """
+    client = client or get_http_client()
+    variables = {"owner": owner, "name": name, "number": pr_number}
+
+    pr = await _graphql(client, github_token, variables)
+    snapshot = PRSnapshot(
+        owner=owner,
+        name=name,
+        number=pr_number,
+        id=pr["id"],
+        title=pr["title"],
+        url=pr["url"],
+        head_sha=pr["headRefOid"],
+        base_sha=pr["baseRefOid"],
+        changed_files=pr.get("changedFiles") or 0,
+        files=pr["files"]["nodes"],
+    )
+    return snapshot
+
+
+def split_hunks(path, patch):
+    """
+    Split a file patch into one chunk per `@@` hunk
+    """
+    parts = HUNK_HEADER.split(patch)
+    if len(parts) <= 1:
+        return [{"path": path, "hunk": patch}]
+    return [{"path": path, "hunk": parts[i] + parts[i + 1]} for i in range(1, len(parts), 2)]
+
+
+def _last_page(resp) -> int:
+    last = resp.links.get("last", {}).get("url")
+    if not last:
+        return 1
+    page = parse_qs(urlparse(last).query).get("page", ["1"])[0]
+    return min(int(page), MAX_FILE_PAGES)
+
+
+async def iter_pr_files(owner, name, pr_number, github_token, client=None, max_concurrency=8, refresh_token=None):
+    """
+    Yield the PR's changed files page by page.
+
+    The first page's `Link` header tells how many pages there are; the rest
+    are fetched concurrently and yielded in whatever order they arrive. With
+    `refresh_token` (an async callable returning a new token), a page answered
+    with 401 is retried once with a fresh token instead of failing the listing.
+    """
+    client = client or get_http_client()
+    url = f"{GITHUB_API_URL}/repos/{owner}/{name}/pulls/{pr_number}/files"
+    headers = {
+        "Authorization": f"Bearer {github_token}",
+        "Accept": "application/vnd.github.v3+json",
+    }
+    limit = asyncio.Semaphore(max_concurrency)
+    refreshing = asyncio.Lock()
+
+    async def fetch_page(page):
+        for attempt in range(2):
+            sent_auth = headers["Authorization"]
+            async with limit:
+                resp = await client.get(url, headers=dict(headers), params={"per_page": FILES_PER_PAGE, "page": page})
+            if resp.status_code == 401 and refresh_token and attempt == 0:
+                async with refreshing:
+                    # Concurrent pages share one refresh
+                    if headers["Authorization"] == sent_auth:
+                        headers["Authorization"] = f"Bearer {await refresh_token()}"
+                continue
+            break
+        if resp.status_code != 200:
+            raise HTTPStatusError(f"GitHub REST error {resp.status_code} listing files: {resp.text}", resp.status_code)
+        return resp
+
+    first = await fetch_page(1)
+
+    # Start the remaining pages before handing back the first one
+    pending = [asyncio.create_task(fetch_page(page)) for page in range(2, _last_page(first) + 1)]
+    try:
+        yield first.json()
+        for next_page in asyncio.as_completed(pending):
+            yield (await next_page).json()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def file_hunks(files, accept=None) -> list:
+    """Split a page of file entries into `{"path", "hunk"}` chunks, skipping files `accept` rejects."""
+    chunks = []
+    for f in files:
+        patch = f.get("patch")
+        if not patch or (accept and not accept(f)):
+            continue
+        chunks.extend(split_hunks(f["filename"], patch))
+    return chunks
+
+
+async def iter_pr_hunk_pages(
+    owner, name, pr_number, github_token, client=None, max_concurrency=8, accept=None, refresh_token=None
+):
+    """
+    Yield one list of `{"path", "hunk"}` chunks per page of changed files, as
+    each page arrives. `accept(file)` can reject a file entry before its
+    patch is split.
+    """
+    async for files in iter_pr_files(owner, name, pr_number, github_token, client, max_concurrency, refresh_token):
+        yield file_hunks(files, accept)
+
+
+# The compare API lists at most 300 changed files
+MAX_COMPARE_FILES = 300
+
+
+async def fetch_compare_hunks(owner, name, base_sha, head_sha, github_token, client=None, accept=None):
+    """
+    Return hunks introduced between two commits via `/compare/{base}...{head}`,
+    leaving out files rejected by `accept(file)`.
+
+    Returns None when an incremental diff cannot be trusted and the caller
+    should review the full PR instead: the base commit is gone or no longer an
+    ancestor of head (force-push), or the comparison is truncated.
+    """
+    client = client or get_http_client()
+    resp = await client.get(
+        f"{GITHUB_API_URL}/repos/{owner}/{name}/compare/{base_sha}...{head_sha}",
+        headers={
+            "Authorization": f"Bearer {github_token}",
+            "Accept": "application/vnd.github.v3+json",
+        },
+    )
+    if resp.status_code in (404, 422):
+        return None
+    if resp.status_code != 200:
+        raise HTTPStatusError(f"GitHub REST error {resp.status_code} comparing commits: {resp.text}", resp.status_code)
+
+    data = resp.json()
+    if data.get("status") not in ("ahead", "identical"):
+        return None
+    files = data.get("files") or []
+    if len(files) >= MAX_COMPARE_FILES:
+        return None
+
+    return file_hunks(files, accept)
@@ -1,19 +1,26 @@
 import os
-import httpx
+import asyncio
 import json
 import traceback
+from services.review_engine.http_client import get_http_client, GITHUB_MODELS_URL, HTTPStatusError
+from services.review_engine.review_cache import assign_comments
+from services.review_engine.functions.json_stream import JsonArrayStream
+from services.review_engine.diff_index import annotate_hunk
 
-GITHUB_MODELS_URL = "https://models.github.ai/inference/chat/completions"  # Correct URL
+REVIEW_MODEL = "openai/gpt-4.1"  # Full model ID with publisher prefix
+# Bump whenever the prompt changes so cached reviews are not reused
+PROMPT_VERSION = "2"
 
-async def generate_review(pr_title, chunks):
-    api_key = os.getenv("OPENAI_API_KEY")  # Your GitHub token
-    if not api_key:
-        raise RuntimeError("OPENAI_API_KEY not set")
+# Rough token estimate (~4 characters per token) used to size prompt shards
+CHARS_PER_TOKEN = 4
+PROMPT_TOKEN_BUDGET = int(os.getenv("REVIEW_PROMPT_TOKEN_BUDGET", 12000))
+SHARD_CONCURRENCY = int(os.getenv("REVIEW_SHARD_CONCURRENCY", 4))
+# Stream completions and hand each comment on as soon as it is parsed
+STREAMING = os.getenv("REVIEW_STREAMING", "false").lower() in ("1", "true", "yes")
 
-    prompt = f"Review the following PR: {pr_title}\n\n"
-    for chunk in chunks:
-        prompt += f"File: {chunk['path']}\n{chunk['hunk']}\n\n"
-    prompt += """
+RESPONSE_FORMAT = """
+        Each line that can be commented on starts with its line number in the new file.
+        Use that number as line_number, and only comment on numbered lines.
         Return ONLY valid JSON (no explanations, no text outside JSON).
         Format:
         [
@@ -21,6 +28,75 @@ async def generate_review(pr_title, chunks):
         ]
         """
 
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _chunk_text(chunk):
+    return f"File: {chunk['path']}\n{annotate_hunk(chunk['path'], chunk['hunk'])}\n\n"
+
+
+def build_prompt(pr_title, chunks):
+    prompt = f"Review the following PR: {pr_title}\n\n"
+    for chunk in chunks:
+        prompt += _chunk_text(chunk)
+    prompt += RESPONSE_FORMAT
+    return prompt
+
+
+def plan_shards(pr_title, chunks, budget=None):
+    """
+    Pack chunks into shards whose prompts stay under the token budget.
+
+    Hunks of the same file are kept in one shard when the whole file fits;
+    a file larger than the budget is split across shards at hunk boundaries.
+    A single hunk larger than the budget gets a shard of its own.
+    """
+    budget = budget or PROMPT_TOKEN_BUDGET
+    available = max(budget - estimate_tokens(build_prompt(pr_title, [])), 1)
+
+    # Group hunks by file, keeping first-seen order
+    files = {}
+    for chunk in chunks:
+        files.setdefault(chunk["path"], []).append(chunk)
+
+    shards, current, used = [], [], 0
+
+    def flush():
+        nonlocal current, used
+        if current:
+            shards.append(current)
+        current, used = [], 0
+
+    for file_chunks in files.values():
+        sizes = [estimate_tokens(_chunk_text(c)) for c in file_chunks]
+        total = sum(sizes)
+        if used + total > available and total <= available:
+            flush()
+        if used + total <= available:
+            current.extend(file_chunks)
+            used += total
+            continue
+
+        # File does not fit in one shard: split it by hunk
+        for chunk, size in zip(file_chunks, sizes):
+            if used + size > available:
+                flush()
+            current.append(chunk)
+            used += size
+
+    flush()
+    return shards
+
+
+def _completion_request(pr_title, chunks):
+    api_key = os.getenv("OPENAI_API_KEY")  # Your GitHub token
+    if not api_key:
+        raise RuntimeError("OPENAI_API_KEY not set")
+
+    prompt = build_prompt(pr_title, chunks)
+
     headers = {
         "Accept": "application/vnd.github+json",  # Required
         "Authorization": f"Bearer {api_key}",
@@ -29,18 +105,175 @@ async def generate_review(pr_title, chunks):
     }
 
     body = {
-        "model": "openai/gpt-4.1",  # Full model ID with publisher prefix
+        "model": REVIEW_MODEL,
         "messages": [{"role": "user", "content": prompt}],
     }
+    return headers, body
 
-    async with httpx.AsyncClient(timeout=60) as client:
-        resp = await client.post(GITHUB_MODELS_URL, headers=headers, json=body)
 
+async def generate_review(pr_title, chunks, client=None):
+    headers, body = _completion_request(pr_title, chunks)
+
+    client = client or get_http_client()
+    resp = await client.post(GITHUB_MODELS_URL, headers=headers, json=body, timeout=60)
+
+    if resp.status_code != 200:
+        raise HTTPStatusError(f"GitHub Models error {resp.status_code}: {resp.text}", resp.status_code)
+
+    data = resp.json()
+    return data["choices"][0]["message"]["content"].strip()
+
+
+async def stream_review(pr_title, chunks, client=None, parser=None):
+    """
+    Request a streamed completion and yield normalized comments as each array
+    element is completed. Falls back to the whole body when the endpoint
+    answers with plain JSON instead of server-sent events.
+    """
+    headers, body = _completion_request(pr_title, chunks)
+    headers["Accept"] = "text/event-stream"
+    body["stream"] = True
+    parser = parser or JsonArrayStream()
+
+    client = client or get_http_client()
+    async with client.stream("POST", GITHUB_MODELS_URL, headers=headers, json=body, timeout=60) as resp:
         if resp.status_code != 200:
-            raise RuntimeError(f"GitHub Models error {resp.status_code}: {resp.text}")
+            await resp.aread()
+            raise HTTPStatusError(f"GitHub Models error {resp.status_code}: {resp.text}", resp.status_code)
+
+        if not resp.headers.get("content-type", "").startswith("text/event-stream"):
+            await resp.aread()
+            content = resp.json()["choices"][0]["message"]["content"]
+            for item in parser.feed(content):
+                yield normalize_comment(item)
+            return
+
+        async for line in resp.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                break
+            try:
+                choices = json.loads(data).get("choices") or []
+            except ValueError:
+                continue
+            delta = (choices[0].get("delta") or {}).get("content") if choices else None
+            if delta:
+                for item in parser.feed(delta):
+                    yield normalize_comment(item)
+
+
+async def _pages(chunks):
+    if isinstance(chunks, list):
+        yield chunks
+        return
+    async for page in chunks:
+        yield page
+
+
+def _raise_failed(tasks):
+    for task in tasks:
+        if task.done() and not task.cancelled() and task.exception() is not None:
+            raise task.exception()
+
+
+async def generate_review_comments(pr_title, chunks, client=None, cache=None, on_comment=None):
+    """
+    Review a PR of any size: plan token-bounded shards, send them to the model
+    concurrently and merge the parsed comments in shard order.
 
-        data = resp.json()
-        return data["choices"][0]["message"]["content"].strip()
+    `chunks` is a list of hunks or an async iterable of lists, one per page of
+    changed files. Pages are sharded and sent to the model as they arrive, so
+    the review starts before the whole PR is fetched; a file's hunks always
+    come in one page, so shards still keep files together.
+
+    With a ReviewCache, hunks reviewed before are served from the cache and
+    only the misses are sent to the model. With `on_comment` (and
+    REVIEW_STREAMING), completions are streamed and each comment is awaited
+    through the callback as soon as it is parsed. The first failing shard
+    cancels the others, so a failed review stops posting right away.
+    """
+    limit = asyncio.Semaphore(SHARD_CONCURRENCY)
+    streaming = bool(on_comment and STREAMING)
+
+    async def stream_shard(shard):
+        parser, shard_comments = JsonArrayStream(), []
+        async with limit:
+            async for comment in stream_review(pr_title, shard, client=client, parser=parser):
+                shard_comments.append(comment)
+                await on_comment(comment)
+        # Never cache a shard whose array did not close
+        if cache and parser.complete:
+            await cache.store(shard, assign_comments(shard, shard_comments))
+        return shard_comments
+
+    async def review_shard(shard):
+        async with limit:
+            output = await generate_review(pr_title, shard, client=client)
+        shard_comments = parse_review_json(output)
+        if on_comment:
+            for comment in shard_comments:
+                await on_comment(comment)
+        # Never cache a shard whose output could not be parsed
+        if cache and (shard_comments or _is_json(output)):
+            await cache.store(shard, assign_comments(shard, shard_comments))
+        return shard_comments
+
+    # Cached comments and shard tasks, in page order
+    parts, tasks = [], []
+    hits = misses_total = 0
+    try:
+        async for page in _pages(chunks):
+            _raise_failed(tasks)
+            cached = await cache.lookup(page) if cache else [None] * len(page)
+            hit_comments = [c for hit in cached if hit is not None for c in hit]
+            if on_comment:
+                for comment in hit_comments:
+                    await on_comment(comment)
+            parts.append(hit_comments)
+            misses = [chunk for chunk, hit in zip(page, cached) if hit is None]
+            hits, misses_total = hits + len(page) - len(misses), misses_total + len(misses)
+
+            for shard in plan_shards(pr_title, misses):
+                task = asyncio.create_task(stream_shard(shard) if streaming else review_shard(shard))
+                parts.append(task)
+                tasks.append(task)
+
+        if cache and hits + misses_total:
+            print(f"🗃️ Review cache: {hits} hits, {misses_total} misses")
+        if len(tasks) > 1:
+            print(f"🧩 Split review into {len(tasks)} shards")
+        if tasks:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            _raise_failed(tasks)
+    except BaseException:
+        # A page or shard failed: stop the other shards before they post more
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+    comments = []
+    for part in parts:
+        comments.extend(part.result() if isinstance(part, asyncio.Task) else part)
+    return comments
+
+
+def _is_json(text):
+    try:
+        json.loads(text)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def normalize_comment(c):
+    return {
+        "body": c.get("body") or c.get("comment") or "(no text)",
+        "path": c.get("path") or c.get("file") or "UnknownFile",
+        "line": c.get("line") or c.get("line_number"),
+    }
 
 
 def parse_review_json(review_output):
@@ -50,14 +283,7 @@ def parse_review_json(review_output):
             data = data["output"]
 
         if isinstance(data, list):
-            normalized = []
-            for c in data:
-                normalized.append({
-                    "body": c.get("body") or c.get("comment") or "(no text)",
-                    "path": c.get("path") or c.get("file") or "UnknownFile",
-                    "line": c.get("line") or c.get("line_number"),
-                })
-            return normalized
+            return [normalize_comment(c) for c in data]
 
         print("⚠️ Unexpected JSON shape:", data)
         return []
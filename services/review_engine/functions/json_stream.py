@@ -0,0 +1,73 @@
+import json
+
+
+class JsonArrayStream:
+    """
+    Incremental parser for a JSON array of objects arriving in pieces.
+
+    `feed` returns the objects completed by each piece. The array starts at
+    the first `[` followed by `{` or `]`; anything before it (prose, even
+    prose with brackets like "[optional]", a ``` fence, a {"output": ...}
+    wrapper) is skipped, and only the object being read is buffered, so memory stays
+    bounded by the largest single element rather than the whole response.
+    """
+
+    __slots__ = ("started", "complete", "_opening", "_depth", "_in_string", "_escaped", "_buffer")
+
+    def __init__(self):
+        self.started = False
+        self.complete = False
+        self._opening = False     # saw a `[` that may open the array
+        self._depth = 0           # nesting inside the top-level array
+        self._in_string = False
+        self._escaped = False
+        self._buffer: list[str] = []
+
+    def feed(self, text: str) -> list:
+        items = []
+        for ch in text:
+            if self.complete:
+                break
+            if not self.started:
+                if ch == "[":
+                    self._opening = True
+                elif self._opening and not ch.isspace():
+                    self._opening = False
+                    if ch in "{]":
+                        # The array's first element (or its end): handle it below
+                        self.started = True
+                if not self.started:
+                    continue
+
+            if self._in_string:
+                self._buffer.append(ch)
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if self._depth == 0:
+                if ch == "{":
+                    self._depth = 1
+                    self._buffer = [ch]
+                elif ch == "]":
+                    self.complete = True
+                continue
+
+            self._buffer.append(ch)
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    raw, self._buffer = "".join(self._buffer), []
+                    try:
+                        items.append(json.loads(raw))
+                    except ValueError:
+                        print(f"⚠️ Skipping malformed streamed element: {raw[:200]}")
+        return items
@@ -1,44 +1,190 @@
-import httpx
+import asyncio, time
 import os
 from services.review_engine.auth import get_installation_token
+from services.review_engine.http_client import get_http_client, GITHUB_API_URL, HTTPStatusError
 
-async def post_pr_comments(owner, repo, pr_number, comments, github_token, installation_id=None):
-    url = f"https://api.github.com/repos/{owner}/{repo}/pulls/{pr_number}/comments"
+# "review" submits every comment in one pull request review; "individual"
+# posts one comment per request.
+COMMENT_MODE = os.getenv("REVIEW_COMMENT_MODE", "review").lower()
+COMMENT_POST_CONCURRENCY = int(os.getenv("REVIEW_COMMENT_POST_CONCURRENCY", 4))
+
+
+def _comment_payload(comment):
+    return {
+        "body": comment.get("body") or comment.get("comment") or "(no text)",
+        "path": comment.get("path") or comment.get("file"),
+        "side": "RIGHT",
+        "line": comment.get("line") or comment.get("line_number"),
+    }
+
+
+def _error_text(resp):
+    try:
+        return resp.json().get("message") or resp.text
+    except Exception:
+        return resp.text
+
+
+async def post_pr_comments(
+    owner, repo, pr_number, comments, github_token, installation_id=None, client=None, commit_id=None, on_posted=None
+):
+    """
+    Post review comments on a PR.
+
+    By default all comments go out in a single `POST /pulls/{n}/reviews`. If
+    GitHub rejects the batch, each comment is posted on its own (in parallel,
+    bounded by REVIEW_COMMENT_POST_CONCURRENCY) so one bad line does not sink
+    the rest. Returns a report of posted and rejected comments.
+
+    `on_posted(comment)` is awaited for every comment GitHub accepted.
+    """
+    base_url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/pulls/{pr_number}"
+    client = client or get_http_client()
+    report = {"mode": COMMENT_MODE, "posted": 0, "rejected": []}
+    if not comments:
+        return report
+    # Comments not yet posted; survives a 401 retry so nothing is posted twice
+    pending = list(comments)
+
+    async def _post_individually(headers, head_sha):
+        limit = asyncio.Semaphore(COMMENT_POST_CONCURRENCY)
+
+        async def _post_one(comment):
+            async with limit:
+                payload = {**_comment_payload(comment), "commit_id": head_sha}
+                return comment, await client.post(f"{base_url}/comments", headers=headers, json=payload)
+
+        results = await asyncio.gather(*(_post_one(c) for c in pending))
+        pending.clear()
+        for comment, resp in results:
+            print(f"🔍 Comment POST status: {resp.status_code}")
+            if resp.status_code == 201:
+                report["posted"] += 1
+                if on_posted:
+                    await on_posted(comment)
+            elif resp.status_code == 401:
+                pending.append(comment)
+            else:
+                report["rejected"].append(
+                    {"comment": comment, "status": resp.status_code, "error": _error_text(resp)}
+                )
+        return 401 if pending else 200
 
     async def _do_post(token):
         headers = {"Authorization": f"Bearer {token}", "Accept": "application/vnd.github.v3+json"}
-        async with httpx.AsyncClient() as client:
-            # Get latest commit
-            commits_url = f"https://api.github.com/repos/{owner}/{repo}/pulls/{pr_number}/commits"
+
+        # Get latest commit, unless the caller already knows the head SHA
+        head_sha = commit_id
+        if not head_sha:
+            commits_url = f"{base_url}/commits"
             commits_resp = await client.get(commits_url, headers=headers)
             if commits_resp.status_code == 401:
-                return None, 401
+                return 401
             commits_resp.raise_for_status()
-            commit_id = commits_resp.json()[-1]["sha"]
-
-            # Post comments
-            for comment in comments:
-                payload = {
-                    "body": comment.get("body") or comment.get("comment") or "(no text)",
-                    "commit_id": commit_id,
-                    "path": comment.get("path") or comment.get("file"),
-                    "side": "RIGHT",
-                    "line": comment.get("line") or comment.get("line_number"),
-                }
-                resp = await client.post(url, headers=headers, json=payload)
-                if resp.status_code == 401:
-                    return None, 401
-                print(f"🔍 Comment POST status: {resp.status_code}")
-            return True, 200
+            head_sha = commits_resp.json()[-1]["sha"]
+
+        if report["mode"] == "review":
+            # One request, one notification
+            review = {
+                "commit_id": head_sha,
+                "event": "COMMENT",
+                "comments": [_comment_payload(c) for c in pending],
+            }
+            resp = await client.post(f"{base_url}/reviews", headers=headers, json=review)
+            print(f"🔍 Review POST status: {resp.status_code} ({len(pending)} comments)")
+            if resp.status_code == 401:
+                return 401
+            if resp.status_code == 200:
+                report["posted"] = len(pending)
+                if on_posted:
+                    for comment in pending:
+                        await on_posted(comment)
+                pending.clear()
+                return 200
+            print(f"⚠️ Batched review rejected ({_error_text(resp)}), posting comments individually...")
+            report["mode"] = "individual"
+
+        return await _post_individually(headers, head_sha)
 
     # First attempt
-    result, status = await _do_post(github_token)
+    status = await _do_post(github_token)
 
     if status == 401 and installation_id:
         print("⚠️ GitHub token expired while posting comments, refreshing...")
-        new_token = await get_installation_token(int(installation_id))
-        result, status = await _do_post(new_token)
+        new_token = await get_installation_token(int(installation_id), force_refresh=True)
+        status = await _do_post(new_token)
         if status != 200:
-            raise RuntimeError(f"❌ Failed to post comments after retry (status {status})")
+            raise HTTPStatusError(f"❌ Failed to post comments after retry (status {status})", status)
+
+    if report["rejected"]:
+        print(f"⚠️ {len(report['rejected'])} of {len(comments)} comments rejected by GitHub")
+    return report
+
+
+class CommentStreamPoster:
+    """
+    Posts review comments one by one as they are produced, instead of
+    waiting for the whole review.
+
+    `add` starts posting a comment and returns immediately; `close` waits for
+    every post and returns the same report as post_pr_comments. A 401 refreshes
+    the installation token once and retries the affected comments.
+    """
+
+    def __init__(
+        self, owner, repo, pr_number, github_token, installation_id=None, client=None, commit_id=None, on_posted=None
+    ):
+        self.url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/pulls/{pr_number}/comments"
+        self.token = github_token
+        self.installation_id = installation_id
+        self.client = client or get_http_client()
+        self.commit_id = commit_id
+        self.on_posted = on_posted
+        self.report = {"mode": "streamed", "posted": 0, "rejected": []}
+        self.first_posted_at = None
+        self._limit = asyncio.Semaphore(COMMENT_POST_CONCURRENCY)
+        self._refresh_lock = asyncio.Lock()
+        self._tasks: list[asyncio.Task] = []
+
+    async def add(self, comment):
+        self._tasks.append(asyncio.create_task(self._post(comment)))
+
+    async def _send(self, comment, token):
+        headers = {"Authorization": f"Bearer {token}", "Accept": "application/vnd.github.v3+json"}
+        payload = {**_comment_payload(comment), "commit_id": self.commit_id}
+        async with self._limit:
+            return await self.client.post(self.url, headers=headers, json=payload)
+
+    async def _refreshed_token(self, stale):
+        async with self._refresh_lock:
+            # Another comment may have refreshed it already
+            if self.token == stale:
+                print("⚠️ GitHub token expired while posting comments, refreshing...")
+                self.token = await get_installation_token(int(self.installation_id), force_refresh=True)
+            return self.token
+
+    async def _post(self, comment):
+        token = self.token
+        resp = await self._send(comment, token)
+        if resp.status_code == 401 and self.installation_id:
+            resp = await self._send(comment, await self._refreshed_token(token))
+
+        if resp.status_code == 201:
+            self.report["posted"] += 1
+            if self.first_posted_at is None:
+                self.first_posted_at = time.monotonic()
+            if self.on_posted:
+                await self.on_posted(comment)
+        else:
+            self.report["rejected"].append(
+                {"comment": comment, "status": resp.status_code, "error": _error_text(resp)}
+            )
 
-    return result
+    async def close(self):
+        results = await asyncio.gather(*self._tasks, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        if self.report["rejected"]:
+            print(f"⚠️ {len(self.report['rejected'])} of {len(self._tasks)} comments rejected by GitHub")
+        return self.report
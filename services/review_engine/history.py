@@ -0,0 +1,145 @@
+import json, os, time
+
+from redis.exceptions import ResponseError
+
+# Latest review per PR, keyed by "repo#pr_number", plus a completion-time
+# index for listing and a PR-number index for lookups without a repo. The
+# PR-number index is a lex-ordered zset of "{pr_number}:{repo}#{pr_number}"
+# members, so the same number in different repos never collides.
+# A compact summary of each review is kept alongside so listings never load
+# comment bodies. Readers live in services/webhook_listener/query_api/routes.py.
+REVIEWS_PREFIX = "pr-review-reviews:"
+SUMMARIES_PREFIX = "pr-review-summaries:"
+RECENT_PREFIX = "pr-review-recent:"
+PR_INDEX_PREFIX = "pr-review-pr-repos:"
+# Per-installation RPUSH lists used before the hashes; only imported now.
+# A list being imported is renamed first, so one engine imports each.
+LEGACY_HISTORY_PREFIX = "pr-review-history:"
+IMPORTING_HISTORY_PREFIX = "pr-review-history-importing:"
+HISTORY_MAX = int(os.getenv("REVIEW_HISTORY_MAX", 10000))
+# List fields kept out of the summaries
+FULL_ONLY_FIELDS = ("comments", "rejected_comments", "dropped_comments", "skipped_files")
+
+# KEYS: reviews hash, recent zset, pr-number index zset, summaries hash
+# ARGV: field, entry json, completed_at, pr_number, max entries, summary json
+# Trimmed PRs leave every structure, the PR-number index included.
+RECORD_SCRIPT = """
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('ZADD', KEYS[2], ARGV[3], ARGV[1])
+redis.call('ZADD', KEYS[3], 0, ARGV[4] .. ':' .. ARGV[1])
+redis.call('HSET', KEYS[4], ARGV[1], ARGV[6])
+local excess = redis.call('ZCARD', KEYS[2]) - tonumber(ARGV[5])
+if excess > 0 then
+  local dropped = redis.call('ZRANGE', KEYS[2], 0, excess - 1)
+  redis.call('HDEL', KEYS[1], unpack(dropped))
+  redis.call('HDEL', KEYS[4], unpack(dropped))
+  for _, field in ipairs(dropped) do
+    redis.call('ZREM', KEYS[3], string.match(field, '#([^#]*)$') .. ':' .. field)
+  end
+  redis.call('ZREMRANGEBYRANK', KEYS[2], 0, excess - 1)
+end
+return excess
+"""
+
+
+def reviews_key(installation_id) -> str:
+    return f"{REVIEWS_PREFIX}{installation_id}"
+
+
+def recent_key(installation_id) -> str:
+    return f"{RECENT_PREFIX}{installation_id}"
+
+
+def pr_index_key(installation_id) -> str:
+    return f"{PR_INDEX_PREFIX}{installation_id}"
+
+
+def summaries_key(installation_id) -> str:
+    return f"{SUMMARIES_PREFIX}{installation_id}"
+
+
+def review_field(repo: str, pr_number) -> str:
+    return f"{repo}#{pr_number}"
+
+
+async def last_reviewed_sha(redis, installation_id, field: str):
+    """Head SHA of the PR's latest recorded review, read from its summary (None once trimmed)."""
+    raw = await redis.hget(summaries_key(installation_id), field)
+    return json.loads(raw).get("head_sha") if raw else None
+
+
+def summarize_review(entry: dict) -> dict:
+    """Listing record for a review: scalar fields plus comment counts."""
+    summary = {k: v for k, v in entry.items() if k not in FULL_ONLY_FIELDS}
+    summary["comment_count"] = len(entry.get("comments") or [])
+    summary["rejected_count"] = len(entry.get("rejected_comments") or [])
+    summary["dropped_count"] = len(entry.get("dropped_comments") or [])
+    summary["skipped_count"] = len(entry.get("skipped_files") or [])
+    return summary
+
+
+def record_review(pipe, entry: dict, completed_at: float | None = None):
+    """
+    Add the commands storing a finished review to a pipeline: the entry
+    replaces the PR's previous one and the oldest PRs beyond HISTORY_MAX are
+    dropped, all inside one script.
+    """
+    installation_id = entry["installation_id"]
+    completed_at = completed_at or time.time()
+    entry = {**entry, "completed_at": completed_at}
+    pipe.eval(
+        RECORD_SCRIPT,
+        4,
+        reviews_key(installation_id),
+        recent_key(installation_id),
+        pr_index_key(installation_id),
+        summaries_key(installation_id),
+        review_field(entry["repo"], entry["pr_number"]),
+        json.dumps(entry),
+        completed_at,
+        entry["pr_number"],
+        HISTORY_MAX,
+        json.dumps(summarize_review(entry)),
+    )
+
+
+async def import_legacy_history(redis, batch: int = 100) -> int:
+    """
+    Record the reviews kept in the old `pr-review-history:*` lists through
+    record_review (summaries and indexes included), then drop the lists.
+    The old entries carry no completion time, so they are spaced a second
+    apart, oldest first, just before now. Returns how many were imported.
+    """
+    keys = [key async for key in redis.scan_iter(match=f"{LEGACY_HISTORY_PREFIX}*")]
+    for key in keys:
+        try:
+            await redis.rename(key, IMPORTING_HISTORY_PREFIX + key[len(LEGACY_HISTORY_PREFIX):])
+        except ResponseError:
+            # Another engine claimed it first
+            continue
+
+    imported = 0
+    # Also resumes imports interrupted by a restart
+    async for key in redis.scan_iter(match=f"{IMPORTING_HISTORY_PREFIX}*"):
+        installation_id = key[len(IMPORTING_HISTORY_PREFIX):]
+        raw_entries = await redis.lrange(key, 0, -1)
+        now = time.time()
+        pipe = redis.pipeline(transaction=False)
+        for i, raw in enumerate(raw_entries):
+            try:
+                entry = json.loads(raw)
+            except ValueError:
+                continue
+            if not isinstance(entry, dict) or not entry.get("repo") or not entry.get("pr_number"):
+                continue
+            entry.setdefault("installation_id", int(installation_id) if installation_id.isdigit() else installation_id)
+            # Later entries for the same PR replace earlier ones, as in the list
+            record_review(pipe, entry, completed_at=entry.get("completed_at") or now - (len(raw_entries) - i))
+            imported += 1
+            if len(pipe) >= batch:
+                await pipe.execute()
+        pipe.delete(key)
+        await pipe.execute()
+    if imported:
+        print(f"📦 Imported {imported} review(s) from the legacy history lists")
+    return imported
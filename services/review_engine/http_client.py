@@ -0,0 +1,71 @@
+import os
+import httpx
+
+# Overridable so the engine can run against a GitHub Enterprise host or the
+# local stand-ins in benchmarks/
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com").rstrip("/")
+GITHUB_MODELS_URL = os.getenv("GITHUB_MODELS_URL", "https://models.github.ai/inference/chat/completions")
+
+_client: httpx.AsyncClient | None = None
+
+
+class HTTPStatusError(RuntimeError):
+    """A GitHub or GitHub Models call answered with an error status, kept in `status_code`."""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def build_client() -> httpx.AsyncClient:
+    """
+    Build a keep-alive pooled client for GitHub and GitHub Models calls.
+    Pool limits, timeouts and HTTP/2 are configured from the environment, and
+    GitHub requests are throttled to the installation's rate limit budget.
+    """
+    limits = httpx.Limits(
+        max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", 100)),
+        max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20)),
+        keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30)),
+    )
+    timeout = httpx.Timeout(
+        float(os.getenv("HTTP_TIMEOUT", 30)),
+        connect=float(os.getenv("HTTP_CONNECT_TIMEOUT", 5)),
+    )
+
+    http2 = os.getenv("HTTP2_ENABLED", "true").lower() in ("1", "true", "yes")
+    if http2 and not _http2_available():
+        print("⚠️ HTTP2_ENABLED but the h2 package is not installed, using HTTP/1.1")
+        http2 = False
+
+    transport = httpx.AsyncHTTPTransport(limits=limits, http2=http2)
+    if os.getenv("GITHUB_RATE_LIMIT_AWARE", "true").lower() in ("1", "true", "yes"):
+        from services.review_engine.rate_limit import RateLimitTransport, rate_limiter
+
+        transport = RateLimitTransport(transport, rate_limiter, GITHUB_API_URL)
+    return httpx.AsyncClient(transport=transport, timeout=timeout)
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Return the application-wide client, creating it on first use
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = build_client()
+    return _client
+
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,221 @@
+import asyncio, json, os, socket, time
+from redis.exceptions import ResponseError
+
+# One stream per installation; producers register streams in STREAMS_KEY so
+# consumers never have to scan the keyspace. Stream entries reference a PR's
+# slot in the installation's pending hash, which holds the latest payload.
+# Jobs are produced by services/webhook_listener/jobs.py; the engine consumes.
+STREAM_PREFIX = "pr-review-stream:"
+STREAMS_KEY = "pr-review-streams"
+PENDING_PREFIX = "pr-review-pending:"
+INFLIGHT_PREFIX = "pr-review-inflight:"
+CONSUMER_GROUP = "review-engine"
+STREAM_MAXLEN = 10000
+WAKE_CHANNEL = "pr-review-wake"
+
+# KEYS: pending hash, inflight hash; ARGV: pr field, expected payload, entry id
+# Moves the PR's pending payload to the inflight hash under the stream entry id,
+# unless a newer event replaced it since it was read.
+TAKE_SCRIPT = """
+local inflight = redis.call('HGET', KEYS[2], ARGV[3])
+if inflight then
+  return inflight
+end
+if redis.call('HGET', KEYS[1], ARGV[1]) ~= ARGV[2] then
+  return false
+end
+redis.call('HDEL', KEYS[1], ARGV[1])
+redis.call('HSET', KEYS[2], ARGV[3], ARGV[2])
+return ARGV[2]
+"""
+
+
+def stream_key(installation_id) -> str:
+    return f"{STREAM_PREFIX}{installation_id}"
+
+
+def pending_key(installation_id) -> str:
+    return f"{PENDING_PREFIX}{installation_id}"
+
+
+def inflight_key(installation_id) -> str:
+    return f"{INFLIGHT_PREFIX}{installation_id}"
+
+
+def installation_from_stream(stream: str) -> str:
+    return stream[len(STREAM_PREFIX):]
+
+
+def default_consumer_name() -> str:
+    return os.getenv("REVIEW_CONSUMER_NAME") or f"{socket.gethostname()}-{os.getpid()}"
+
+
+class StreamJob:
+    """
+    A stream entry, carrying what is needed to load and acknowledge its job.
+
+    Entries normally reference a PR slot (`pr_field`); the payload is only
+    resolved by JobQueue.take when the job is about to run.
+    """
+
+    __slots__ = ("stream", "entry_id", "job", "pr_field")
+
+    def __init__(self, stream: str, entry_id: str, job: dict | None = None, pr_field: str | None = None):
+        self.stream = stream
+        self.entry_id = entry_id
+        self.job = job
+        self.pr_field = pr_field
+
+    @property
+    def installation_id(self) -> str:
+        return installation_from_stream(self.stream)
+
+    @property
+    def label(self) -> str:
+        if self.pr_field:
+            return self.pr_field
+        return f"{(self.job or {}).get('repo')}#{(self.job or {}).get('pr_number')}"
+
+
+class JobQueue:
+    """
+    Consumer-group reader over the per-installation job streams.
+
+    Entries stay pending until `ack` is called, so a job whose consumer dies
+    mid-review is picked up again by `reclaim` on another consumer.
+    """
+
+    def __init__(self, redis, consumer: str | None = None, group: str = CONSUMER_GROUP):
+        self.redis = redis
+        self.group = group
+        self.consumer = consumer or default_consumer_name()
+        self._streams: set[str] = set()
+
+    @property
+    def streams(self) -> list[str]:
+        return sorted(self._streams)
+
+    async def refresh_streams(self) -> list[str]:
+        """Pick up streams registered since the last call and join their groups."""
+        registered = await self.redis.smembers(STREAMS_KEY)
+        for stream in registered:
+            if stream not in self._streams:
+                await self._ensure_group(stream)
+                self._streams.add(stream)
+        return self.streams
+
+    async def _ensure_group(self, stream: str):
+        try:
+            await self.redis.xgroup_create(stream, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def _decode(self, stream: str, entry_id: str, fields: dict) -> StreamJob | None:
+        try:
+            if "pr" in fields:
+                return StreamJob(stream, entry_id, pr_field=fields["pr"])
+            return StreamJob(stream, entry_id, job=json.loads(fields["job"]))
+        except Exception:
+            print(f"❌ Failed to parse job {entry_id} from {stream}")
+            return None
+
+    async def take(self, entry: StreamJob) -> dict | None:
+        """
+        Resolve the job payload for an entry, claiming the PR's pending slot.
+
+        Waits out the debounce window (`not_before`), which later events for
+        the same PR may extend. Returns None if there is nothing left to run.
+        """
+        if entry.pr_field is None:
+            return entry.job
+
+        installation_id = entry.installation_id
+        pending, inflight = pending_key(installation_id), inflight_key(installation_id)
+        while True:
+            # A reclaimed entry may already have taken its payload
+            raw = await self.redis.hget(inflight, entry.entry_id)
+            if raw is not None:
+                break
+            raw = await self.redis.hget(pending, entry.pr_field)
+            if raw is None:
+                return None
+            wait = json.loads(raw).get("not_before", 0) - time.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            raw = await self.redis.eval(TAKE_SCRIPT, 2, pending, inflight, entry.pr_field, raw, entry.entry_id)
+            if raw is not None:
+                break
+
+        entry.job = json.loads(raw)
+        return entry.job
+
+    async def read(
+        self, streams: list[str], count: int = 1, block_ms: int | None = 1000, own_pending: bool = False
+    ) -> list[StreamJob]:
+        """
+        Read new entries for this consumer from the given streams; block_ms=None
+        never blocks. With own_pending, re-read entries already delivered to
+        this consumer name but never acked, e.g. by a process that crashed.
+        """
+        if not streams:
+            return []
+        start = "0" if own_pending else ">"
+        response = await self.redis.xreadgroup(
+            self.group, self.consumer, {s: start for s in streams}, count=count, block=None if own_pending else block_ms
+        )
+        jobs, malformed = [], []
+        for stream, entries in response or []:
+            for entry_id, fields in entries:
+                job = self._decode(stream, entry_id, fields)
+                if job:
+                    jobs.append(job)
+                else:
+                    malformed.append((stream, entry_id))
+        for stream, entry_id in malformed:
+            await self.ack_entry(stream, entry_id)
+        return jobs
+
+    async def reclaim(self, min_idle_ms: int, count: int = 10) -> list[StreamJob]:
+        """Take over entries left pending by consumers idle for at least min_idle_ms."""
+        jobs = []
+        for stream in self.streams:
+            result = await self.redis.xautoclaim(
+                stream, self.group, self.consumer, min_idle_ms, start_id="0-0", count=count
+            )
+            for entry_id, fields in result[1]:
+                if fields is None:
+                    continue
+                job = self._decode(stream, entry_id, fields)
+                if job:
+                    jobs.append(job)
+                else:
+                    await self.ack_entry(stream, entry_id)
+        return jobs
+
+    async def touch(self, entries: list[StreamJob]):
+        """
+        Reset the idle time of entries this consumer holds (XCLAIM JUSTID), so
+        a review running longer than the reclaim threshold is not taken over.
+        """
+        by_stream: dict[str, list[str]] = {}
+        for entry in entries:
+            by_stream.setdefault(entry.stream, []).append(entry.entry_id)
+        if not by_stream:
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        for stream, entry_ids in by_stream.items():
+            pipe.xclaim(stream, self.group, self.consumer, 0, entry_ids, justid=True)
+        await pipe.execute()
+
+    async def ack_entry(self, stream: str, entry_id: str):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.xack(stream, self.group, entry_id)
+        pipe.xdel(stream, entry_id)
+        pipe.hdel(inflight_key(installation_from_stream(stream)), entry_id)
+        await pipe.execute()
+
+    async def ack(self, job: StreamJob):
+        """Mark a job as done and drop it from its stream."""
+        await self.ack_entry(job.stream, job.entry_id)
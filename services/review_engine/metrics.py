@@ -0,0 +1,77 @@
+import time
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+from services.review_engine.job_queue import pending_key, installation_from_stream
+
+# Reviews span sub-second cache hits to multi-minute model calls
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, float("inf"))
+
+STAGE_SECONDS = Histogram(
+    "pr_review_stage_seconds",
+    "Time spent in each stage of a review job",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "pr_review_queue_wait_seconds",
+    "Time from enqueue to a job starting, per installation",
+    ["installation"],
+    buckets=STAGE_BUCKETS,
+)
+JOBS_TOTAL = Counter("pr_review_jobs_total", "Review jobs by outcome", ["outcome"])
+COMMENTS_TOTAL = Counter("pr_review_comments_total", "Review comments by posting result", ["result"])
+ERRORS_TOTAL = Counter("pr_review_errors_total", "Errors raised while processing jobs, by exception type", ["type"])
+# Gauge modes only apply under the multi-process worker (PROMETHEUS_MULTIPROC_DIR)
+QUEUE_DEPTH = Gauge(
+    "pr_review_queue_depth", "PRs waiting to be reviewed per installation", ["installation"],
+    multiprocess_mode="livemostrecent",
+)
+JOBS_IN_FLIGHT = Gauge(
+    "pr_review_jobs_in_flight", "Review jobs currently running in this engine", multiprocess_mode="livesum"
+)
+GITHUB_RATE_REMAINING = Gauge(
+    "pr_review_github_rate_remaining", "Last reported GitHub rate limit budget", ["installation", "resource"],
+    multiprocess_mode="livemostrecent",
+)
+GITHUB_BACKOFFS_TOTAL = Counter("pr_review_github_backoffs_total", "Rate limited GitHub responses backed off on", ["reason"])
+
+
+def observe_stage(stage: str):
+    """Context manager timing a block into the stage histogram."""
+    return STAGE_SECONDS.labels(stage).time()
+
+
+def observe_duration(stage: str, seconds: float):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def record_error(e: BaseException):
+    ERRORS_TOTAL.labels(type(e).__name__).inc()
+
+
+def entry_age(entry_id: str, now: float | None = None) -> float:
+    """Seconds since a stream entry was added, from the millisecond part of its id."""
+    millis = int(entry_id.split("-", 1)[0])
+    return max((now or time.time()) - millis / 1000, 0.0)
+
+
+def observe_queue_wait(entry_id: str, installation_id):
+    age = entry_age(entry_id)
+    STAGE_SECONDS.labels("queue_wait").observe(age)
+    QUEUE_WAIT_SECONDS.labels(str(installation_id)).observe(age)
+
+
+async def refresh_queue_depth(redis, streams: list[str]):
+    """Set the queue depth gauge from the size of each installation's pending hash."""
+    if not streams:
+        return
+    pipe = redis.pipeline(transaction=False)
+    for stream in streams:
+        pipe.hlen(pending_key(installation_from_stream(stream)))
+    for stream, depth in zip(streams, await pipe.execute()):
+        QUEUE_DEPTH.labels(installation_from_stream(stream)).set(depth)
+
+
+def render_metrics():
+    """Return the exposition body and its content type."""
+    return generate_latest(), CONTENT_TYPE_LATEST
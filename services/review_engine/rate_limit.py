@@ -0,0 +1,190 @@
+import asyncio, hashlib, os, random, time
+from urllib.parse import urlparse
+import httpx
+
+from services.review_engine.metrics import GITHUB_RATE_REMAINING, GITHUB_BACKOFFS_TOTAL
+
+# Requests kept in reserve per bucket; below this we wait for the reset
+RATE_LIMIT_RESERVE = int(os.getenv("GITHUB_RATE_LIMIT_RESERVE", 50))
+# Start spacing requests out once less than this fraction of the budget is left
+RATE_LIMIT_PACE_BELOW = float(os.getenv("GITHUB_RATE_LIMIT_PACE_BELOW", 0.2))
+# Longest we are willing to sleep for a limit before handing the error back
+RATE_LIMIT_MAX_WAIT = float(os.getenv("GITHUB_RATE_LIMIT_MAX_WAIT", 900))
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("GITHUB_RATE_LIMIT_MAX_RETRIES", 3))
+# GitHub asks for at least a minute's pause after a secondary limit without Retry-After
+SECONDARY_LIMIT_BACKOFF = float(os.getenv("GITHUB_SECONDARY_LIMIT_BACKOFF", 60))
+
+
+class RateBucket:
+    """Last known budget for one installation and resource."""
+
+    __slots__ = ("limit", "remaining", "reset_at", "next_slot")
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset_at = 0.0
+        self.next_slot = 0.0
+
+
+class GitHubRateLimiter:
+    """
+    Tracks GitHub's rate limit headers per installation and resource (core,
+    graphql, ...) and decides how long a request should wait before it is sent.
+
+    Installation tokens are mapped back to their installation through
+    `register_token`, so a refreshed token keeps the installation's budget.
+    """
+
+    def __init__(self, reserve: int | None = None, pace_below: float | None = None):
+        self.reserve = RATE_LIMIT_RESERVE if reserve is None else reserve
+        self.pace_below = RATE_LIMIT_PACE_BELOW if pace_below is None else pace_below
+        self._buckets: dict[tuple[str, str], RateBucket] = {}
+        # Secondary limits apply to the whole installation, whatever the resource
+        self._blocked_until: dict[str, float] = {}
+        self._installations: dict[str, str] = {}
+        self._tokens: dict[str, str] = {}
+
+    def register_token(self, token: str, installation_id):
+        owner = str(installation_id)
+        previous = self._tokens.get(owner)
+        if previous and previous != token:
+            self._installations.pop(previous, None)
+        self._tokens[owner] = token
+        self._installations[token] = owner
+
+    def identity(self, request: httpx.Request) -> str:
+        auth = request.headers.get("Authorization", "")
+        token = auth.split(" ", 1)[-1]
+        if not token:
+            return "anonymous"
+        if token in self._installations:
+            return self._installations[token]
+        if token.count(".") == 2:
+            return "app"  # App JWT
+        return "token:" + hashlib.sha1(token.encode()).hexdigest()[:12]
+
+    @staticmethod
+    def resource(request: httpx.Request) -> str:
+        return "graphql" if request.url.path.rstrip("/").endswith("/graphql") else "core"
+
+    def bucket(self, identity: str, resource: str) -> RateBucket:
+        return self._buckets.setdefault((identity, resource), RateBucket())
+
+    def delay(self, identity: str, resource: str, now: float | None = None) -> float:
+        """
+        Seconds to hold a request back, reserving its slot.
+
+        Waits for the reset once the bucket is down to the reserve, and below
+        `pace_below` of the limit spreads the remaining budget evenly over the
+        time left in the window.
+        """
+        now = now or time.time()
+        wait = max(self._blocked_until.get(identity, 0) - now, 0)
+        bucket = self.bucket(identity, resource)
+        if bucket.remaining is None or bucket.reset_at <= now:
+            return wait
+
+        window = bucket.reset_at - now
+        if bucket.remaining <= self.reserve:
+            return max(wait, window)
+        if bucket.limit and bucket.remaining < bucket.limit * self.pace_below:
+            interval = window / (bucket.remaining - self.reserve)
+            slot = max(now + wait, bucket.next_slot)
+            bucket.next_slot = slot + interval
+            # Count the request against the budget until the response says otherwise
+            bucket.remaining -= 1
+            return slot - now
+        return wait
+
+    def update(self, identity: str, request: httpx.Request, response: httpx.Response):
+        headers = response.headers
+        if "x-ratelimit-remaining" not in headers:
+            return
+        resource = headers.get("x-ratelimit-resource") or self.resource(request)
+        bucket = self.bucket(identity, resource)
+        try:
+            bucket.remaining = int(headers["x-ratelimit-remaining"])
+            bucket.limit = int(headers.get("x-ratelimit-limit") or bucket.limit or 0) or None
+            bucket.reset_at = float(headers.get("x-ratelimit-reset") or bucket.reset_at)
+        except ValueError:
+            return
+        GITHUB_RATE_REMAINING.labels(identity, resource).set(bucket.remaining)
+
+    def backoff(self, identity: str, response: httpx.Response, body: str, attempt: int, now: float | None = None):
+        """
+        Seconds to wait before retrying a 403/429, or None if it is not a rate limit.
+        """
+        now = now or time.time()
+        headers = response.headers
+        retry_after = headers.get("retry-after")
+        if retry_after:
+            try:
+                wait = float(retry_after)
+            except ValueError:
+                wait = SECONDARY_LIMIT_BACKOFF
+            reason = "retry_after"
+        elif headers.get("x-ratelimit-remaining") == "0":
+            wait = max(float(headers.get("x-ratelimit-reset", now)) - now, 1)
+            reason = "primary"
+        elif response.status_code == 429 or "rate limit" in body.lower():
+            wait = SECONDARY_LIMIT_BACKOFF * 2 ** attempt
+            reason = "secondary"
+        else:
+            return None
+
+        # A little jitter so concurrent jobs do not all retry at once
+        wait += random.uniform(0, min(wait * 0.1, 5))
+        self._blocked_until[identity] = max(self._blocked_until.get(identity, 0), now + wait)
+        GITHUB_BACKOFFS_TOTAL.labels(reason).inc()
+        return wait
+
+
+class RateLimitTransport(httpx.AsyncBaseTransport):
+    """
+    Transport that applies a GitHubRateLimiter to requests for the GitHub
+    API host; other hosts (GitHub Models) pass straight through.
+
+    Rate limited responses are retried after the advertised wait, up to
+    RATE_LIMIT_MAX_RETRIES times and RATE_LIMIT_MAX_WAIT seconds; past that
+    the response is returned and the caller's usual error handling applies.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, limiter: GitHubRateLimiter, api_url: str):
+        self.transport = transport
+        self.limiter = limiter
+        self.api_host = urlparse(api_url).netloc
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if request.url.netloc.decode() != self.api_host:
+            return await self.transport.handle_async_request(request)
+
+        identity = self.limiter.identity(request)
+        resource = self.limiter.resource(request)
+        attempt = 0
+        while True:
+            wait = self.limiter.delay(identity, resource)
+            if wait > RATE_LIMIT_MAX_WAIT:
+                print(f"⚠️ GitHub {resource} budget for {identity} exhausted for {wait:.0f}s, sending anyway")
+            elif wait > 0:
+                await asyncio.sleep(wait)
+
+            response = await self.transport.handle_async_request(request)
+            self.limiter.update(identity, request, response)
+            if response.status_code not in (403, 429) or attempt >= RATE_LIMIT_MAX_RETRIES:
+                return response
+
+            body = (await response.aread()).decode(errors="replace")
+            backoff = self.limiter.backoff(identity, response, body, attempt)
+            if backoff is None or backoff > RATE_LIMIT_MAX_WAIT:
+                return response
+
+            await response.aclose()
+            attempt += 1
+            print(f"⏳ GitHub rate limit for {identity} ({response.status_code}), retrying in {backoff:.1f}s")
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+rate_limiter = GitHubRateLimiter()
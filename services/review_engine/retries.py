@@ -0,0 +1,171 @@
+import asyncio, json, os, random, time
+
+import httpx
+
+from services.review_engine.http_client import HTTPStatusError
+from services.review_engine.job_queue import (
+    pending_key, stream_key, STREAMS_KEY, STREAM_MAXLEN, WAKE_CHANNEL,
+)
+
+# Failed jobs wait in RETRY_KEY (member -> due time) with their payload in
+# RETRY_JOBS_KEY until the promoter puts them back on their installation's
+# stream. Members are "{installation_id}:{repo}#{pr_number}", so a PR has at
+# most one retry scheduled. Jobs out of attempts, or failing in a way retrying
+# cannot fix, go to the installation's dead-letter hash (keyed by PR) instead.
+# The listener reads both in services/webhook_listener/jobs.py.
+RETRY_KEY = "pr-review-retry"
+RETRY_JOBS_KEY = "pr-review-retry-jobs"
+DEAD_LETTER_PREFIX = "pr-review-dead-letter:"
+
+MAX_ATTEMPTS = int(os.getenv("REVIEW_MAX_ATTEMPTS", 5))
+RETRY_MAX_DELAY = float(os.getenv("REVIEW_RETRY_MAX_DELAY", 1800))
+RETRY_POLL_INTERVAL = float(os.getenv("REVIEW_RETRY_POLL_INTERVAL", 5))
+PROMOTE_BATCH = 100
+
+# Error kind -> first retry delay in seconds; None means retrying cannot help
+BACKOFF_BASE = {
+    "rate_limited": 60,
+    "timeout": 20,
+    "server": 15,
+    "network": 10,
+    "unknown": 30,
+    "client": None,
+}
+
+# KEYS: retry zset, retry jobs hash, pending hash, stream, streams set
+# ARGV: member, pr field, stream maxlen, wake channel
+# Claims a due retry (only one engine wins the ZREM) and queues it like the
+# listener does. A payload already pending for the PR is newer and wins.
+PROMOTE_SCRIPT = """
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 0 then
+  return -1
+end
+local job = redis.call('HGET', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+if not job then
+  return -1
+end
+local created = redis.call('HSETNX', KEYS[3], ARGV[2], job)
+if created == 1 then
+  redis.call('XADD', KEYS[4], 'MAXLEN', '~', ARGV[3], '*', 'pr', ARGV[2])
+  redis.call('SADD', KEYS[5], KEYS[4])
+  redis.call('PUBLISH', ARGV[4], KEYS[4])
+end
+return created
+"""
+
+
+def dead_letter_key(installation_id) -> str:
+    return f"{DEAD_LETTER_PREFIX}{installation_id}"
+
+
+def retry_member(job: dict) -> str:
+    return f"{job['installation_id']}:{job['repo']}#{job['pr_number']}"
+
+
+def classify_error(e: Exception) -> str:
+    """Map a job failure to a key of BACKOFF_BASE."""
+    if isinstance(e, (httpx.TimeoutException, asyncio.TimeoutError)):
+        return "timeout"
+    if isinstance(e, httpx.TransportError):
+        return "network"
+    if isinstance(e, HTTPStatusError):
+        status = e.status_code
+    elif isinstance(e, httpx.HTTPStatusError):
+        status = e.response.status_code
+    else:
+        return "unknown"
+    if status == 429 or (status == 403 and "rate limit" in str(e).lower()):
+        return "rate_limited"
+    if status >= 500:
+        return "server"
+    return "client"
+
+
+def backoff_delay(kind: str, attempt: int, rng=random) -> float:
+    """Exponential backoff from the kind's base delay, with jitter over the upper half."""
+    delay = min(BACKOFF_BASE[kind] * 2 ** (attempt - 1), RETRY_MAX_DELAY)
+    return rng.uniform(delay / 2, delay)
+
+
+async def retry_or_dead_letter(redis, job: dict, error: Exception, now: float | None = None) -> str:
+    """
+    Schedule a failed job's next attempt, or dead-letter it once retrying is
+    pointless. Returns "retrying" or "dead_lettered".
+    """
+    now = time.time() if now is None else now
+    kind = classify_error(error)
+    attempt = int(job.get("attempt", 1))
+    member = retry_member(job)
+
+    if BACKOFF_BASE[kind] is not None and attempt < MAX_ATTEMPTS:
+        delay = backoff_delay(kind, attempt)
+        retry = {**job, "attempt": attempt + 1, "last_error": kind}
+        retry.pop("not_before", None)
+        pipe = redis.pipeline(transaction=True)
+        pipe.hset(RETRY_JOBS_KEY, member, json.dumps(retry))
+        pipe.zadd(RETRY_KEY, {member: now + delay})
+        await pipe.execute()
+        print(f"🔁 Retrying {member} in {delay:.0f}s (attempt {attempt + 1}/{MAX_ATTEMPTS}, {kind})")
+        return "retrying"
+
+    entry = {
+        "job": job,
+        "error": str(error)[:1000],
+        "error_type": kind,
+        "attempts": attempt,
+        "failed_at": now,
+    }
+    field = f"{job['repo']}#{job['pr_number']}"
+    await redis.hset(dead_letter_key(job["installation_id"]), field, json.dumps(entry))
+    print(f"🪦 Dead-lettered {member} after {attempt} attempt(s) ({kind})")
+    return "dead_lettered"
+
+
+async def clear_failures(redis, job: dict):
+    """Forget the PR's scheduled retry and dead letter once a review of it succeeded."""
+    member = retry_member(job)
+    pipe = redis.pipeline(transaction=True)
+    pipe.zrem(RETRY_KEY, member)
+    pipe.hdel(RETRY_JOBS_KEY, member)
+    pipe.hdel(dead_letter_key(job["installation_id"]), f"{job['repo']}#{job['pr_number']}")
+    await pipe.execute()
+
+
+async def promote_due(redis, now: float | None = None, limit: int = PROMOTE_BATCH) -> int:
+    """Move retries whose time has come back onto their streams; returns how many were queued."""
+    now = time.time() if now is None else now
+    members = await redis.zrangebyscore(RETRY_KEY, "-inf", now, start=0, num=limit)
+    promoted = 0
+    for member in members:
+        installation_id, _, pr_field = member.partition(":")
+        created = await redis.eval(
+            PROMOTE_SCRIPT,
+            5,
+            RETRY_KEY,
+            RETRY_JOBS_KEY,
+            pending_key(installation_id),
+            stream_key(installation_id),
+            STREAMS_KEY,
+            member,
+            pr_field,
+            STREAM_MAXLEN,
+            WAKE_CHANNEL,
+        )
+        promoted += created == 1
+    return promoted
+
+
+async def retry_promoter(redis, interval: float | None = None):
+    """Promote due retries forever; every engine runs one, the script keeps it exactly-once."""
+    interval = interval or RETRY_POLL_INTERVAL
+    while True:
+        try:
+            promoted = await promote_due(redis)
+            if promoted:
+                print(f"🔁 Requeued {promoted} job(s) for retry")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️ Retry promoter error: {e}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,103 @@
+import hashlib, json, os, re, time
+
+CACHE_PREFIX = "pr-review-cache:"
+CACHE_INDEX_KEY = "pr-review-cache-index"
+HUNK_RANGE = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@", re.MULTILINE)
+
+
+def hunk_key(model: str, prompt_version: str, path: str, hunk: str) -> str:
+    digest = hashlib.sha256("\0".join((model, prompt_version, path, hunk)).encode()).hexdigest()
+    return f"{CACHE_PREFIX}{digest}"
+
+
+def hunk_new_range(hunk: str):
+    """Return the (first, last) new-file line covered by a hunk, or None."""
+    match = HUNK_RANGE.search(hunk)
+    if not match:
+        return None
+    start = int(match.group(1))
+    count = int(match.group(2)) if match.group(2) is not None else 1
+    return start, start + max(count, 1) - 1
+
+
+def assign_comments(chunks, comments):
+    """
+    Attribute each comment to the chunk it refers to, by path and new-file line.
+    Comments whose line matches no hunk go to the first hunk of their file;
+    comments on files outside `chunks` are dropped from the result.
+    """
+    assigned = [[] for _ in chunks]
+    by_path = {}
+    for i, chunk in enumerate(chunks):
+        by_path.setdefault(chunk["path"], []).append(i)
+
+    for comment in comments:
+        indexes = by_path.get(comment.get("path"))
+        if not indexes:
+            continue
+        target = indexes[0]
+        line = comment.get("line")
+        if isinstance(line, int):
+            for i in indexes:
+                span = hunk_new_range(chunks[i]["hunk"])
+                if span and span[0] <= line <= span[1]:
+                    target = i
+                    break
+        assigned[target].append(comment)
+    return assigned
+
+
+class ReviewCache:
+    """
+    Redis cache of model review comments per hunk.
+
+    Entries are content-addressed by model, prompt version, file path and hunk
+    text, expire after `ttl` seconds, and the least recently used entries are
+    evicted once more than `max_entries` are stored.
+    """
+
+    def __init__(self, redis, model: str, prompt_version: str, ttl: int | None = None, max_entries: int | None = None):
+        self.redis = redis
+        self.model = model
+        self.prompt_version = prompt_version
+        self.ttl = ttl or int(os.getenv("REVIEW_CACHE_TTL", 7 * 24 * 3600))
+        self.max_entries = max_entries or int(os.getenv("REVIEW_CACHE_MAX_ENTRIES", 50000))
+
+    def key(self, chunk) -> str:
+        return hunk_key(self.model, self.prompt_version, chunk["path"], chunk["hunk"])
+
+    async def lookup(self, chunks):
+        """Return cached comment lists for chunks, with None for misses."""
+        if not chunks:
+            return []
+        keys = [self.key(c) for c in chunks]
+        values = await self.redis.mget(keys)
+
+        hits = [k for k, v in zip(keys, values) if v is not None]
+        if hits:
+            # Refresh recency for LRU eviction
+            now = time.time()
+            await self.redis.zadd(CACHE_INDEX_KEY, {k: now for k in hits})
+
+        return [json.loads(v) if v is not None else None for v in values]
+
+    async def store(self, chunks, comments_per_chunk):
+        if not chunks:
+            return
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=False)
+        index = {}
+        for chunk, comments in zip(chunks, comments_per_chunk):
+            key = self.key(chunk)
+            pipe.set(key, json.dumps(comments), ex=self.ttl)
+            index[key] = now
+        pipe.zadd(CACHE_INDEX_KEY, index)
+        # Forget index entries whose keys have already expired
+        pipe.zremrangebyscore(CACHE_INDEX_KEY, "-inf", now - self.ttl)
+        pipe.zcard(CACHE_INDEX_KEY)
+        size = (await pipe.execute())[-1]
+
+        if size > self.max_entries:
+            evicted = await self.redis.zpopmin(CACHE_INDEX_KEY, size - self.max_entries)
+            if evicted:
+                await self.redis.delete(*[key for key, _ in evicted])
@@ -0,0 +1,220 @@
+"""
+Per-repo review settings: which changed files are sent to the model and how
+much of a PR is reviewed.
+
+Defaults come from config/default-config.yaml. A repo can override any key
+with a `.github/pr-review.yml` at the reviewed commit.
+"""
+import os, re
+from collections import OrderedDict
+from pathlib import Path
+
+import yaml
+
+from services.review_engine.http_client import get_http_client, GITHUB_API_URL
+
+BUNDLED_CONFIG_PATH = Path(__file__).resolve().parents[2] / "config" / "default-config.yaml"
+# An empty REVIEW_DEFAULT_CONFIG means the bundled file, not the current directory
+DEFAULT_CONFIG_PATH = Path(os.getenv("REVIEW_DEFAULT_CONFIG") or BUNDLED_CONFIG_PATH)
+REPO_CONFIG_PATH = os.getenv("REVIEW_REPO_CONFIG_PATH", ".github/pr-review.yml")
+CONFIG_CACHE_SIZE = int(os.getenv("REVIEW_CONFIG_CACHE_SIZE", 256))
+
+SETTINGS = ("include", "exclude", "generated", "max_file_patch_bytes", "max_pr_changes")
+
+_defaults: dict | None = None
+_configs: "OrderedDict[tuple[str, str], ReviewConfig]" = OrderedDict()
+
+
+def glob_to_regex(pattern: str) -> str:
+    """
+    Translate a .gitignore-style glob into a regex for full-path matching.
+    """
+    pattern = pattern.strip()
+    # Like .gitignore, a pattern with no inner `/` matches at any depth
+    anchored = "/" in pattern.rstrip("/")
+    pattern = pattern.lstrip("/")
+    if pattern.endswith("/"):
+        pattern += "**"
+
+    parts, i = [], 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            parts.append("[^/]")
+            i += 1
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    return ("" if anchored else "(?:.*/)?") + "".join(parts)
+
+
+def compile_globs(patterns):
+    """Compile a list of globs into one regex, or None when the list is empty."""
+    patterns = [p for p in (patterns or []) if isinstance(p, str) and p.strip()]
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{glob_to_regex(p)})" for p in patterns))
+
+
+def _limit(value) -> int:
+    try:
+        return max(int(value or 0), 0)
+    except (TypeError, ValueError):
+        print(f"⚠️ Invalid review config limit {value!r}, ignoring")
+        return 0
+
+
+class ReviewConfig:
+    """Compiled review settings for one repo and commit."""
+
+    __slots__ = ("include", "exclude", "generated", "max_file_patch_bytes", "max_pr_changes")
+
+    def __init__(self, settings: dict):
+        self.include = compile_globs(settings.get("include"))
+        self.exclude = compile_globs(settings.get("exclude"))
+        self.generated = compile_globs(settings.get("generated"))
+        self.max_file_patch_bytes = _limit(settings.get("max_file_patch_bytes"))
+        self.max_pr_changes = _limit(settings.get("max_pr_changes"))
+
+    def path_reason(self, path: str):
+        """Why a path is not reviewed, or None if it is."""
+        if self.include and not self.include.fullmatch(path):
+            return "not_included"
+        if self.exclude and self.exclude.fullmatch(path):
+            return "excluded"
+        if self.generated and self.generated.fullmatch(path):
+            return "generated"
+        return None
+
+    def file_reason(self, f: dict):
+        """Why a REST file entry (`filename`, `patch`) is not reviewed, or None."""
+        reason = self.path_reason(f["filename"])
+        if reason:
+            return reason
+        if self.max_file_patch_bytes and len((f.get("patch") or "").encode()) > self.max_file_patch_bytes:
+            return "patch_too_large"
+        return None
+
+    def selection(self) -> "FileSelection":
+        return FileSelection(self)
+
+    def select(self, files) -> dict:
+        """
+        Decide which of the PR's files (`path`, `additions`, `deletions`) are
+        skipped, taking them in order while they fit in max_pr_changes.
+        Returns {path: reason} for the skipped ones.
+        """
+        selection = self.selection()
+        for f in files:
+            selection.add(f["path"], f.get("additions"), f.get("deletions"))
+        return selection.skipped
+
+
+class FileSelection:
+    """
+    A PR's file selection built up as its file list arrives: each file is
+    judged once, against the change budget left by the files before it.
+    """
+
+    __slots__ = ("config", "skipped", "seen", "total")
+
+    def __init__(self, config: ReviewConfig):
+        self.config = config
+        self.skipped: dict[str, str] = {}
+        self.seen: set[str] = set()
+        self.total = 0
+
+    def add(self, path: str, additions=0, deletions=0):
+        """Why the file is not reviewed, or None if it fits."""
+        if path in self.seen:
+            return self.skipped.get(path)
+        self.seen.add(path)
+        reason = self.config.path_reason(path)
+        if not reason:
+            changes = (additions or 0) + (deletions or 0)
+            if self.config.max_pr_changes and self.total + changes > self.config.max_pr_changes:
+                reason = "pr_change_limit"
+            else:
+                self.total += changes
+        if reason:
+            self.skipped[path] = reason
+        return reason
+
+
+def load_settings(path) -> dict:
+    with open(path) as f:
+        settings = yaml.safe_load(f) or {}
+    if not isinstance(settings, dict):
+        raise ValueError(f"{path} must contain a mapping")
+    return settings
+
+
+def default_settings() -> dict:
+    global _defaults
+    if _defaults is None:
+        try:
+            _defaults = load_settings(DEFAULT_CONFIG_PATH)
+        except (OSError, ValueError, yaml.YAMLError) as e:
+            if DEFAULT_CONFIG_PATH != BUNDLED_CONFIG_PATH:
+                print(f"❌ REVIEW_DEFAULT_CONFIG={DEFAULT_CONFIG_PATH} could not be loaded ({e}), no file filtering applies")
+            else:
+                print(f"⚠️ Could not load {DEFAULT_CONFIG_PATH} ({e}), reviewing every file")
+            _defaults = {}
+    return _defaults
+
+
+async def fetch_repo_settings(owner, name, ref, github_token, client=None) -> dict:
+    """
+    Read the repo's override file at `ref`. A missing or invalid file means
+    no overrides; it never fails the review.
+    """
+    client = client or get_http_client()
+    resp = await client.get(
+        f"{GITHUB_API_URL}/repos/{owner}/{name}/contents/{REPO_CONFIG_PATH}",
+        params={"ref": ref},
+        headers={
+            "Authorization": f"Bearer {github_token}",
+            "Accept": "application/vnd.github.raw+json",
+        },
+    )
+    if resp.status_code == 404:
+        return {}
+    if resp.status_code != 200:
+        print(f"⚠️ Could not read {REPO_CONFIG_PATH} from {owner}/{name} ({resp.status_code}), using defaults")
+        return {}
+    try:
+        settings = yaml.safe_load(resp.text) or {}
+    except yaml.YAMLError as e:
+        print(f"⚠️ Invalid {REPO_CONFIG_PATH} in {owner}/{name}: {e}")
+        return {}
+    if not isinstance(settings, dict):
+        print(f"⚠️ {REPO_CONFIG_PATH} in {owner}/{name} is not a mapping, using defaults")
+        return {}
+    return settings
+
+
+async def load_review_config(owner, name, ref, github_token, client=None) -> ReviewConfig:
+    """
+    Review settings for a repo at a commit: the defaults with the repo's
+    overrides applied, compiled once and cached per repo and commit.
+    """
+    key = (f"{owner}/{name}", ref)
+    config = _configs.get(key)
+    if config is not None:
+        _configs.move_to_end(key)
+        return config
+
+    overrides = await fetch_repo_settings(owner, name, ref, github_token, client=client)
+    settings = {**default_settings(), **{k: v for k, v in overrides.items() if k in SETTINGS}}
+    config = _configs[key] = ReviewConfig(settings)
+    while len(_configs) > CONFIG_CACHE_SIZE:
+        _configs.popitem(last=False)
+    return config
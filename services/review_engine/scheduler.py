@@ -0,0 +1,118 @@
+import math, os, time
+from collections import deque
+
+from services.review_engine.job_queue import StreamJob
+from services.review_engine.metrics import entry_age
+
+# Weights below this would take too many rounds to earn a single job
+MIN_WEIGHT = 0.01
+
+
+def parse_weights(spec: str) -> dict[str, float]:
+    """Parse "123=2,456=0.5" into installation weights; bad items are skipped."""
+    weights = {}
+    for part in (spec or "").split(","):
+        installation, _, weight = part.partition("=")
+        if not installation.strip():
+            continue
+        try:
+            weights[installation.strip()] = max(float(weight), MIN_WEIGHT)
+        except ValueError:
+            print(f"⚠️ Ignoring invalid installation weight {part!r}")
+    return weights
+
+
+class FairScheduler:
+    """
+    Deficit round robin over the installations with jobs delivered to this
+    engine.
+
+    Each installation earns its weight (1 by default) in credit when its turn
+    comes and spends one credit per job, so a deep queue cannot starve the
+    others. A job that has waited longer than `max_wait` seconds since it was
+    enqueued is served ahead of the rotation, oldest first.
+    """
+
+    def __init__(self, weights: dict[str, float] | None = None, max_wait: float | None = None):
+        if weights is None:
+            weights = parse_weights(os.getenv("REVIEW_INSTALLATION_WEIGHTS", ""))
+        self.weights = weights
+        self.max_wait = max_wait if max_wait is not None else float(os.getenv("REVIEW_MAX_QUEUE_WAIT", 300))
+        self._queues: dict[str, deque] = {}
+        self._deficit: dict[str, float] = {}
+        # Installations with queued jobs; the head is the one whose turn it is
+        self._ring: deque[str] = deque()
+        self._head_credited = False
+
+    def __len__(self):
+        return sum(len(q) for q in self._queues.values())
+
+    def weight(self, installation_id) -> float:
+        return self.weights.get(str(installation_id), 1.0)
+
+    def wanted(self, installation_id) -> int:
+        """
+        How many more entries to read for an installation. Keeping ceil(weight)
+        queued lets a heavier installation spend its whole credit in one turn.
+        """
+        key = str(installation_id)
+        return max(math.ceil(self.weight(key)) - len(self._queues.get(key, ())), 0)
+
+    def has_ready(self, is_ready) -> bool:
+        return any(is_ready(key) for key in self._ring)
+
+    def entries(self) -> list[StreamJob]:
+        return [e for q in self._queues.values() for e in q]
+
+    def entry_ids(self) -> set[str]:
+        return {e.entry_id for e in self.entries()}
+
+    def push(self, entry: StreamJob):
+        key = str(entry.installation_id)
+        queue = self._queues.setdefault(key, deque())
+        if not queue:
+            self._ring.append(key)
+            self._deficit[key] = 0.0
+        queue.append(entry)
+
+    def pop(self, is_ready=None, now: float | None = None) -> StreamJob | None:
+        """
+        Return the next job to run among installations for which is_ready()
+        is true (e.g. those below their concurrency cap), or None.
+        """
+        is_ready = is_ready or (lambda installation_id: True)
+        ready = [key for key in self._ring if is_ready(key)]
+        if not ready:
+            return None
+
+        # Max-wait guarantee comes before fairness
+        now = now or time.time()
+        age, oldest = max((entry_age(self._queues[key][0].entry_id, now), key) for key in ready)
+        if age >= self.max_wait:
+            print(f"⏰ Job for installation {oldest} waited {age:.0f}s, serving it out of turn")
+            self._deficit[oldest] -= 1
+            return self._take(oldest)
+
+        while True:
+            key = self._ring[0]
+            if is_ready(key):
+                if self._deficit[key] < 1 and not self._head_credited:
+                    self._deficit[key] += self.weight(key)
+                    self._head_credited = True
+                if self._deficit[key] >= 1:
+                    self._deficit[key] -= 1
+                    return self._take(key)
+            self._ring.rotate(-1)
+            self._head_credited = False
+
+    def _take(self, key: str) -> StreamJob:
+        queue = self._queues[key]
+        entry = queue.popleft()
+        if not queue:
+            # An installation that runs dry forfeits its unused credit
+            if self._ring[0] == key:
+                self._head_credited = False
+            self._ring.remove(key)
+            del self._queues[key]
+            del self._deficit[key]
+        return entry
@@ -0,0 +1,242 @@
+"""
+Standalone review worker, independent of the HTTP app:
+
+    python -m services.review_engine.worker --processes 4
+
+The supervisor runs one review loop per child process, each with its own
+event loop and a stable consumer name, so a restarted child picks up the
+entries its predecessor was handed. Crashed children are restarted with
+backoff. SIGTERM drains: children stop taking jobs and finish the ones in
+flight before exiting.
+
+One setting, REVIEW_STOP_GRACE_PERIOD (--stop-grace-period), sizes the whole
+shutdown: docker-compose gives the container that long after SIGTERM, the
+supervisor kills children still alive SHUTDOWN_MARGIN seconds before that,
+and jobs get SHUTDOWN_MARGIN seconds less again to drain (drain_deadlines).
+
+Children register in Redis with heartbeats (WORKERS_KEY, worker_key). With
+--metrics-port, the supervisor serves the children's metrics aggregated
+through prometheus_client's multi-process mode.
+"""
+import argparse, asyncio, json, multiprocessing, os, signal, socket, tempfile, time
+from pathlib import Path
+
+# Live workers (member: consumer name, score: last heartbeat), details in worker_key
+WORKERS_KEY = "pr-review-workers"
+WORKER_PREFIX = "pr-review-worker:"
+
+HEARTBEAT_INTERVAL = float(os.getenv("REVIEW_HEARTBEAT_INTERVAL", 10))
+HEARTBEAT_TTL = int(os.getenv("REVIEW_HEARTBEAT_TTL", 30))
+# A child that ran this long before crashing is restarted right away
+STABLE_AFTER = 60
+MAX_RESTART_DELAY = 60
+# Seconds after SIGTERM before the container runtime kills everything
+STOP_GRACE_PERIOD = float(os.getenv("REVIEW_STOP_GRACE_PERIOD", 330))
+# Time kept back at each shutdown step: unregistering and closing connections,
+# then reaping children before the runtime's SIGKILL
+SHUTDOWN_MARGIN = 15
+
+
+def worker_key(consumer: str) -> str:
+    return f"{WORKER_PREFIX}{consumer}"
+
+
+def drain_deadlines(stop_grace_period: float) -> tuple[float, float]:
+    """(drain timeout for jobs, deadline to kill children), in seconds after SIGTERM."""
+    kill_after = max(stop_grace_period - SHUTDOWN_MARGIN, 0)
+    return max(kill_after - SHUTDOWN_MARGIN, 0), kill_after
+
+
+async def heartbeat(redis, consumer: str, slot: int, stop: asyncio.Event, interval: float | None = None):
+    """Keep this worker's registration fresh, and drop workers whose heartbeat lapsed."""
+    from services.review_engine import engine
+    from services.review_engine.metrics import refresh_queue_depth
+
+    interval = interval or HEARTBEAT_INTERVAL
+    started_at = time.time()
+    while True:
+        now = time.time()
+        pool = engine._pool
+        info = {
+            "consumer": consumer,
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "slot": slot,
+            "started_at": started_at,
+            "heartbeat_at": now,
+            "in_flight": len(pool) if pool else 0,
+            "state": "draining" if stop.is_set() else "running",
+        }
+        try:
+            pipe = redis.pipeline(transaction=False)
+            pipe.set(worker_key(consumer), json.dumps(info), ex=HEARTBEAT_TTL)
+            pipe.zadd(WORKERS_KEY, {consumer: now})
+            pipe.zremrangebyscore(WORKERS_KEY, "-inf", now - HEARTBEAT_TTL)
+            await pipe.execute()
+            if engine._queue is not None:
+                await refresh_queue_depth(redis, engine._queue.streams)
+        except Exception as e:
+            print(f"⚠️ Heartbeat failed for {consumer}: {e}")
+        await asyncio.sleep(interval)
+
+
+async def run_worker(slot: int, consumer: str, drain_timeout: float) -> bool:
+    """One child's review loop; returns True when it stopped because it was asked to."""
+    from redis.asyncio import from_url
+    from services.review_engine import engine
+    from services.review_engine.http_client import get_http_client, close_http_client
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    redis = from_url(os.getenv("REDIS_URL_DOCKER", "").strip(), decode_responses=True)
+    get_http_client()
+    beat = asyncio.create_task(heartbeat(redis, consumer, slot, stop))
+    try:
+        await engine.review_worker(stop=stop, consumer=consumer, drain_timeout=drain_timeout)
+    finally:
+        beat.cancel()
+        try:
+            pipe = redis.pipeline(transaction=False)
+            pipe.delete(worker_key(consumer))
+            pipe.zrem(WORKERS_KEY, consumer)
+            await pipe.execute()
+        except Exception as e:
+            print(f"⚠️ Could not unregister {consumer}: {e}")
+        await redis.aclose()
+        await close_http_client()
+    return stop.is_set()
+
+
+def _child_main(slot: int, consumer: str, drain_timeout: float):
+    stopped = asyncio.run(run_worker(slot, consumer, drain_timeout))
+    # The review loop only returns on its own when it cannot start (e.g. no Redis)
+    raise SystemExit(0 if stopped else 1)
+
+
+class Supervisor:
+    """Keeps `processes` worker children running until asked to stop."""
+
+    def __init__(self, processes: int, stop_grace_period: float, consumer_prefix: str | None = None):
+        self.processes = processes
+        self.drain_timeout, self.kill_after = drain_deadlines(stop_grace_period)
+        self.consumer_prefix = consumer_prefix or os.getenv("REVIEW_CONSUMER_NAME") or socket.gethostname()
+        self.stopping = False
+        self._ctx = multiprocessing.get_context("spawn")
+        self._children: list = [None] * processes
+        self._started_at = [0.0] * processes
+        self._restart_at = [0.0] * processes
+        self._restart_delay = [1.0] * processes
+
+    def consumer(self, slot: int) -> str:
+        return f"{self.consumer_prefix}-w{slot}"
+
+    def _start(self, slot: int):
+        proc = self._ctx.Process(
+            target=_child_main, args=(slot, self.consumer(slot), self.drain_timeout), name=self.consumer(slot)
+        )
+        proc.start()
+        self._children[slot] = proc
+        self._started_at[slot] = time.monotonic()
+        print(f"🚀 Started worker {self.consumer(slot)} (pid {proc.pid})")
+
+    def _reap(self, slot: int, now: float):
+        proc = self._children[slot]
+        self._children[slot] = None
+        _mark_dead(proc.pid)
+        if now - self._started_at[slot] >= STABLE_AFTER:
+            self._restart_delay[slot] = 1.0
+        delay = self._restart_delay[slot]
+        self._restart_delay[slot] = min(delay * 2, MAX_RESTART_DELAY)
+        self._restart_at[slot] = now + delay
+        print(f"💥 Worker {self.consumer(slot)} (pid {proc.pid}) exited with {proc.exitcode}, restarting in {delay:.0f}s")
+
+    def _request_stop(self, signum, frame):
+        if not self.stopping:
+            print(f"🔹 Received {signal.Signals(signum).name}, draining workers...")
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+        for slot in range(self.processes):
+            self._start(slot)
+
+        while not self.stopping:
+            now = time.monotonic()
+            for slot, proc in enumerate(self._children):
+                if proc is not None and not proc.is_alive():
+                    self._reap(slot, now)
+                elif proc is None and now >= self._restart_at[slot]:
+                    self._start(slot)
+            time.sleep(0.5)
+
+        self.drain()
+
+    def drain(self):
+        """Ask every child to drain, then wait for them, killing any that overrun."""
+        alive = [p for p in self._children if p is not None and p.is_alive()]
+        for proc in alive:
+            proc.terminate()
+        # Children get the drain timeout plus time to unregister and close connections
+        deadline = time.monotonic() + self.kill_after
+        for proc in alive:
+            proc.join(max(deadline - time.monotonic(), 0))
+            if proc.is_alive():
+                print(f"⚠️ Worker pid {proc.pid} did not stop in time, killing it")
+                proc.kill()
+                proc.join()
+            _mark_dead(proc.pid)
+        print("🔹 All workers stopped.")
+
+
+def _mark_dead(pid):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(pid)
+
+
+def _serve_metrics(port: int):
+    """Serve the children's metrics; PROMETHEUS_MULTIPROC_DIR must be set before they start."""
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        # Leftovers from a previous run would be summed into this one
+        for stale in Path(directory).glob("*.db"):
+            stale.unlink()
+    else:
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="pr-review-metrics-")
+
+    from prometheus_client import CollectorRegistry, multiprocess, start_http_server
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    start_http_server(port, registry=registry)
+    print(f"📈 Serving worker metrics on :{port}/metrics")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run review workers without the HTTP app")
+    parser.add_argument(
+        "--processes", type=int, default=int(os.getenv("REVIEW_WORKER_PROCESSES", os.cpu_count() or 1)),
+        help="Worker processes to keep running",
+    )
+    parser.add_argument(
+        "--stop-grace-period", type=float, default=STOP_GRACE_PERIOD,
+        help="Seconds the container gets after SIGTERM; job drain and kill deadlines fit inside it",
+    )
+    parser.add_argument(
+        "--metrics-port", type=int, default=int(os.getenv("REVIEW_METRICS_PORT", 0)),
+        help="Serve aggregated Prometheus metrics on this port (0: off)",
+    )
+    args = parser.parse_args(argv)
+
+    if args.metrics_port:
+        _serve_metrics(args.metrics_port)
+    Supervisor(max(args.processes, 1), args.stop_grace_period).run()
+
+
+if __name__ == "__main__":
+    main()
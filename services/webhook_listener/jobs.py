@@ -0,0 +1,136 @@
+# jobs.py
+import json, os, time
+
+# Must match services/review_engine/job_queue.py
+STREAM_PREFIX = "pr-review-stream:"
+STREAMS_KEY = "pr-review-streams"
+PENDING_PREFIX = "pr-review-pending:"
+DELIVERY_PREFIX = "pr-review-delivery:"
+STREAM_MAXLEN = 10000
+
+DELIVERY_TTL = int(os.getenv("WEBHOOK_DELIVERY_TTL", 24 * 3600))
+DEBOUNCE_SECONDS = float(os.getenv("REVIEW_DEBOUNCE_SECONDS", 0))
+
+WAKE_CHANNEL = "pr-review-wake"
+# Per-installation LPUSH lists used before the streams; only drained now
+LEGACY_QUEUE_PREFIX = "pr-review-queue:"
+STATS_PREFIX = "pr-review-stats:"
+
+# Must match services/review_engine/retries.py
+RETRY_KEY = "pr-review-retry"
+RETRY_JOBS_KEY = "pr-review-retry-jobs"
+DEAD_LETTER_PREFIX = "pr-review-dead-letter:"
+
+ENQUEUED, COALESCED, DUPLICATE = 1, 0, -1
+
+# KEYS: pending hash, stream, streams set, delivery key
+# ARGV: pr field, job json, stream maxlen, delivery ttl (0 = no dedupe), wake channel
+# Returns 1 when a new job was queued (and wakes the engines), 0 when it
+# replaced a pending one, -1 when the delivery was already seen.
+ENQUEUE_SCRIPT = """
+if ARGV[4] ~= '0' then
+  if not redis.call('SET', KEYS[4], '1', 'NX', 'EX', ARGV[4]) then
+    return -1
+  end
+end
+local created = redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+if created == 1 then
+  redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[3], '*', 'pr', ARGV[1])
+  redis.call('SADD', KEYS[3], KEYS[2])
+  redis.call('PUBLISH', ARGV[5], KEYS[2])
+end
+return created
+"""
+
+
+def stream_key(installation_id: int) -> str:
+    return f"{STREAM_PREFIX}{installation_id}"
+
+
+def pending_key(installation_id: int) -> str:
+    return f"{PENDING_PREFIX}{installation_id}"
+
+
+def pr_field(job: dict) -> str:
+    return f"{job['repo']}#{job['pr_number']}"
+
+
+def stats_key(installation_id: int) -> str:
+    return f"{STATS_PREFIX}{installation_id}"
+
+
+def dead_letter_key(installation_id: int) -> str:
+    return f"{DEAD_LETTER_PREFIX}{installation_id}"
+
+
+def cancel_retry(pipe, job: dict):
+    """Drop a PR's scheduled retry, for when it is queued by hand instead."""
+    member = f"{job['installation_id']}:{pr_field(job)}"
+    pipe.zrem(RETRY_KEY, member)
+    pipe.hdel(RETRY_JOBS_KEY, member)
+
+
+def queue_job(pipe, job: dict, delivery_id: str | None = None, debounce: float | None = None):
+    """
+    Add the enqueue script for a job to a pipeline, so it can share a round
+    trip with other bookkeeping commands.
+
+    At most one job is kept pending per PR: a later event for a PR that is
+    still waiting replaces the earlier payload instead of queueing another
+    review. Deliveries already seen (by X-GitHub-Delivery id) are dropped, and
+    with a debounce the job only becomes eligible once the PR has been quiet
+    for that long.
+    """
+    installation_id = job["installation_id"]
+    debounce = DEBOUNCE_SECONDS if debounce is None else debounce
+    if debounce > 0:
+        job = {**job, "not_before": time.time() + debounce}
+
+    pipe.eval(
+        ENQUEUE_SCRIPT,
+        4,
+        pending_key(installation_id),
+        stream_key(installation_id),
+        STREAMS_KEY,
+        f"{DELIVERY_PREFIX}{delivery_id or ''}",
+        pr_field(job),
+        json.dumps(job),
+        STREAM_MAXLEN,
+        DELIVERY_TTL if delivery_id else 0,
+        WAKE_CHANNEL,
+    )
+
+
+async def enqueue_job(redis, job: dict, delivery_id: str | None = None, debounce: float | None = None) -> int:
+    """
+    Queue a review job on its own; returns ENQUEUED, COALESCED or DUPLICATE
+    """
+    pipe = redis.pipeline(transaction=False)
+    queue_job(pipe, job, delivery_id=delivery_id, debounce=debounce)
+    return (await pipe.execute())[0]
+
+
+async def drain_legacy_queues(redis) -> int:
+    """
+    Move jobs still waiting in the old `pr-review-queue:*` lists onto the
+    streams, oldest first, and drop the lists. Each job is popped before it
+    is queued, so listeners starting together never queue one twice.
+    Returns how many jobs were moved.
+    """
+    moved = 0
+    async for key in redis.scan_iter(match=f"{LEGACY_QUEUE_PREFIX}*"):
+        # The old engine popped from the right: that end is the oldest job
+        while (raw := await redis.rpop(key)) is not None:
+            try:
+                job = json.loads(raw)
+            except ValueError:
+                job = None
+            if not isinstance(job, dict) or not all(job.get(k) for k in ("repo", "pr_number", "installation_id")):
+                print(f"⚠️ Dropping malformed legacy job from {key}: {raw[:200]}", flush=True)
+                continue
+            await enqueue_job(redis, job, debounce=0)
+            moved += 1
+        await redis.delete(key)
+    if moved:
+        print(f"📦 Moved {moved} job(s) from the legacy queues onto the streams", flush=True)
+    return moved
@@ -1,39 +1,125 @@
-from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
 import json
-from redis.asyncio import from_url
-import hmac, hashlib, os
+import asyncio
+import hmac, hashlib, os, time
 import sys
 from query_api.routes import router as query_router
+from jobs import queue_job, stream_key, stats_key, drain_legacy_queues, DUPLICATE, COALESCED
+from redis_pool import get_redis_client, close_redis_pool, pool_stats
+from metrics import INGEST_SECONDS, render_metrics
 import httpx
 
+try:
+    # Optional faster JSON decoder
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
 app = FastAPI()
+_http_client: httpx.AsyncClient | None = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Shared keep-alive client for calls to the review engine
+    """
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=float(os.getenv("HTTP_TIMEOUT", 5)),
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", 20)),
+                max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", 10)),
+            ),
+        )
+    return _http_client
+
+
+@app.on_event("startup")
+async def startup_event():
+    # One Redis connection pool shared by the webhook and the query API
+    redis = get_redis_client()
+    # Jobs queued by a listener that predates the streams would otherwise never run
+    try:
+        await drain_legacy_queues(redis)
+    except Exception as e:
+        print(f"⚠️ Could not drain legacy job queues: {e}", flush=True)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+    await close_redis_pool()
+
+
+@app.get("/health")
+async def health():
+    try:
+        await asyncio.wait_for(get_redis_client().ping(), timeout=2)
+    except Exception as e:
+        return JSONResponse(
+            status_code=503,
+            content={"status": "degraded", "redis": f"error: {e}", "pool": pool_stats()},
+        )
+    return {"status": "ok", "redis": "ok", "pool": pool_stats()}
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint."""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
+async def ping_worker(worker_url: str):
+    """Legacy HTTP wake-up for engines that do not listen on the wake channel."""
+    try:
+        await get_http_client().get(f"{worker_url}/wake")
+        print("✅ Worker pinged to wake up", flush=True)
+    except Exception as e:
+        print(f"⚠️ Failed to ping worker: {e}", flush=True)
+
 
 @app.post("/webhook")
-async def handle_webhook(request: Request):
+async def handle_webhook(request: Request, background_tasks: BackgroundTasks):
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        outcome, response = await _ingest(request, background_tasks)
+        return response
+    except HTTPException as e:
+        if e.status_code == 401:
+            outcome = "rejected"
+        raise
+    finally:
+        INGEST_SECONDS.labels(outcome).observe(time.perf_counter() - started)
+
+
+async def _ingest(request: Request, background_tasks: BackgroundTasks):
+    """Verify, parse and enqueue a delivery; returns (outcome, response body)."""
     secret = os.getenv("GITHUB_SECRET").encode()
     body = await request.body()
-    x_hub_signature = request.headers.get("x-hub-signature-256")
+    x_hub_signature = request.headers.get("x-hub-signature-256") or ""
 
     expected_signature = "sha256=" + hmac.new(secret, body, hashlib.sha256).hexdigest()
 
     if not hmac.compare_digest(expected_signature, x_hub_signature):
         raise HTTPException(401, "Invalid signature")
 
-    payload = await request.json()
+    # Parse the bytes already read for the signature check, once
+    payload = json_loads(body)
     pr = payload.get("pull_request")
     if not pr:
-        return {"ignored": True}
+        return "ignored", {"ignored": True}
 
     installation_id = payload["installation"]["id"]
 
-    redis_url = os.getenv("REDIS_URL_DOCKER")
-    print(f"Connecting to Redis at {redis_url}", flush=True)
-
-    redis = await from_url(redis_url, decode_responses=True)
-    await redis.ping()  # Test connection
-
-    # Namespace queue by installation_id
-    queue_key = f"pr-review-queue:{installation_id}"
+    # Namespace stream by installation_id
+    queue_key = stream_key(installation_id)
 
     job = {
         "repo": payload["repository"]["full_name"],
@@ -42,22 +128,29 @@ async def handle_webhook(request: Request):
         "installation_id": installation_id
     }
 
-    push_result = await redis.lpush(queue_key, json.dumps(job))
-    print(f"LPUSH to {queue_key}, result={push_result}", flush=True)
-
-    await redis.close()
-    print(f"Enqueued PR job: {job}", file=sys.stdout, flush=True)
-
-    worker_url = os.getenv("API_URL") 
+    # Enqueue (which also publishes the wake-up) and bookkeeping in one round trip
+    delivery_id = request.headers.get("x-github-delivery")
+    pipe = get_redis_client().pipeline(transaction=False)
+    queue_job(pipe, job, delivery_id=delivery_id)
+    pipe.hincrby(stats_key(installation_id), "webhooks", 1)
+    result, _ = await pipe.execute()
+
+    if result == DUPLICATE:
+        print(f"Duplicate delivery {delivery_id} ignored", flush=True)
+        return "duplicate", {"duplicate": True, "delivery": delivery_id}
+
+    coalesced = result == COALESCED
+    if coalesced:
+        print(f"Coalesced PR job into pending slot on {queue_key}: {job}", flush=True)
+    else:
+        print(f"Enqueued PR job on {queue_key}: {job}", file=sys.stdout, flush=True)
+
+    # Never hold the delivery response on the engine
+    worker_url = os.getenv("API_URL")
     if worker_url:
-        try:
-            async with httpx.AsyncClient(timeout=5) as client:
-                await client.get(f"{worker_url}/wake")
-            print("✅ Worker pinged to wake up", flush=True)
-        except Exception as e:
-            print(f"⚠️ Failed to ping worker: {e}", flush=True)
-
+        background_tasks.add_task(ping_worker, worker_url)
 
-    return {"enqueued": job, "queue": queue_key}
+    outcome = "coalesced" if coalesced else "enqueued"
+    return outcome, {"enqueued": job, "queue": queue_key, "coalesced": coalesced}
 
 app.include_router(query_router, prefix="/api")    
@@ -0,0 +1,17 @@
+# metrics.py
+from prometheus_client import CONTENT_TYPE_LATEST, Histogram, generate_latest
+
+# Ingest is a signature check plus one Redis round trip
+INGEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, float("inf"))
+
+INGEST_SECONDS = Histogram(
+    "pr_webhook_ingest_seconds",
+    "Time from receiving a webhook to responding, by outcome",
+    ["outcome"],
+    buckets=INGEST_BUCKETS,
+)
+
+
+def render_metrics():
+    """Return the exposition body and its content type."""
+    return generate_latest(), CONTENT_TYPE_LATEST
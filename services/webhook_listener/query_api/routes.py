@@ -1,54 +1,122 @@
 # query_api/routes.py
-from fastapi import Request, HTTPException, Depends
-import redis.asyncio as aioredis
-import os, json
+from fastapi import HTTPException, Depends, Query
+import json
+from jobs import queue_job, cancel_retry, dead_letter_key, pr_field, ENQUEUED
+from redis_pool import get_redis
 
-REDIS_URL = os.getenv("REDIS_URL_DOCKER")
+# Must match services/review_engine/history.py
+def reviews_key(installation_id: int) -> str:
+    return f"pr-review-reviews:{installation_id}"
 
-async def get_redis():
-    redis = await aioredis.from_url(REDIS_URL, decode_responses=True)
-    try:
-        yield redis
-    finally:
-        await redis.close()
+def recent_key(installation_id: int) -> str:
+    return f"pr-review-recent:{installation_id}"
 
-def history_key(installation_id: int) -> str:
-    return f"pr-review-history:{installation_id}"
+def pr_index_key(installation_id: int) -> str:
+    return f"pr-review-pr-repos:{installation_id}"
 
-def queue_key(installation_id: int) -> str:
-    return f"pr-review-queue:{installation_id}"
+# KEYS: reviews hash, pr-number index zset, recent zset; ARGV: "repo#pr" field or "", pr_number
+# Without a repo, resolves the most recently reviewed repo with that PR number:
+# index members are "{pr_number}:{repo}#{pr_number}", found by lex range.
+LOOKUP_SCRIPT = """
+local field = ARGV[1]
+if field == '' then
+  local best_score
+  local prefix = ARGV[2] .. ':'
+  for _, member in ipairs(redis.call('ZRANGEBYLEX', KEYS[2], '[' .. prefix, '(' .. ARGV[2] .. ';')) do
+    local candidate = string.sub(member, #prefix + 1)
+    local score = tonumber(redis.call('ZSCORE', KEYS[3], candidate))
+    if score and (not best_score or score > best_score) then
+      field, best_score = candidate, score
+    end
+  end
+  if field == '' then
+    return false
+  end
+end
+return redis.call('HGET', KEYS[1], field)
+"""
+
+def summaries_key(installation_id: int) -> str:
+    return f"pr-review-summaries:{installation_id}"
+
+# Fields only present on full history entries; asking for them loads the
+# whole review instead of its summary.
+FULL_ONLY_FIELDS = {"comments", "rejected_comments", "dropped_comments", "skipped_files"}
+MAX_PAGE_SIZE = 500
+
+def encode_cursor(score: float, skip: int) -> str:
+    return f"{score!r}:{skip}"
+
+def decode_cursor(cursor: str):
+    """Return (score, skip) from a listing cursor; raises ValueError if malformed."""
+    score, _, skip = cursor.partition(":")
+    return float(score), int(skip or 0)
+
+def project(record: dict, fields: list[str] | None) -> dict:
+    if not fields:
+        return record
+    if "comment_count" in fields and "comment_count" not in record:
+        record["comment_count"] = len(record.get("comments") or [])
+    if "rejected_count" in fields and "rejected_count" not in record:
+        record["rejected_count"] = len(record.get("rejected_comments") or [])
+    if "dropped_count" in fields and "dropped_count" not in record:
+        record["dropped_count"] = len(record.get("dropped_comments") or [])
+    if "skipped_count" in fields and "skipped_count" not in record:
+        record["skipped_count"] = len(record.get("skipped_files") or [])
+    return {k: record[k] for k in fields if k in record}
 
 # 📝 List PRs for an installation
-async def list_prs_internal(redis, installation_id: int, limit: int = 10):
-    key = history_key(installation_id)
-    prs = await redis.lrange(key, -limit, -1)
-    
-    if not prs:
-        return []  # Return empty list, not None
-    
-    return [json.loads(pr) for pr in prs]
+async def list_prs_internal(
+    redis, installation_id: int, limit: int = 10, cursor: str | None = None, fields: list[str] | None = None
+):
+    """
+    One page of reviews, most recently completed first.
+
+    Records are compact summaries (comment counts instead of bodies) unless
+    `fields` asks for comments. `next_cursor` resumes after the last record:
+    it holds that record's completion time and how many records sharing that
+    time were already returned, so pages never repeat or skip ties.
+    """
+    if cursor:
+        max_score, skip = decode_cursor(cursor)
+    else:
+        max_score, skip = "+inf", 0
+
+    members = await redis.zrevrangebyscore(
+        recent_key(installation_id), max_score, "-inf", start=skip, num=limit + 1, withscores=True
+    )
+    page, more = members[:limit], len(members) > limit
+    if not page:
+        return {"items": [], "next_cursor": None}
+
+    source = reviews_key if FULL_ONLY_FIELDS.intersection(fields or ()) else summaries_key
+    raw = await redis.hmget(source(installation_id), [member for member, _ in page])
+    items = [project(json.loads(r), fields) for r in raw if r]
+
+    next_cursor = None
+    if more:
+        last_score = page[-1][1]
+        ties = sum(1 for _, score in page if score == last_score)
+        if cursor and last_score == max_score:
+            ties += skip
+        next_cursor = encode_cursor(last_score, ties)
+    return {"items": items, "next_cursor": next_cursor}
 
 # 📝 Show a specific PR
-async def show_pr_internal(redis, installation_id: int, pr_number: int):
-    prs = await redis.lrange(history_key(installation_id), 0, -1)
-    for entry in prs:
-        pr = json.loads(entry)
-        if pr["pr_number"] == pr_number:
-            return pr
-    return None
+async def show_pr_internal(redis, installation_id: int, pr_number: int, repo: str | None = None):
+    field = f"{repo}#{pr_number}" if repo else ""
+    entry = await redis.eval(
+        LOOKUP_SCRIPT, 3, reviews_key(installation_id), pr_index_key(installation_id), recent_key(installation_id),
+        field, pr_number,
+    )
+    return json.loads(entry) if entry else None
 
 # 📝 Recheck a PR
-async def recheck_pr_internal(redis, installation_id: int, pr_number: int):
-    prs = await redis.lrange(history_key(installation_id), 0, -1)
-    repo, stored_installation_id = None, None
-    for entry in prs:
-        pr = json.loads(entry)
-        if pr["pr_number"] == pr_number:
-            repo = pr["repo"]
-            stored_installation_id = pr["installation_id"]
-            break
-    if not repo:
+async def recheck_pr_internal(redis, installation_id: int, pr_number: int, repo: str | None = None):
+    pr = await show_pr_internal(redis, installation_id, pr_number, repo)
+    if not pr:
         return None
+    repo, stored_installation_id = pr["repo"], pr["installation_id"]
 
     job = {
         "repo": repo,
@@ -56,8 +124,39 @@ async def recheck_pr_internal(redis, installation_id: int, pr_number: int):
         "action": "reopened",
         "installation_id": stored_installation_id,
     }
-    await redis.lpush(queue_key(stored_installation_id), json.dumps(job))
-    return {"status": "requeued", "pr_number": pr_number, "repo": repo}
+    # Manual rechecks skip the debounce window and replace any scheduled retry
+    pipe = redis.pipeline(transaction=True)
+    cancel_retry(pipe, job)
+    queue_job(pipe, job, debounce=0)
+    result = (await pipe.execute())[-1]
+    status = "requeued" if result == ENQUEUED else "already_queued"
+    return {"status": status, "pr_number": pr_number, "repo": repo}
+
+# 🪦 Jobs that failed for good, most recent first
+async def list_dead_letters_internal(redis, installation_id: int):
+    entries = [json.loads(raw) for raw in await redis.hvals(dead_letter_key(installation_id))]
+    return sorted(entries, key=lambda e: e.get("failed_at", 0), reverse=True)
+
+# 🪦 Queue a dead-lettered job again with a fresh attempt count
+async def replay_dead_letter_internal(redis, installation_id: int, pr_number: int, repo: str | None = None):
+    key = dead_letter_key(installation_id)
+    if repo:
+        raw = await redis.hget(key, f"{repo}#{pr_number}")
+        entry = json.loads(raw) if raw else None
+    else:
+        matches = [e for e in await list_dead_letters_internal(redis, installation_id) if e["job"]["pr_number"] == pr_number]
+        entry = matches[0] if matches else None
+    if not entry:
+        return None
+
+    job = {k: v for k, v in entry["job"].items() if k not in ("attempt", "last_error", "not_before")}
+    pipe = redis.pipeline(transaction=True)
+    pipe.hdel(key, pr_field(job))
+    cancel_retry(pipe, job)
+    queue_job(pipe, job, debounce=0)
+    result = (await pipe.execute())[-1]
+    status = "requeued" if result == ENQUEUED else "already_queued"
+    return {"status": status, "pr_number": pr_number, "repo": job["repo"]}
 
 
 # === Routes ===
@@ -66,21 +165,42 @@ from fastapi import APIRouter
 router = APIRouter()
 
 @router.get("/prs")
-async def list_prs(installation_id: int, limit: int = 10, redis=Depends(get_redis)):
-    prs = await list_prs_internal(redis, installation_id, limit)
-    # Return empty list instead of letting it fail
-    return prs if prs else []
+async def list_prs(
+    installation_id: int,
+    limit: int = Query(10, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    fields: str | None = None,
+    redis=Depends(get_redis),
+):
+    if cursor:
+        try:
+            decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid cursor: {cursor}")
+    projection = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    return await list_prs_internal(redis, installation_id, limit, cursor, projection)
 
 @router.get("/prs/{pr_number}")
-async def show_pr(pr_number: int, installation_id: int, redis=Depends(get_redis)):
-    pr = await show_pr_internal(redis, installation_id, pr_number)
+async def show_pr(pr_number: int, installation_id: int, repo: str | None = None, redis=Depends(get_redis)):
+    pr = await show_pr_internal(redis, installation_id, pr_number, repo)
     if not pr:
         raise HTTPException(status_code=404, detail=f"PR #{pr_number} not found")
     return pr
 
 @router.post("/prs/{pr_number}/recheck")
-async def recheck_pr(pr_number: int, installation_id: int, redis=Depends(get_redis)):
-    result = await recheck_pr_internal(redis, installation_id, pr_number)
+async def recheck_pr(pr_number: int, installation_id: int, repo: str | None = None, redis=Depends(get_redis)):
+    result = await recheck_pr_internal(redis, installation_id, pr_number, repo)
     if not result:
         raise HTTPException(status_code=404, detail=f"Repo for PR #{pr_number} not found")
     return result
+
+@router.get("/dead-letters")
+async def list_dead_letters(installation_id: int, redis=Depends(get_redis)):
+    return await list_dead_letters_internal(redis, installation_id)
+
+@router.post("/dead-letters/{pr_number}/replay")
+async def replay_dead_letter(pr_number: int, installation_id: int, repo: str | None = None, redis=Depends(get_redis)):
+    result = await replay_dead_letter_internal(redis, installation_id, pr_number, repo)
+    if not result:
+        raise HTTPException(status_code=404, detail=f"No dead-lettered job for PR #{pr_number}")
+    return result
@@ -0,0 +1,54 @@
+# redis_pool.py
+import os
+import redis.asyncio as aioredis
+
+_pool: aioredis.ConnectionPool | None = None
+_client: aioredis.Redis | None = None
+
+
+def create_pool() -> aioredis.ConnectionPool:
+    """
+    Build the application's Redis connection pool from the environment
+    """
+    return aioredis.ConnectionPool.from_url(
+        os.getenv("REDIS_URL_DOCKER"),
+        decode_responses=True,
+        max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", 50)),
+        health_check_interval=int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30)),
+        socket_keepalive=True,
+    )
+
+
+def get_redis_client() -> aioredis.Redis:
+    """
+    Return the shared Redis client, creating the pool on first use
+    """
+    global _pool, _client
+    if _client is None:
+        _pool = create_pool()
+        _client = aioredis.Redis(connection_pool=_pool)
+    return _client
+
+
+async def close_redis_pool():
+    global _pool, _client
+    if _client is not None:
+        await _client.aclose()
+    if _pool is not None:
+        await _pool.disconnect()
+    _pool, _client = None, None
+
+
+def pool_stats() -> dict:
+    if _pool is None:
+        return {}
+    return {
+        "max_connections": _pool.max_connections,
+        "in_use": len(getattr(_pool, "_in_use_connections", ())),
+        "idle": len(getattr(_pool, "_available_connections", ())),
+    }
+
+
+async def get_redis():
+    """FastAPI dependency yielding the shared client; connections return to the pool."""
+    yield get_redis_client()
@@ -0,0 +1,40 @@
+# tests/benchmarks_tests/test_harness.py
+from fastapi.testclient import TestClient
+
+from benchmarks import fake_github, fake_models
+from benchmarks.load import parse_mix
+from benchmarks.run import percentile
+from services.review_engine.functions.generate_review import build_prompt, parse_review_json
+
+
+def test_fake_github_paginates_files_like_github():
+    """
+    The files listing should advertise its last page so the engine fetches the rest concurrently.
+    """
+    github = fake_github.FakeGitHub()
+    github.add_pr(fake_github.FakePR(repo="bench/repo", number=1, files=250, hunks_per_file=2))
+    client = TestClient(fake_github.create_app(github))
+
+    resp = client.get("/repos/bench/repo/pulls/1/files", params={"per_page": 100, "page": 3})
+
+    assert len(resp.json()) == 50
+    assert resp.links["last"]["url"].endswith("page=3")
+
+    client.post("/repos/bench/repo/pulls/1/reviews", json={"comments": [{}, {}]})
+    assert github.prs[("bench/repo", 1)].comments == 2
+
+
+def test_fake_model_comments_point_at_prompt_files():
+    """
+    Fake reviews should parse like real ones and target files and lines from the prompt.
+    """
+    pr = fake_github.FakePR(repo="bench/repo", number=7, files=2, hunks_per_file=1)
+    prompt = build_prompt("title", [{"path": pr.path(i), "hunk": pr.patch(i)} for i in range(2)])
+
+    output = fake_models.fake_review(prompt, fake_models.ModelProfile(comments_per_file=2, comment_chars=50))
+    comments = parse_review_json(output)
+
+    assert [c["path"] for c in comments] == ["src/module_0.py"] * 2 + ["src/module_1.py"] * 2
+    assert comments[0]["line"] == 1 and len(comments[0]["body"]) == 50
+    assert percentile([3, 1, 2, 4], 50) == 2
+    assert parse_mix("small=1,large=3") == [("small", 1.0), ("large", 3.0)]
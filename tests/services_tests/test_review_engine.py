@@ -78,3 +78,778 @@
 #     # Assertions
 #     fake_redis.brpop.assert_awaited()
 #     engine.post_pr_comments.assert_awaited_once()
+
+
+import asyncio
+import pytest
+
+import services.review_engine.engine as engine
+
+
+@pytest.mark.asyncio
+async def test_job_pool_caps_per_installation_and_cancels():
+    """
+    JobPool should track per-installation load and cancel in-flight jobs cleanly.
+    """
+    pool = engine.JobPool(max_jobs=3, max_per_installation=2)
+    started = asyncio.Event()
+
+    async def slow_job():
+        started.set()
+        await asyncio.sleep(60)
+
+    for _ in range(2):
+        await pool.acquire()
+        pool.spawn(1, slow_job())
+    await started.wait()
+
+    assert len(pool) == 2
+    assert pool.is_saturated(1)
+    assert not pool.is_saturated(2)
+
+    await pool.cancel_all()
+    await asyncio.sleep(0)
+
+    assert len(pool) == 0
+    assert not pool.is_saturated(1)
+
+
+@pytest.mark.asyncio
+async def test_job_queue_reads_stream_entries_and_drops_malformed():
+    """
+    JobQueue.read should decode stream entries and ack entries it cannot parse.
+    """
+    from unittest.mock import AsyncMock, MagicMock
+    from services.review_engine.job_queue import JobQueue
+
+    fake_pipe = MagicMock()
+    fake_pipe.execute = AsyncMock(return_value=[1, 1])
+    fake_redis = AsyncMock()
+    fake_redis.pipeline = MagicMock(return_value=fake_pipe)
+    fake_redis.xreadgroup.return_value = [
+        ["pr-review-stream:7", [
+            ("1-0", {"job": '{"repo": "user/repo", "pr_number": 42, "installation_id": 7}'}),
+            ("2-0", {"job": "not json"}),
+        ]],
+    ]
+
+    queue = JobQueue(fake_redis, consumer="test")
+    jobs = await queue.read(["pr-review-stream:7"])
+
+    assert len(jobs) == 1
+    assert jobs[0].entry_id == "1-0"
+    assert jobs[0].installation_id == "7"
+    fake_pipe.xack.assert_called_once_with("pr-review-stream:7", "review-engine", "2-0")
+
+    # Held entries are kept fresh so no other consumer reclaims them mid-review
+    await queue.touch(jobs)
+    fake_pipe.xclaim.assert_called_once_with("pr-review-stream:7", "review-engine", "test", 0, ["1-0"], justid=True)
+
+
+@pytest.mark.asyncio
+async def test_token_cache_single_flight_and_refresh_ahead(monkeypatch):
+    """
+    Concurrent misses share one mint; tokens near expiry are refreshed ahead of time.
+    """
+    import time
+    from services.review_engine import auth
+
+    calls = []
+
+    async def fake_fetch(installation_id):
+        calls.append(installation_id)
+        await asyncio.sleep(0.01)
+        return f"token-{len(calls)}", time.time() + 3600
+
+    monkeypatch.setattr(auth, "_fetch_installation_token", fake_fetch)
+    cache = auth.InstallationTokenCache(refresh_margin=60, refresh_ahead=300)
+
+    tokens = await asyncio.gather(*(cache.get(7) for _ in range(5)))
+    assert tokens == ["token-1"] * 5
+    assert len(calls) == 1
+
+    # Inside the refresh-ahead window the old token is served while a new one is minted
+    cache._tokens["7"] = ("token-1", time.time() + 120)
+    assert await cache.get(7) == "token-1"
+    await asyncio.sleep(0.05)
+    assert await cache.get(7) == "token-2"
+
+    assert await cache.get(7, force_refresh=True) == "token-3"
+
+
+@pytest.mark.asyncio
+async def test_app_jwt_is_reused_until_near_expiry(monkeypatch):
+    """
+    The App JWT should be signed once and reused, with the private key parsed only once.
+    """
+    import jwt
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from services.review_engine import auth
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.TraditionalOpenSSL,
+        serialization.NoEncryption(),
+    ).decode()
+    monkeypatch.setenv("GITHUB_APP_ID", "123")
+    monkeypatch.setenv("GITHUB_APP_PRIVATE_KEY", pem)
+    monkeypatch.setattr(auth, "_app_jwt", None)
+    monkeypatch.setattr(auth, "_app_jwt_lock", None)
+
+    first = await auth.get_app_jwt()
+    loaded = auth._private_key
+    second = await auth.get_app_jwt()
+
+    assert first == second
+    assert auth._private_key is loaded
+    claims = jwt.decode(first, key.public_key(), algorithms=["RS256"])
+    assert claims["iss"] == "123"
+
+    # Close to expiry a new token is signed
+    monkeypatch.setattr(auth, "_app_jwt", (first, claims["exp"] - 600))
+    await auth.get_app_jwt()
+    assert auth._app_jwt[1] >= claims["exp"]
+
+
+@pytest.mark.asyncio
+async def test_fetch_pr_snapshot_takes_one_graphql_round_trip():
+    """
+    The PR snapshot should come from one GraphQL query, with only the first page of files.
+    """
+    import json
+    import httpx
+    from services.review_engine.functions.fetch_pr import fetch_pr_snapshot
+
+    requests = []
+
+    def handler(request):
+        requests.append(json.loads(request.content)["variables"])
+        pr = {
+            "id": "PR_1", "title": "Add feature", "url": "https://github.com/user/repo/pull/42",
+            "headRefOid": "head", "baseRefOid": "base", "changedFiles": 250,
+            "files": {"nodes": [{"path": "a.py"}, {"path": "b.py"}]},
+        }
+        return httpx.Response(200, json={"data": {"repository": {"pullRequest": pr}}})
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        snapshot = await fetch_pr_snapshot("user", "repo", 42, "token", client=client)
+
+    assert requests == [{"owner": "user", "name": "repo", "number": 42}]
+    assert snapshot.head_sha == "head" and snapshot.changed_files == 250
+    assert snapshot.repo == "user/repo"
+    assert [f["path"] for f in snapshot.files] == ["a.py", "b.py"]
+
+
+@pytest.mark.asyncio
+async def test_iter_pr_hunk_pages_fetches_every_page():
+    """
+    All pages named by the Link header should be fetched with per_page=100 and split into hunks.
+    """
+    import httpx
+    from services.review_engine.functions.fetch_pr import iter_pr_hunk_pages
+
+    base = "https://api.github.com/repos/user/repo/pulls/42/files"
+    seen = []
+
+    def handler(request):
+        page = int(request.url.params["page"])
+        seen.append((page, request.url.params["per_page"]))
+        headers = {"Link": f'<{base}?per_page=100&page=2>; rel="next", <{base}?per_page=100&page=3>; rel="last"'}
+        files = [{"filename": f"f{page}.py", "patch": "@@ -1 +1 @@\n-a\n+b\n@@ -9 +9 @@\n-c\n+d\n"}]
+        return httpx.Response(200, json=files, headers=headers)
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        pages = [page async for page in iter_pr_hunk_pages("user", "repo", 42, "token", client=client)]
+
+    assert sorted(seen) == [(1, "100"), (2, "100"), (3, "100")]
+    assert [len(page) for page in pages] == [2, 2, 2]
+    assert pages[0][0] == {"path": "f1.py", "hunk": "@@ -1 +1 @@\n-a\n+b\n"}
+
+
+@pytest.mark.asyncio
+async def test_iter_pr_hunk_pages_refreshes_token_for_failing_page():
+    """
+    A page answered with 401 should be retried with a fresh token, without refetching the others.
+    """
+    import httpx
+    from services.review_engine.functions.fetch_pr import iter_pr_hunk_pages
+
+    base = "https://api.github.com/repos/user/repo/pulls/42/files"
+    seen = []
+
+    def handler(request):
+        page = int(request.url.params["page"])
+        token = request.headers["Authorization"]
+        seen.append((page, token))
+        if page == 2 and token == "Bearer stale":
+            return httpx.Response(401, json={"message": "Bad credentials"})
+        headers = {"Link": f'<{base}?per_page=100&page=2>; rel="last"'}
+        return httpx.Response(200, json=[{"filename": f"f{page}.py", "patch": "@@ -1 +1 @@\n-a\n+b\n"}], headers=headers)
+
+    async def refresh_token():
+        return "fresh"
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        pages = [p async for p in iter_pr_hunk_pages("user", "repo", 42, "stale", client=client, refresh_token=refresh_token)]
+
+    assert sorted(seen) == [(1, "Bearer stale"), (2, "Bearer fresh"), (2, "Bearer stale")]
+    assert sorted(page[0]["path"] for page in pages) == ["f1.py", "f2.py"]
+
+
+@pytest.mark.asyncio
+async def test_post_pr_comments_falls_back_when_review_is_rejected():
+    """
+    A rejected batched review should fall back to single comments and report the bad ones.
+    """
+    import json
+    import httpx
+    from services.review_engine.functions.post_comments import post_pr_comments
+
+    posted = []
+
+    def handler(request):
+        if request.url.path.endswith("/reviews"):
+            return httpx.Response(422, json={"message": "Line could not be resolved"})
+        body = json.loads(request.content)
+        posted.append(body)
+        if body["line"] == 999:
+            return httpx.Response(422, json={"message": "line must be part of the diff"})
+        return httpx.Response(201, json={})
+
+    comments = [
+        {"body": "ok", "path": "a.py", "line": 1},
+        {"body": "bad", "path": "a.py", "line": 999},
+    ]
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        report = await post_pr_comments("user", "repo", 42, comments, "token", client=client, commit_id="sha")
+
+    assert report["mode"] == "individual"
+    assert report["posted"] == 1
+    assert [r["comment"]["line"] for r in report["rejected"]] == [999]
+    assert all(p["commit_id"] == "sha" for p in posted)
+
+
+def test_plan_shards_respects_budget_and_keeps_files_together():
+    """
+    Shards should stay under the token budget and keep a file's hunks together when possible.
+    """
+    from services.review_engine.functions.generate_review import (
+        build_prompt, estimate_tokens, plan_shards,
+    )
+
+    hunk = "@@ -1 +1 @@\n" + "+x = 1\n" * 100
+    chunks = (
+        [{"path": "a.py", "hunk": hunk} for _ in range(2)]
+        + [{"path": "b.py", "hunk": hunk} for _ in range(2)]
+        + [{"path": "huge.py", "hunk": hunk} for _ in range(6)]
+    )
+    budget = estimate_tokens(build_prompt("T", chunks[:2])) + 50
+
+    shards = plan_shards("T", chunks, budget=budget)
+
+    assert [c for shard in shards for c in shard] == chunks
+    assert all(estimate_tokens(build_prompt("T", s)) <= budget for s in shards)
+    assert {c["path"] for c in shards[0]} == {"a.py"}
+    assert {c["path"] for c in shards[1]} == {"b.py"}
+
+
+@pytest.mark.asyncio
+async def test_generate_review_comments_only_sends_cache_misses(monkeypatch):
+    """
+    Cached hunks should be merged back in and only misses sent to the model.
+    """
+    from services.review_engine.functions import generate_review as gr
+
+    chunks = [
+        {"path": "a.py", "hunk": "@@ -1,2 +1,2 @@\n-a\n+b\n"},
+        {"path": "a.py", "hunk": "@@ -10,2 +10,3 @@\n-c\n+d\n+e\n"},
+    ]
+
+    class FakeCache:
+        stored = None
+
+        async def lookup(self, chunks):
+            return [[{"body": "cached", "path": "a.py", "line": 1}], None]
+
+        async def store(self, chunks, comments_per_chunk):
+            self.stored = (chunks, comments_per_chunk)
+
+    prompts = []
+
+    async def fake_generate_review(pr_title, shard, client=None):
+        prompts.append(shard)
+        return '[{"file": "a.py", "comment": "fresh", "line_number": 11}]'
+
+    monkeypatch.setattr(gr, "generate_review", fake_generate_review)
+    cache = FakeCache()
+
+    comments = await gr.generate_review_comments("T", chunks, cache=cache)
+
+    assert prompts == [[chunks[1]]]
+    assert [c["body"] for c in comments] == ["cached", "fresh"]
+    assert cache.stored == ([chunks[1]], [[{"body": "fresh", "path": "a.py", "line": 11}]])
+
+
+@pytest.mark.asyncio
+async def test_fetch_compare_hunks_falls_back_on_force_push():
+    """
+    Only fast-forward comparisons yield incremental hunks; diverged or missing bases return None.
+    """
+    import httpx
+    from services.review_engine.functions.fetch_pr import fetch_compare_hunks
+
+    responses = {
+        "old...new": httpx.Response(200, json={
+            "status": "ahead",
+            "files": [{"filename": "a.py", "patch": "@@ -3 +3 @@\n-a\n+b\n"}],
+        }),
+        "rewritten...new": httpx.Response(200, json={"status": "diverged", "files": []}),
+        "gone...new": httpx.Response(404, json={"message": "Not Found"}),
+    }
+
+    def handler(request):
+        return responses[request.url.path.rsplit("/", 1)[1]]
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        ahead = await fetch_compare_hunks("user", "repo", "old", "new", "token", client=client)
+        diverged = await fetch_compare_hunks("user", "repo", "rewritten", "new", "token", client=client)
+        missing = await fetch_compare_hunks("user", "repo", "gone", "new", "token", client=client)
+
+    assert ahead == [{"path": "a.py", "hunk": "@@ -3 +3 @@\n-a\n+b\n"}]
+    assert diverged is None
+    assert missing is None
+
+
+@pytest.mark.asyncio
+async def test_job_queue_take_claims_latest_pending_payload():
+    """
+    Entries referencing a PR slot should resolve to the slot's latest payload.
+    """
+    import json
+    from unittest.mock import AsyncMock
+    from services.review_engine.job_queue import JobQueue, StreamJob
+
+    latest = json.dumps({"repo": "user/repo", "pr_number": 42, "action": "synchronize", "installation_id": 7})
+    fake_redis = AsyncMock()
+    fake_redis.hget.side_effect = [None, latest]
+    fake_redis.eval.return_value = latest
+
+    queue = JobQueue(fake_redis, consumer="test")
+    entry = StreamJob("pr-review-stream:7", "1-0", pr_field="user/repo#42")
+    job = await queue.take(entry)
+
+    assert job["action"] == "synchronize"
+    assert fake_redis.eval.await_args.args[1:] == (
+        2, "pr-review-pending:7", "pr-review-inflight:7", "user/repo#42", latest, "1-0",
+    )
+
+    # Nothing pending any more: the entry is a no-op
+    fake_redis.hget.side_effect = [None, None]
+    assert await queue.take(StreamJob("pr-review-stream:7", "2-0", pr_field="user/repo#42")) is None
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint_reports_stages_and_queue_depth(monkeypatch):
+    """
+    /metrics should expose stage timings and per-installation queue depth.
+    """
+    from unittest.mock import AsyncMock, MagicMock
+    from fastapi.testclient import TestClient
+    from services.review_engine.job_queue import JobQueue
+    from services.review_engine.metrics import entry_age, observe_stage
+
+    assert entry_age("1000-0", now=5.0) == 4.0
+    with observe_stage("model"):
+        pass
+
+    fake_pipe = MagicMock()
+    fake_pipe.execute = AsyncMock(return_value=[3])
+    fake_redis = MagicMock()
+    fake_redis.pipeline = MagicMock(return_value=fake_pipe)
+    queue = JobQueue(fake_redis, consumer="test")
+    queue._streams = {"pr-review-stream:7"}
+    monkeypatch.setattr(engine, "_queue", queue)
+
+    response = TestClient(engine.app).get("/metrics")
+
+    assert response.status_code == 200
+    assert 'pr_review_stage_seconds_count{stage="model"}' in response.text
+    assert 'pr_review_queue_depth{installation="7"} 3.0' in response.text
+    fake_pipe.hlen.assert_called_once_with("pr-review-pending:7")
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_transport_backs_off_and_paces():
+    """
+    Secondary limits should be retried after Retry-After, and a low budget paced out.
+    """
+    import time
+    import httpx
+    from services.review_engine.rate_limit import GitHubRateLimiter, RateLimitTransport
+
+    reset = str(int(time.time()) + 1000)
+
+    responses = [
+        httpx.Response(403, headers={"Retry-After": "0"}, json={"message": "You have exceeded a secondary rate limit"}),
+        httpx.Response(200, headers={"X-RateLimit-Limit": "5000", "X-RateLimit-Remaining": "150",
+                                     "X-RateLimit-Reset": reset, "X-RateLimit-Resource": "core"}, json={}),
+    ]
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.host)
+        return responses[min(len(calls) - 1, 1)] if request.url.host == "api.github.com" else httpx.Response(200)
+
+    limiter = GitHubRateLimiter(reserve=50, pace_below=0.2)
+    limiter.register_token("tok", 42)
+    transport = RateLimitTransport(httpx.MockTransport(handler), limiter, "https://api.github.com")
+    async with httpx.AsyncClient(transport=transport) as client:
+        resp = await client.get("https://api.github.com/repos/o/r", headers={"Authorization": "Bearer tok"})
+        await client.post("https://models.github.ai/inference/chat/completions")
+
+    assert resp.status_code == 200
+    assert calls == ["api.github.com", "api.github.com", "models.github.ai"]
+
+    # 100 requests left above the reserve over ~1000s: about one every 10s
+    assert limiter.delay("42", "core") == 0
+    assert limiter.delay("42", "core") == pytest.approx(10, abs=0.5)
+    assert limiter.delay("42", "graphql") == 0
+
+
+def test_fair_scheduler_weights_installations_and_honours_max_wait():
+    """
+    A deep queue should not starve other installations, weights should skew the
+    share, and a job past the max wait should jump the rotation.
+    """
+    import time
+    from services.review_engine.job_queue import StreamJob
+    from services.review_engine.scheduler import FairScheduler, parse_weights
+
+    now_ms = int(time.time() * 1000)
+    scheduler = FairScheduler(weights=parse_weights("1=2,bad"), max_wait=60)
+    for i in range(6):
+        scheduler.push(StreamJob("pr-review-stream:1", f"{now_ms}-{i}"))
+    for i in range(3):
+        scheduler.push(StreamJob("pr-review-stream:2", f"{now_ms}-{10 + i}"))
+    scheduler.push(StreamJob("pr-review-stream:3", f"{now_ms}-20"))
+
+    order = [scheduler.pop().installation_id for _ in range(6)]
+    assert order == ["1", "1", "2", "3", "1", "1"]
+    assert scheduler.wanted(1) == 0 and scheduler.wanted(3) == 1
+
+    # Saturated installations are skipped without losing their place
+    assert scheduler.pop(lambda installation_id: installation_id != "2").installation_id == "1"
+
+    scheduler.push(StreamJob("pr-review-stream:4", f"{now_ms - 120_000}-0"))
+    assert scheduler.pop().installation_id == "4"
+    assert len(scheduler) == 3
+
+
+@pytest.mark.asyncio
+async def test_stream_review_yields_comments_as_sse_chunks_arrive(monkeypatch):
+    """
+    Streamed completions should be parsed element by element, across chunk
+    boundaries, ignoring brackets in the prose before the array.
+    """
+    import json
+    import httpx
+    from services.review_engine.functions import generate_review as gr
+    from services.review_engine.functions.json_stream import JsonArrayStream
+
+    content = 'Sure! Findings [by severity]:\n```json\n[ {"file": "a.py", "comment": "use {} not dict()", "line_number": 3},' \
+              ' {"file": "b.py", "comment": "escaped \\"quote\\"", "line_number": 9}]\n```'
+    pieces = [content[i:i + 7] for i in range(0, len(content), 7)]
+    events = "".join(f"data: {json.dumps({'choices': [{'delta': {'content': p}}]})}\n\n" for p in pieces)
+    events += "data: [DONE]\n\n"
+
+    def handler(request):
+        assert json.loads(request.content)["stream"] is True
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=events.encode())
+
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    parser = JsonArrayStream()
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        comments = [c async for c in gr.stream_review("title", [{"path": "a.py", "hunk": "@@"}], client, parser)]
+
+    assert comments == [
+        {"body": "use {} not dict()", "path": "a.py", "line": 3},
+        {"body": 'escaped "quote"', "path": "b.py", "line": 9},
+    ]
+    assert parser.complete
+
+
+@pytest.mark.asyncio
+async def test_failing_shard_cancels_the_others(monkeypatch):
+    """
+    When one shard fails, the shards still running should be cancelled before the error is raised.
+    """
+    import asyncio
+    from services.review_engine.functions import generate_review as gr
+
+    cancelled = []
+
+    async def fake_review(pr_title, shard, client=None):
+        if shard[0]["path"] == "bad.py":
+            raise RuntimeError("OpenAI API error 500")
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(shard[0]["path"])
+            raise
+
+    monkeypatch.setattr(gr, "generate_review", fake_review)
+    monkeypatch.setattr(gr, "plan_shards", lambda title, chunks: [[c] for c in chunks])
+    chunks = [{"path": p, "hunk": "@@ -1 +1 @@\n+x\n"} for p in ("a.py", "bad.py", "c.py")]
+
+    with pytest.raises(RuntimeError):
+        await asyncio.wait_for(gr.generate_review_comments("title", chunks), 5)
+    assert sorted(cancelled) == ["a.py", "c.py"]
+
+
+def test_diff_index_maps_new_lines_and_snaps_comments():
+    """
+    The diff index should map added and context lines to new-file lines and
+    positions, snap near misses onto the diff and drop comments it cannot place.
+    """
+    from services.review_engine.diff_index import DiffIndex, annotate_hunk
+
+    from services.review_engine.functions.fetch_pr import split_hunks
+
+    first = "@@ -10,3 +10,4 @@ def f():\n ctx\n-old\n+new\n+added\n ctx2\n"
+    second = "@@ -40,2 +41,2 @@ class C:\n-gone\n+back\n tail"
+    chunks = split_hunks("src/a.py", first + second)
+    assert [c["hunk"] for c in chunks] == [first, second]
+    diff = DiffIndex.from_chunks(chunks)
+
+    assert sorted(diff.files["src/a.py"].positions) == [10, 11, 12, 13, 41, 42]
+    # Positions run on across hunks, counting the second hunk's header
+    assert diff.position("src/a.py", 11) == 3 and diff.position("src/a.py", 41) == 8
+    assert diff.position("src/a.py", 20) is None
+
+    assert diff.validate({"path": "src/a.py", "line": 12, "body": "ok"})["line"] == 12
+    assert diff.validate({"path": "a.py", "line": "15", "body": "near"}) == {"path": "src/a.py", "line": 13, "body": "near"}
+    assert diff.validate({"path": "src/a.py", "line": 30, "body": "far"}) is None
+    assert diff.validate({"path": "src/a.py", "line": None, "body": "no line"}) is None
+    assert diff.validate({"path": "UnknownFile", "line": 10, "body": "?"}) is None
+
+    assert annotate_hunk("src/a.py", first).split("\n") == [
+        "@@ -10,3 +10,4 @@ def f():", "10  ctx", "   -old", "11 +new", "12 +added", "13  ctx2",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_review_config_filters_files_and_caches_per_commit():
+    """
+    The repo override should replace defaults, be fetched once per commit, and
+    skip excluded, generated, oversized and over-budget files.
+    """
+    import httpx
+    from services.review_engine import review_config
+    from services.review_engine.review_config import load_review_config
+
+    fetched = []
+
+    def handler(request):
+        fetched.append(request.url.params["ref"])
+        assert request.url.path.endswith("/contents/.github/pr-review.yml")
+        return httpx.Response(200, text="exclude: ['docs/', '*.md']\nmax_file_patch_bytes: 20\nmax_pr_changes: 10\n")
+
+    review_config._configs.clear()
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        config = await load_review_config("user", "repo", "sha1", "token", client=client)
+        assert await load_review_config("user", "repo", "sha1", "token", client=client) is config
+    assert fetched == ["sha1"]
+
+    skipped = config.select([
+        {"path": "src/app.py", "additions": 6, "deletions": 0},
+        {"path": "docs/guide/intro.txt", "additions": 1, "deletions": 0},
+        {"path": "README.md", "additions": 1, "deletions": 0},
+        {"path": "web/package-lock.json", "additions": 900, "deletions": 0},
+        {"path": "src/big.py", "additions": 5, "deletions": 1},
+        {"path": "src/small.py", "additions": 3, "deletions": 0},
+    ])
+    assert skipped == {
+        "docs/guide/intro.txt": "excluded",
+        "README.md": "excluded",
+        "web/package-lock.json": "generated",
+        "src/big.py": "pr_change_limit",
+    }
+    assert config.file_reason({"filename": "src/small.py", "patch": "@@ -1 +1 @@\n+" + "x" * 30}) == "patch_too_large"
+    assert config.file_reason({"filename": "src/small.py", "patch": "@@ -1 +1 @@\n+x"}) is None
+
+    # Files listed after the snapshot's first page spend what is left of the budget
+    selection = config.selection()
+    assert selection.add("src/app.py", 6, 0) is None
+    assert selection.add("src/later.py", 5, 0) == "pr_change_limit"
+    assert selection.add("src/app.py", 6, 0) is None and selection.total == 6
+
+
+@pytest.mark.asyncio
+async def test_failed_jobs_back_off_by_error_type_then_dead_letter(monkeypatch):
+    """
+    Transient failures should schedule a jittered, growing retry; permanent ones
+    and jobs out of attempts should land in the dead-letter hash.
+    """
+    import httpx, json
+    from unittest.mock import AsyncMock, MagicMock
+    from services.review_engine import retries
+    from services.review_engine.http_client import HTTPStatusError
+
+    assert retries.classify_error(HTTPStatusError("GitHub REST error 502 listing files: bad gateway", 502)) == "server"
+    assert retries.classify_error(HTTPStatusError("GitHub Models error 429: slow down", 429)) == "rate_limited"
+    assert retries.classify_error(HTTPStatusError("GitHub GraphQL error 404: nope", 404)) == "client"
+    # Numbers in the message text are not statuses
+    assert retries.classify_error(RuntimeError("Could not parse line 404 of the review")) == "unknown"
+    assert retries.classify_error(httpx.ReadTimeout("timed out")) == "timeout"
+    assert 15 <= retries.backoff_delay("server", 2) <= 30
+
+    pipe = MagicMock()
+    pipe.execute = AsyncMock()
+    redis = MagicMock()
+    redis.pipeline.return_value = pipe
+    redis.hset = AsyncMock()
+    job = {"repo": "octo/repo", "pr_number": 7, "installation_id": 42, "action": "opened", "not_before": 1.0}
+
+    outcome = await retries.retry_or_dead_letter(redis, job, HTTPStatusError("GitHub Models error 503: busy", 503), now=1000)
+    assert outcome == "retrying"
+    member, payload = pipe.hset.call_args.args[1:]
+    assert member == "42:octo/repo#7"
+    assert json.loads(payload) == {**{k: v for k, v in job.items() if k != "not_before"}, "attempt": 2, "last_error": "server"}
+    due = pipe.zadd.call_args.args[1][member]
+    assert 1000 + 7.5 <= due <= 1000 + 15
+
+    monkeypatch.setattr(retries, "MAX_ATTEMPTS", 3)
+    outcome = await retries.retry_or_dead_letter(redis, {**job, "attempt": 3}, HTTPStatusError("GitHub Models error 503", 503))
+    assert outcome == "dead_lettered"
+    outcome = await retries.retry_or_dead_letter(redis, job, HTTPStatusError("Pull request #7 not found", 404), now=5)
+    assert outcome == "dead_lettered"
+    key, field, entry = redis.hset.call_args.args
+    assert (key, field) == ("pr-review-dead-letter:42", "octo/repo#7")
+    assert json.loads(entry)["error_type"] == "client" and json.loads(entry)["attempts"] == 1
+
+    redis.zrangebyscore = AsyncMock(return_value=["42:octo/repo#7", "42:octo/repo#8"])
+    redis.eval = AsyncMock(side_effect=[1, -1])
+    assert await retries.promote_due(redis, now=2000) == 1
+    args = redis.eval.call_args_list[0].args
+    assert args[2:7] == (
+        "pr-review-retry", "pr-review-retry-jobs", "pr-review-pending:42", "pr-review-stream:42", "pr-review-streams",
+    )
+    assert args[7:9] == ("42:octo/repo#7", "octo/repo#7")
+
+
+@pytest.mark.asyncio
+async def test_graphql_missing_or_forbidden_pr_is_a_client_error():
+    """
+    GraphQL NOT_FOUND / FORBIDDEN errors and a null PR should raise typed errors that are dead-lettered, not retried.
+    """
+    import httpx
+    from services.review_engine import retries
+    from services.review_engine.functions.fetch_pr import fetch_pr_snapshot
+    from services.review_engine.http_client import HTTPStatusError
+
+    bodies = [
+        {"data": {"repository": None}, "errors": [{"type": "NOT_FOUND", "message": "Could not resolve to a Repository"}]},
+        {"data": {"repository": {"pullRequest": None}}},
+        {"data": None, "errors": [{"type": "FORBIDDEN", "message": "Resource not accessible by integration"}]},
+    ]
+
+    def handler(request):
+        return httpx.Response(200, json=bodies.pop(0))
+
+    statuses = []
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        for _ in range(3):
+            with pytest.raises(HTTPStatusError) as raised:
+                await fetch_pr_snapshot("user", "repo", 42, "token", client=client)
+            statuses.append(raised.value.status_code)
+            assert retries.classify_error(raised.value) == "client"
+
+    assert statuses == [404, 404, 403]
+
+
+@pytest.mark.asyncio
+async def test_worker_drains_in_flight_jobs_and_resumes_its_own_pending():
+    """
+    A stop request should let running jobs finish within the drain timeout and
+    cancel the ones that overrun; a restarted consumer re-reads its own pending entries.
+    """
+    from unittest.mock import AsyncMock
+    from services.review_engine.job_queue import JobQueue
+    from services.review_engine.worker import Supervisor
+
+    pool = engine.JobPool(max_jobs=2, max_per_installation=2)
+    finished = []
+
+    async def job(seconds):
+        await asyncio.sleep(seconds)
+        finished.append(seconds)
+
+    for seconds in (0.01, 60):
+        await pool.acquire()
+        pool.spawn(1, job(seconds))
+
+    # A full pool must not keep a stop request from being seen
+    stop = asyncio.Event()
+    waiting = asyncio.create_task(engine._acquire_unless_stopped(pool, stop))
+    await asyncio.sleep(0.01)
+    stop.set()
+    assert await asyncio.wait_for(waiting, 1) is False
+
+    assert await pool.drain(timeout=0.2) == 1
+    await asyncio.sleep(0)
+    assert finished == [0.01] and len(pool) == 0
+    # Every slot is free again
+    assert pool._slots._value == 2
+
+    fake_redis = AsyncMock()
+    fake_redis.xreadgroup.return_value = [["pr-review-stream:7", [("1-0", {"pr": "user/repo#1"})]]]
+    queue = JobQueue(fake_redis, consumer=Supervisor(2, 60, consumer_prefix="host").consumer(1))
+    entries = await queue.read(["pr-review-stream:7"], count=100, own_pending=True)
+
+    assert [e.pr_field for e in entries] == ["user/repo#1"]
+    assert fake_redis.xreadgroup.call_args.args == ("review-engine", "host-w1", {"pr-review-stream:7": "0"})
+    assert fake_redis.xreadgroup.call_args.kwargs["block"] is None
+
+    from services.review_engine.worker import drain_deadlines
+
+    drain_timeout, kill_after = drain_deadlines(330)
+    assert drain_timeout < kill_after < 330
+
+
+@pytest.mark.asyncio
+async def test_legacy_history_lists_are_imported_through_record_review():
+    """
+    Reviews left in the old history lists should be recorded oldest first, with summaries, and the lists dropped.
+    """
+    import json
+    from unittest.mock import AsyncMock, MagicMock
+    from services.review_engine import history
+
+    entries = [
+        {"repo": "octo/repo", "pr_number": 7, "comments": [{"body": "a"}]},
+        "not json",
+        {"repo": "octo/repo", "pr_number": 8, "comments": [], "installation_id": 42},
+    ]
+
+    async def scan_iter(match):
+        yield {"pr-review-history:*": "pr-review-history:42", "pr-review-history-importing:*": "pr-review-history-importing:42"}[match]
+
+    pipe = MagicMock()
+    pipe.__len__.return_value = 0
+    pipe.execute = AsyncMock()
+    redis = MagicMock()
+    redis.scan_iter = scan_iter
+    redis.rename = AsyncMock()
+    redis.lrange = AsyncMock(return_value=[e if isinstance(e, str) else json.dumps(e) for e in entries])
+    redis.pipeline.return_value = pipe
+
+    assert await history.import_legacy_history(redis) == 2
+    redis.rename.assert_awaited_once_with("pr-review-history:42", "pr-review-history-importing:42")
+    recorded = [call.args for call in pipe.eval.call_args_list]
+    assert [args[6] for args in recorded] == ["octo/repo#7", "octo/repo#8"]
+    assert json.loads(recorded[0][7])["installation_id"] == 42
+    assert recorded[0][8] < recorded[1][8]
+    assert json.loads(recorded[0][11])["comment_count"] == 1
+    pipe.delete.assert_called_once_with("pr-review-history-importing:42")
@@ -5,7 +5,7 @@ import json
 import hmac
 import hashlib
 import pytest
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 from fastapi.testclient import TestClient
 from services.webhook_listener.main import app
 
@@ -38,28 +38,84 @@ async def test_valid_signature_and_pr_event(monkeypatch):
         "repository": {"full_name": "user/repo"},
         "pull_request": {"number": 42},
         "action": "opened",
+        "installation": {"id": 7},
     }
     body_bytes = json.dumps(body).encode()
 
     signature = generate_signature("testsecret", body_bytes)
 
-    fake_redis = AsyncMock()
-    fake_redis.lpush.return_value = 1
-    fake_redis.ping.return_value = True
+    fake_pipe = MagicMock()
+    fake_pipe.execute = AsyncMock(return_value=[1, 1])
+    fake_redis = MagicMock()
+    fake_redis.pipeline.return_value = fake_pipe
 
     # Patch Redis connection to use the fake_redis mock
-    with patch("services.webhook_listener.main.from_url", AsyncMock(return_value=fake_redis)):
+    with patch("services.webhook_listener.main.get_redis_client", return_value=fake_redis):
         response = client.post(
             "/webhook",
-            headers={"x-hub-signature-256": signature},
-            json=body,
+            headers={
+                "x-hub-signature-256": signature,
+                "x-github-delivery": "delivery-1",
+                "content-type": "application/json",
+            },
+            content=body_bytes,
         )
 
     assert response.status_code == 200
     data = response.json()
     assert "enqueued" in data
     assert data["enqueued"]["pr_number"] == 42
-    fake_redis.lpush.assert_awaited_once()
+    assert data["queue"] == "pr-review-stream:7"
+    assert data["coalesced"] is False
+    fake_pipe.execute.assert_awaited_once()
+    fake_pipe.eval.assert_called_once()
+    fake_pipe.hincrby.assert_called_once_with("pr-review-stats:7", "webhooks", 1)
+    keys = fake_pipe.eval.call_args.args[2:6]
+    assert keys == (
+        "pr-review-pending:7",
+        "pr-review-stream:7",
+        "pr-review-streams",
+        "pr-review-delivery:delivery-1",
+    )
+
+
+@pytest.mark.parametrize("result, expected", [
+    (0, {"coalesced": True}),
+    (-1, {"duplicate": True}),
+])
+def test_repeated_pr_events_are_coalesced_or_deduplicated(result, expected):
+    """
+    Later events for a pending PR replace its payload; redelivered events are dropped.
+    """
+    body = {
+        "repository": {"full_name": "user/repo"},
+        "pull_request": {"number": 42},
+        "action": "synchronize",
+        "installation": {"id": 7},
+    }
+    body_bytes = json.dumps(body).encode()
+    signature = generate_signature("testsecret", body_bytes)
+
+    fake_pipe = MagicMock()
+    fake_pipe.execute = AsyncMock(return_value=[result, 1])
+    fake_redis = MagicMock()
+    fake_redis.pipeline.return_value = fake_pipe
+
+    with patch("services.webhook_listener.main.get_redis_client", return_value=fake_redis):
+        response = client.post(
+            "/webhook",
+            headers={
+                "x-hub-signature-256": signature,
+                "x-github-delivery": "delivery-1",
+                "content-type": "application/json",
+            },
+            content=body_bytes,
+        )
+
+    assert response.status_code == 200
+    data = response.json()
+    for key, value in expected.items():
+        assert data[key] == value
 
 
 def test_invalid_signature():
@@ -97,9 +153,148 @@ def test_non_pr_event(monkeypatch):
 
     response = client.post(
         "/webhook",
-        headers={"x-hub-signature-256": signature},
-        json=body,
+        headers={"x-hub-signature-256": signature, "content-type": "application/json"},
+        content=body_bytes,
     )
 
     assert response.status_code == 200
     assert response.json() == {"ignored": True}
+
+
+def test_health_reports_redis_status():
+    """
+    /health should ping Redis through the shared pool and report 503 when it is down.
+    """
+    fake_redis = AsyncMock()
+    with patch("services.webhook_listener.main.get_redis_client", return_value=fake_redis):
+        assert client.get("/health").json()["redis"] == "ok"
+
+        fake_redis.ping.side_effect = ConnectionError("refused")
+        response = client.get("/health")
+
+    assert response.status_code == 503
+    assert response.json()["status"] == "degraded"
+
+
+def test_missing_signature_is_rejected():
+    """
+    A delivery without a signature header should be a 401, not a server error.
+    """
+    response = client.post("/webhook", content=b"{}")
+
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_pr_history_reads_use_the_index():
+    """
+    History lookups should hit the review hash directly instead of scanning a list.
+    """
+    from services.webhook_listener.query_api.routes import show_pr_internal
+
+    entry = {"repo": "octo/repo", "pr_number": 7, "installation_id": 42}
+    fake_redis = AsyncMock()
+    fake_redis.eval.return_value = json.dumps(entry)
+
+    assert await show_pr_internal(fake_redis, 42, 7, repo="octo/repo") == entry
+    args = fake_redis.eval.call_args.args
+    assert args[2:] == ("pr-review-reviews:42", "pr-review-pr-repos:42", "pr-review-recent:42", "octo/repo#7", 7)
+    fake_redis.lrange.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_pr_listing_pages_summaries_with_a_cursor():
+    """
+    Listings read compact summaries and hand back a cursor that resumes after ties.
+    """
+    from services.webhook_listener.query_api.routes import list_prs_internal, decode_cursor
+
+    summary = {"repo": "octo/repo", "pr_number": 1, "status": "done", "comment_count": 3}
+    fake_redis = AsyncMock()
+    fake_redis.zrevrangebyscore.return_value = [("octo/repo#3", 20.0), ("octo/repo#2", 10.0), ("octo/repo#1", 10.0)]
+    fake_redis.hmget.return_value = [json.dumps(summary)] * 2
+
+    page = await list_prs_internal(fake_redis, 42, limit=2, fields=["pr_number", "comment_count"])
+
+    assert page["items"] == [{"pr_number": 1, "comment_count": 3}] * 2
+    assert decode_cursor(page["next_cursor"]) == (10.0, 1)
+    assert fake_redis.hmget.call_args.args[0] == "pr-review-summaries:42"
+
+    fake_redis.zrevrangebyscore.return_value = [("octo/repo#1", 10.0)]
+    fake_redis.hmget.return_value = [json.dumps(summary)]
+    page = await list_prs_internal(fake_redis, 42, limit=2, cursor=page["next_cursor"])
+
+    assert page["next_cursor"] is None
+    assert fake_redis.zrevrangebyscore.call_args.kwargs["start"] == 1
+
+
+def test_metrics_records_ingest_latency_by_outcome():
+    """
+    Each delivery should land in the ingest histogram under its outcome.
+    """
+    body = json.dumps({"action": "opened"}).encode()
+    client.post(
+        "/webhook",
+        content=body,
+        headers={"X-Hub-Signature-256": generate_signature("testsecret", body)},
+    )
+    client.post("/webhook", content=b"{}")
+
+    text = client.get("/metrics").text
+
+    assert 'pr_webhook_ingest_seconds_count{outcome="ignored"}' in text
+    assert 'pr_webhook_ingest_seconds_count{outcome="rejected"}' in text
+
+
+@pytest.mark.asyncio
+async def test_dead_letters_are_listed_and_replayed_with_fresh_attempts():
+    """
+    Replaying a dead letter should remove it, cancel any retry and queue the job without its attempt count.
+    """
+    from services.webhook_listener.query_api.routes import list_dead_letters_internal, replay_dead_letter_internal
+
+    old = {"job": {"repo": "octo/repo", "pr_number": 7, "installation_id": 42, "attempt": 5}, "failed_at": 1}
+    new = {"job": {"repo": "octo/other", "pr_number": 7, "installation_id": 42, "attempt": 2}, "failed_at": 2}
+    pipe = MagicMock()
+    pipe.execute = AsyncMock(return_value=[1, 0, 0, 1])
+    fake_redis = MagicMock()
+    fake_redis.hvals = AsyncMock(return_value=[json.dumps(old), json.dumps(new)])
+    fake_redis.pipeline.return_value = pipe
+
+    assert [e["failed_at"] for e in await list_dead_letters_internal(fake_redis, 42)] == [2, 1]
+
+    result = await replay_dead_letter_internal(fake_redis, 42, 7)
+
+    assert result == {"status": "requeued", "pr_number": 7, "repo": "octo/other"}
+    pipe.hdel.assert_any_call("pr-review-dead-letter:42", "octo/other#7")
+    pipe.zrem.assert_called_once_with("pr-review-retry", "42:octo/other#7")
+    queued = json.loads(pipe.eval.call_args.args[7])
+    assert queued == {"repo": "octo/other", "pr_number": 7, "installation_id": 42}
+
+
+@pytest.mark.asyncio
+async def test_legacy_queue_jobs_move_onto_the_streams():
+    """
+    Jobs left in the pre-streams LPUSH lists should be queued oldest first, and the lists dropped.
+    """
+    from services.webhook_listener.jobs import drain_legacy_queues
+
+    older = {"repo": "octo/repo", "pr_number": 7, "installation_id": 42, "action": "opened"}
+    newer = {"repo": "octo/repo", "pr_number": 8, "installation_id": 42, "action": "opened"}
+
+    async def scan_iter(match):
+        assert match == "pr-review-queue:*"
+        yield "pr-review-queue:42"
+
+    pipe = MagicMock()
+    pipe.execute = AsyncMock(return_value=[1])
+    fake_redis = MagicMock()
+    fake_redis.scan_iter = scan_iter
+    fake_redis.rpop = AsyncMock(side_effect=[json.dumps(older), "not json", json.dumps(newer), None])
+    fake_redis.delete = AsyncMock()
+    fake_redis.pipeline.return_value = pipe
+
+    assert await drain_legacy_queues(fake_redis) == 2
+    queued = [json.loads(call.args[7]) for call in pipe.eval.call_args_list]
+    assert [job["pr_number"] for job in queued] == [7, 8]
+    fake_redis.delete.assert_awaited_once_with("pr-review-queue:42")